@@ -0,0 +1,752 @@
+"""
+Module that contains benchmarks for the processing, analysis and acquisition
+code. Run as a script with the names of the benchmarks to run, e.g.
+
+    python benchmarks.py blanking
+
+or with no arguments to run all of them.
+"""
+import concurrent.futures
+import contextlib
+import io
+import os
+import re
+import runpy
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import tifffile
+
+import calibration
+import compressors
+import events
+import processing
+import readers
+import segmentation
+import utils
+import writers
+
+try:
+    #only available on Unix. Peak RSS isn't reported without it.
+    import resource
+except ImportError:
+    resource = None
+
+
+def _time_call(fn, repeats: int = 3) -> float:
+    """
+    returns best wall time of repeats calls of fn in seconds.
+    """
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def _reference_blank(image, pixel_value_target, radius):
+    #original problem_2.image_process_fn loop, kept as the reference for
+    #correctness and speed.
+    pixel_coords = np.argwhere(image == pixel_value_target)
+    y_range, x_range = np.ogrid[:image.shape[0], :image.shape[1]]
+    for coord in pixel_coords:
+        y, x = coord
+        mask = (x_range - x)**2 + (y_range - y)**2 <= radius**2
+        image[mask] = 0
+        image[y][x] = pixel_value_target
+    return image
+
+
+def bench_blanking(frame_sizes: tuple[int, ...] = (512, 1024, 2048),
+                   hit_counts: tuple[int, ...] = (1, 10, 100, 1000, 10000),
+                   target: int = 700,
+                   radius: float = 15):
+    """
+    Benchmarks processing.BlankingEngine methods against the original loop
+    across frame sizes and number of target hits per frame. Every method's
+    output is checked to be pixel-identical to the original.
+
+    Parameters:
+
+    frame_sizes: tuple[int, ...]
+        Side lengths of square frames to test.
+
+    hit_counts: tuple[int, ...]
+        Number of target pixels placed in each frame.
+
+    target: int
+        Target pixel value.
+
+    radius: float
+        Blanking radius in pixels.
+    """
+    rng = np.random.default_rng(0)
+    engines = {method: processing.BlankingEngine(target, radius, method)
+               for method in ("bbox", "fft", "auto")}
+    print(f"{'size':>6} {'hits':>7} {'original':>10} {'bbox':>10} {'fft':>10} {'auto':>10}  (ms)")
+    for size in frame_sizes:
+        for hit_count in hit_counts:
+            frame = rng.integers(0, target, (size, size), dtype=np.uint16)
+            flat = rng.choice(frame.size, min(hit_count, frame.size), replace=False)
+            frame.flat[flat] = target
+            times = {}
+            #original loop is O(hits*H*W) so it's skipped where it would
+            #take minutes. bbox replicates the loop exactly, so it's used as
+            #the reference instead.
+            if hit_count*frame.size <= 2e9:
+                start = time.perf_counter()
+                expected = _reference_blank(frame.copy(), target, radius)
+                times["original"] = time.perf_counter() - start
+            else:
+                expected = engines["bbox"](frame.copy())
+            for method, engine in engines.items():
+                if not np.array_equal(engine(frame.copy()), expected):
+                    raise AssertionError(f"{method} output differs from original")
+                times[method] = _time_call(lambda: engine(frame.copy()))
+            row = [f"{times[key]*1e3:10.2f}" if key in times else f"{'-':>10}"
+                   for key in ("original", "bbox", "fft", "auto")]
+            print(f"{size:>6} {hit_count:>7} " + " ".join(row))
+
+
+def bench_region_blanking(frame_size: int = 2048, tile_size: int = 256,
+                          tile_fractions: tuple[float, ...] = (1, 0.5, 0.25, 0.1, 0.02),
+                          hit_fraction: float = 1e-4, target: int = 700,
+                          radius: float = 15):
+    """
+    Benchmarks processing.RegionProcessor blanking a noisy frame with
+    increasing fractions of its tiles as regions of interest, to show that
+    per-frame cost scales with region area.
+
+    Parameters:
+
+    frame_size: int
+        Side length of square frame.
+
+    tile_size: int
+        Side length of square tiles.
+
+    tile_fractions: tuple[float, ...]
+        Fractions of tiles processed.
+
+    hit_fraction: float
+        Fraction of pixels equal to target.
+    """
+    rng = np.random.default_rng(0)
+    frame = rng.integers(0, target, (frame_size, frame_size), dtype=np.uint16)
+    frame[rng.random(frame.shape) < hit_fraction] = target
+    tiles = processing.tile_grid(frame.shape, (tile_size, tile_size))
+    engine = processing.BlankingEngine(target, radius)
+    full_time = _time_call(lambda: engine(frame.copy()))
+    print(f"{'tiles':>7} {'area':>6} {'ms':>8} {'vs full':>8}")
+    for fraction in tile_fractions:
+        regions = [tiles[num] for num in
+                   rng.choice(len(tiles), max(int(fraction*len(tiles)), 1), replace=False)]
+        processor = processing.RegionProcessor(engine, regions)
+        seconds = _time_call(lambda: processor(frame.copy()))
+        #times include copying the frame, which is the floor for small areas
+        print(f"{len(regions):>7} {len(regions)/len(tiles):6.2f} {seconds*1e3:8.2f} "
+              f"{seconds/full_time:8.2f}")
+
+
+def bench_processing_stage(frame_size: int = 2048, num_frames: int = 40,
+                           worker_counts: tuple[int, ...] = (1, 2, 4, 8),
+                           hit_fraction: float = 1e-2, target: int = 700,
+                           radius: float = 15):
+    """
+    Benchmarks blanking frames inline against processing.ProcessingStage
+    with different numbers of worker threads, in frames per second. Frames
+    are noisy enough that blanking uses the FFT method.
+
+    Parameters:
+
+    frame_size: int
+        Side length of square frames.
+
+    num_frames: int
+        Number of frames processed per run.
+
+    worker_counts: tuple[int, ...]
+        Numbers of worker threads to test.
+
+    hit_fraction: float
+        Fraction of pixels equal to target.
+    """
+    rng = np.random.default_rng(0)
+    frame = rng.integers(0, target, (frame_size, frame_size), dtype=np.uint16)
+    frame[rng.random(frame.shape) < hit_fraction] = target
+    engine = processing.BlankingEngine(target, radius)
+
+    def process_fn(image, metadata):
+        return engine(image), metadata
+
+    def run_inline():
+        for frame_num in range(num_frames):
+            process_fn(frame.copy(), {"frame": frame_num})
+
+    print(f"{'workers':>8} {'fps':>8}")
+    print(f"{'inline':>8} {num_frames/_time_call(run_inline, 1):8.1f}")
+    for workers in worker_counts:
+        def run_stage():
+            with processing.ProcessingStage(process_fn, workers,
+                                            num_frames=num_frames) as stage:
+                results = []
+                for frame_num in range(num_frames):
+                    results.extend(stage(frame.copy(), {"frame": frame_num}) or [])
+            if [metadata["frame"] for _, metadata in results] != list(range(num_frames)):
+                raise AssertionError("results out of order")
+        print(f"{workers:>8} {num_frames/_time_call(run_stage, 1):8.1f}")
+
+
+def bench_large_frame(frame_size: int = 8192, tile_size: int = 2048,
+                      workers: int | None = None):
+    """
+    Benchmarks labeling a synthetic frame with label_page()'s full-frame
+    path against segmentation.label_large_page(), reporting time and label
+    array size of each and checking that labels are identical.
+
+    Parameters:
+
+    frame_size: int
+        Side length of square frame.
+
+    tile_size: int
+        Side length of square tiles.
+
+    workers: int | None
+        Number of threads for tiled labeling. None uses all cores.
+    """
+    rng = np.random.default_rng(0)
+    #sparse bright squares on a noisy background
+    frame = rng.integers(0, 200, (frame_size, frame_size), dtype=np.uint16)
+    for y, x in rng.integers(0, frame_size - 40, (frame_size*frame_size//4000, 2)):
+        frame[y:y + rng.integers(10, 40), x:x + rng.integers(10, 40)] = 1000
+    start = time.perf_counter()
+    full = segmentation.label(frame > segmentation.threshold_otsu(frame))
+    full_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    tiled = segmentation.label_large_page(frame, (tile_size, tile_size), workers)
+    tiled_seconds = time.perf_counter() - start
+    if not np.array_equal(full, tiled):
+        raise AssertionError("tiled labels differ from full-frame labels")
+    print(f"{full.max()} objects")
+    print(f"{'path':>6} {'seconds':>8} {'labels MB':>10} {'dtype':>7}")
+    for name, seconds, labels in (("full", full_seconds, full), ("tiled", tiled_seconds, tiled)):
+        print(f"{name:>6} {seconds:8.2f} {labels.nbytes/1e6:10.0f} {str(labels.dtype):>7}")
+
+
+def _read_stack(filename, use_reader):
+    #runs in a fresh process so that ru_maxrss is the peak of this run only.
+    #Every page is reduced so all of its data is actually read.
+    start = time.perf_counter()
+    if use_reader:
+        with readers.TiffPageReader(filename) as reader:
+            for image in reader:
+                np.add.reduce(image, axis=None)
+    else:
+        with tifffile.TiffFile(filename) as image_stack:
+            for page in image_stack.pages:
+                np.add.reduce(page.asarray(), axis=None)
+    seconds = time.perf_counter() - start
+    peak_rss = None
+    if resource:
+        #ru_maxrss is in kB on Linux
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*1024
+    return seconds, peak_rss
+
+
+def bench_page_reader(size_gb: float = 10, frame_shape: tuple[int, int] = (2048, 2048),
+                      save_dir: str | None = None):
+    """
+    Benchmarks reading a synthetic uncompressed uint16 stack with
+    TiffPage.asarray() against readers.TiffPageReader, reporting throughput
+    and peak RSS of each. Each read runs in its own process. The stack is
+    written just before reading, so reads are likely served from the page
+    cache when the stack fits in RAM.
+
+    Parameters:
+
+    size_gb: float
+        Size of the synthetic stack in GB.
+
+    frame_shape: tuple[int, int]
+        Shape of each page.
+
+    save_dir: str | None
+        Directory the stack is written to. Defaults to the temp directory.
+    """
+    page = np.random.default_rng(0).integers(0, 4096, frame_shape, dtype=np.uint16)
+    num_pages = max(int(size_gb*1e9 // page.nbytes), 1)
+    with tempfile.TemporaryDirectory(dir=save_dir) as temp_dir:
+        filename = os.path.join(temp_dir, "stack.tif")
+        with tifffile.TiffWriter(filename, bigtiff=True) as writer:
+            for _ in range(num_pages):
+                writer.write(page, contiguous=True)
+        size_mb = num_pages*page.nbytes/1e6
+        print(f"{num_pages} pages, {size_mb:.0f} MB")
+        print(f"{'reader':>10} {'MB/s':>10} {'peak RSS (MB)':>14}")
+        for name, use_reader in (("asarray", False), ("memmap", True)):
+            with concurrent.futures.ProcessPoolExecutor(1) as executor:
+                future = executor.submit(_read_stack, filename, use_reader)
+                seconds, peak_rss = future.result()
+            rss = f"{peak_rss/1e6:14.0f}" if peak_rss else f"{'-':>14}"
+            print(f"{name:>10} {size_mb/seconds:10.0f} {rss}")
+
+
+def _reference_pixel_values(image):
+    #original problem_3_test.test_pixel_values loop, kept as the reference
+    #for correctness and speed.
+    pixel_values = []
+    for y in range(image.shape[1]):
+        for x in range(image.shape[0]):
+            pixel_value = image[x][y]
+            if pixel_value > 0:
+                pixel_values.append(pixel_value)
+    return pixel_values
+
+
+def bench_pixel_statistics(frame_size: int = 1024, num_pages: int = 16):
+    """
+    Benchmarks the nonzero pixel value loop of problem_3_test against
+    calibration.pixel_histogram() on a synthetic bimodal page, checking that
+    the values are identical, and times calibration.calibrate() on a
+    synthetic stack.
+
+    Parameters:
+
+    frame_size: int
+        Side length of square pages.
+
+    num_pages: int
+        Number of pages of synthetic stack.
+    """
+    rng = np.random.default_rng(0)
+    pages = []
+    for _ in range(num_pages):
+        page = rng.normal(300, 30, (frame_size, frame_size))
+        nuclei = rng.random(page.shape) < 0.2
+        page[nuclei] = rng.normal(1500, 150, nuclei.sum())
+        pages.append(np.clip(page, 0, 4095).astype(np.uint16))
+    start = time.perf_counter()
+    pixel_values = _reference_pixel_values(pages[0])
+    loop_seconds = time.perf_counter() - start
+    counts = calibration.pixel_histogram(pages[0])
+    vectorized_seconds = _time_call(lambda: calibration.pixel_histogram(pages[0]))
+    if not np.array_equal(np.repeat(np.arange(len(counts)), counts), np.sort(pixel_values)):
+        raise AssertionError("pixel histogram differs from loop")
+    print(f"{'method':>10} {'s/page':>10} {'speedup':>8}")
+    print(f"{'loop':>10} {loop_seconds:10.3f} {1:8.0f}")
+    print(f"{'bincount':>10} {vectorized_seconds:10.4f} {loop_seconds/vectorized_seconds:8.0f}")
+    with tempfile.TemporaryDirectory() as temp_dir:
+        filename = os.path.join(temp_dir, "stack.tif")
+        with tifffile.TiffWriter(filename) as writer:
+            for page in pages:
+                writer.write(page, contiguous=False)
+        start = time.perf_counter()
+        statistics = calibration.calibrate(filename)
+        seconds = time.perf_counter() - start
+    print(f"calibrate: {seconds/num_pages:.4f} s/page, bimodal {statistics['bimodal']}, "
+          f"otsu {statistics['otsu_threshold']}, valley {statistics['valley_threshold']}")
+
+
+def _microscopy_frames(frame_shape, num_frames):
+    #dim noisy background with bright blurry nuclei, which compresses about
+    #like real fluorescence frames (pure noise frames barely compress)
+    rng = np.random.default_rng(0)
+    yy, xx = np.ogrid[:frame_shape[0], :frame_shape[1]]
+    frames = []
+    for _ in range(num_frames):
+        signal = np.full(frame_shape, 100.)
+        for y, x in rng.integers(0, frame_shape, (frame_shape[0]*frame_shape[1]//20000, 2)):
+            signal[max(y - 30, 0):y + 30, max(x - 30, 0):x + 30] += 800*np.exp(
+                -((yy[max(y - 30, 0):y + 30] - y)**2 + (xx[:, max(x - 30, 0):x + 30] - x)**2)/200)
+        frames.append(rng.poisson(signal).astype(np.uint16))
+    return frames
+
+
+def bench_compression(frame_shape: tuple[int, int] = (2048, 2048), num_frames: int = 32,
+                      codecs: tuple[str | None, ...] = (None,) + tuple(compressors.CODECS),
+                      save_dir: str | None = None):
+    """
+    Benchmarks writing synthetic fluorescence frames with writers.NDTiffWriter
+    uncompressed and with each available codec, reporting compression ratio,
+    write MB/s and read MB/s (of uncompressed data) with
+    readers.NDTiffReader and with tifffile (readers.TiffPageReader), and
+    checking frames read back are identical. Reads are likely served from the
+    page cache.
+
+    Parameters:
+
+    frame_shape: tuple[int, int]
+        Shape of each frame.
+
+    num_frames: int
+        Number of frames written.
+
+    codecs: tuple[str | None, ...]
+        Codecs in compressors.CODECS to benchmark. None is uncompressed.
+
+    save_dir: str | None
+        Directory the datasets are written to. Defaults to the temp directory.
+    """
+    frames = _microscopy_frames(frame_shape, num_frames)
+    size_mb = sum(frame.nbytes for frame in frames)/1e6
+    print(f"{num_frames} frames, {size_mb:.0f} MB, {os.cpu_count()} threads")
+    print(f"{'codec':>6} {'ratio':>6} {'write MB/s':>11} {'read MB/s':>10} {'tifffile MB/s':>14}")
+    with tempfile.TemporaryDirectory(dir=save_dir) as temp_dir:
+        for codec in codecs:
+            path = os.path.join(temp_dir, codec or "none")
+            start = time.perf_counter()
+            with writers.NDTiffWriter(path, compression=codec) as writer:
+                for time_point, frame in enumerate(frames):
+                    writer.put_image(frame, {"time": time_point})
+            write_seconds = time.perf_counter() - start
+            disk_mb = sum(os.path.getsize(os.path.join(path, name))
+                          for name in os.listdir(path))/1e6
+            with readers.NDTiffReader(path) as reader:
+                start = time.perf_counter()
+                read_frames = [np.array(image) for image in reader]
+                read_seconds = time.perf_counter() - start
+            if not all(np.array_equal(read, frame) for read, frame in zip(read_frames, frames)):
+                raise AssertionError(f"frames read back with {codec} differ")
+            tiff_name = next(name for name in os.listdir(path) if name.endswith(".tif"))
+            with readers.TiffPageReader(os.path.join(path, tiff_name)) as reader:
+                start = time.perf_counter()
+                for image in reader:
+                    np.add.reduce(image, axis=None)
+                tiff_seconds = time.perf_counter() - start
+            print(f"{codec or 'none':>6} {size_mb/disk_mb:6.2f} {size_mb/write_seconds:11.0f} "
+                  f"{size_mb/read_seconds:10.0f} {size_mb/tiff_seconds:14.0f}")
+
+
+def bench_event_generation(num_time_points: int = 20, num_z_slices: int = 50,
+                           num_channels: int = 4, grid_shape: tuple[int, int] = (5, 5)):
+    """
+    Benchmarks planning a large acquisition with pycromanager's
+    multi_d_acquisition_events against events.acquisition_events(),
+    reporting time to the first event, time to iterate all events and peak
+    Python memory (tracemalloc) of each, and checking that the events are
+    the same.
+
+    Parameters:
+
+    num_time_points: int
+        Number of time points.
+
+    num_z_slices: int
+        Number of z slices. multi_d_acquisition_events is given the z_end
+        correction problem_1_pycro needed.
+
+    num_channels: int
+        Number of channels.
+
+    grid_shape: tuple[int, int]
+        Shape of stage position grid.
+    """
+    from pycromanager import multi_d_acquisition_events
+
+    step_size = 0.1
+    channels = [f"channel_{i}" for i in range(num_channels)]
+    positions = utils.get_stage_grid_positions(grid_shape=grid_shape)
+    z_end = (num_z_slices - 1)*step_size - step_size/100
+    plans = {
+        "multi_d": lambda: iter(multi_d_acquisition_events(
+            num_time_points=num_time_points, z_start=0, z_end=z_end, z_step=step_size,
+            channel_group="Channel", channels=channels, xy_positions=positions)),
+        "lazy": lambda: events.acquisition_events(
+            num_time_points=num_time_points, z_start=0, z_step=step_size,
+            num_z_slices=num_z_slices, channel_group="Channel", channels=channels,
+            xy_positions=positions),
+    }
+    num_events = num_time_points*num_z_slices*num_channels*len(positions)
+    print(f"{num_events} events")
+    print(f"{'plan':>8} {'first event s':>14} {'all events s':>13} {'peak MB':>8}")
+    checks = {}
+    for name, plan in plans.items():
+        tracemalloc.start()
+        start = time.perf_counter()
+        plan_events = plan()
+        first = next(plan_events)
+        first_seconds = time.perf_counter() - start
+        count = 1
+        for event in plan_events:
+            count += 1
+            last = event
+        seconds = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        if count != num_events:
+            raise AssertionError(f"{name} planned {count} events, not {num_events}")
+        checks[name] = (first, last)
+        print(f"{name:>8} {first_seconds:14.3f} {seconds:13.3f} {peak/1e6:8.1f}")
+    for multi_d_event, lazy_event in zip(checks["multi_d"], checks["lazy"]):
+        if (multi_d_event["axes"] != lazy_event["axes"]
+                or not np.isclose(multi_d_event["z"], lazy_event["z"])):
+            raise AssertionError("lazy events differ from multi_d_acquisition_events")
+
+
+def bench_stage_path(speed: tuple[float, float] = (500, 2000),
+                     settle: tuple[float, float] = (0.01, 0.005)):
+    """
+    Benchmarks ordering stage positions with utils.plan_stage_path() on a
+    regular grid, an overlapping grid, a sparse subset of a grid and
+    scattered positions, reporting estimated travel time of each strategy
+    (serpentine order of the grid, nearest neighbor, nearest neighbor with
+    2-opt, and plan_stage_path() with serpentine sweeps as well) and the
+    seconds planning took. Positions are shuffled before planning, and every
+    path starts where the serpentine does.
+
+    Parameters:
+
+    speed: tuple[float, float]
+        (x, y) stage speeds in um/s.
+
+    settle: tuple[float, float]
+        (x, y) settle times in s after a move on that axis.
+    """
+    rng = np.random.default_rng(0)
+    big_grid = utils.get_stage_grid_positions(grid_shape=(100, 100))
+    position_sets = {
+        "grid": utils.get_stage_grid_positions(grid_shape=(50, 60)),
+        "overlap": utils.get_stage_grid_positions(1000, (40, 40), overlap=0.15),
+        "sparse": [big_grid[num] for num in
+                   sorted(rng.choice(len(big_grid), 2000, replace=False))],
+        "scattered": [tuple(pos) for pos in rng.uniform(-20000, 20000, (3000, 2))],
+    }
+    strategies = {
+        "nn": {"max_seconds": 0, "sweeps": False},
+        "nn_2opt": {"sweeps": False},
+        "planned": {},
+    }
+    print(f"{'positions':>10} {'count':>6} {'strategy':>10} {'travel s':>9} {'plan s':>7}")
+    for name, positions in position_sets.items():
+        serpentine_time = utils.get_travel_time(positions, speed, settle)
+        print(f"{name:>10} {len(positions):>6} {'serpentine':>10} {serpentine_time:9.1f} "
+              f"{0:7.2f}")
+        shuffled = [positions[num] for num in rng.permutation(len(positions))]
+        start = shuffled.index(positions[0])
+        for strategy, kwargs in strategies.items():
+            plan_start = time.perf_counter()
+            planned, travel_time = utils.plan_stage_path(shuffled, speed, settle, start,
+                                                         **kwargs)
+            seconds = time.perf_counter() - plan_start
+            if sorted(planned) != sorted(positions):
+                raise AssertionError(f"{strategy} didn't visit every position once")
+            print(f"{name:>10} {len(positions):>6} {strategy:>10} {travel_time:9.1f} "
+                  f"{seconds:7.2f}")
+
+
+def _reference_set_position_list(xyz_positions):
+    #original pycro.set_position_list(), with round trips for every
+    #position, kept as the reference for correctness and speed
+    import pycro
+    studio, core = pycro.studio, pycro.core
+    position_list = studio.positions().get_position_list()
+    position_list.clear_all_positions()
+    for pos in xyz_positions:
+        multi_args = [core.get_xy_stage_device(), pos[0], pos[1],
+                      core.get_focus_device(), pos[2]]
+        multi_position = pycro.new_java_object("org.micromanager.MultiStagePosition",
+                                               multi_args)
+        multi_position.set_label(str(pos))
+        position_list.add_position(multi_position)
+    studio.positions().set_position_list(position_list)
+
+
+def _run_position_list(num_positions, call_latency, work_dir):
+    #runs in a fresh process, like _run_acquisition_script()
+    os.environ["PYCRO_BACKEND"] = "sim"
+    import pycro
+    import simulation
+    simulation.settings.call_latency = call_latency
+    grid_side = int(np.ceil(np.sqrt(num_positions)))
+    xy_positions = utils.get_stage_grid_positions(grid_shape=(grid_side, grid_side))
+    xyz_positions = [(x, y, 0) for x, y in xy_positions[:num_positions]]
+    moved = list(xyz_positions)
+    moved[num_positions//2] = (0, 0, 10)
+    path = os.path.join(work_dir, "positions.pos")
+    runs = {"per_position": lambda: _reference_set_position_list(xyz_positions),
+            "file": lambda: pycro.set_position_list(xyz_positions, diff=False, path=path),
+            "diff": lambda: pycro.set_position_list(moved, path=path)}
+    results = {}
+    for name, run in runs.items():
+        with pycro.RoundTripCounter() as counter:
+            start = time.perf_counter()
+            run()
+            seconds = time.perf_counter() - start
+        expected = moved if name == "diff" else xyz_positions
+        position_list = pycro.studio._position_list._positions
+        if [(pos._x, pos._y, pos._z) for pos in position_list] != expected:
+            raise AssertionError(f"{name} set the wrong positions")
+        if [pos._label for pos in position_list] != [str(pos) for pos in expected]:
+            raise AssertionError(f"{name} set the wrong labels")
+        results[name] = (seconds, counter.count)
+    return results
+
+
+def bench_position_list(position_counts: tuple[int, ...] = (100, 1000, 10000),
+                        call_latency: float = 0.0002):
+    """
+    Benchmarks setting a position list against the simulated backend with
+    the original per-position round trips, with pycro.set_position_list()
+    loading the list from a file, and with set_position_list() sending the
+    one position that changed since, reporting seconds and round trips of
+    each and checking the positions set.
+
+    Parameters:
+
+    position_counts: tuple[int, ...]
+        Numbers of positions of the lists.
+
+    call_latency: float
+        Simulated seconds per bridge call.
+    """
+    print(f"{'positions':>9} {'method':>13} {'seconds':>9} {'round trips':>12}")
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for num_positions in position_counts:
+            with concurrent.futures.ProcessPoolExecutor(1) as executor:
+                results = executor.submit(_run_position_list, num_positions,
+                                          call_latency, temp_dir).result()
+            for name, (seconds, trips) in results.items():
+                print(f"{num_positions:>9} {name:>13} {seconds:9.3f} {trips:12}")
+
+
+def _script_path(name):
+    #scripts live next to this module, whatever the working directory is
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), name)
+
+
+#acquisition scripts benchmarked by bench_acquisition(), as name: (script,
+#simulation settings overrides, user parameter overrides)
+ACQUISITION_SCRIPTS = {
+    "script": (_script_path("problem_1_script.py"), {}, {}),
+    "script_per_frame": (_script_path("problem_1_script.py"), {"sequenceable": False}, {}),
+    "script_ndtiff": (_script_path("problem_1_script.py"), {}, {"native_ndtiff": True}),
+    "pycro": (_script_path("problem_1_pycro.py"), {}, {}),
+    "mda": (_script_path("problem_1_mda.py"), {}, {}),
+    "problem_2": (_script_path("problem_2.py"), {}, {}),
+    "problem_2_zlib": (_script_path("problem_2.py"), {}, {"compression": "zlib"}),
+}
+
+
+def _with_parameters(script, parameters, work_dir):
+    #returns path of a copy of script in work_dir with the module level
+    #assignments of user parameters replaced
+    with open(script) as file:
+        source = file.read()
+    for name, value in parameters.items():
+        source, count = re.subn(rf"^{name} = .*$", f"{name} = {value!r}", source,
+                                flags=re.MULTILINE)
+        if not count:
+            raise ValueError(f"{script} has no user parameter {name}")
+    path = os.path.join(work_dir, os.path.basename(script))
+    with open(path, "w") as file:
+        file.write(source)
+    return path
+
+
+def _run_acquisition_script(script, sim_settings, parameters, work_dir):
+    #runs in a fresh process so that pycro connects to a new simulated
+    #backend and the tracer only holds this run.
+    os.environ["PYCRO_BACKEND"] = "sim"
+    #scripts import repo modules, which os.chdir() would otherwise hide when
+    #this module was imported from the working directory
+    sys.path.insert(0, os.path.dirname(script))
+    if parameters:
+        script = _with_parameters(script, parameters, work_dir)
+    import pycro
+    import simulation
+    for name, value in sim_settings.items():
+        setattr(simulation.settings, name, value)
+    tracer = pycro.enable_tracing()
+    #problem_2 image_process_fn is traced through the blanking engine
+    processing.BlankingEngine.__call__ = tracer.wrap(processing.BlankingEngine.__call__,
+                                                     "BlankingEngine.__call__")
+    #relative save_dir of scripts ends up in work_dir
+    os.chdir(work_dir)
+    first_frame = pycro.core._frame_num
+    with pycro.RoundTripCounter() as counter, contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        runpy.run_path(script, run_name="__main__")
+        seconds = time.perf_counter() - start
+    num_images = pycro.core._frame_num - first_frame
+    return num_images, seconds, counter.per_image(num_images), tracer.summary()
+
+
+def bench_acquisition(scripts: tuple[str, ...] = tuple(ACQUISITION_SCRIPTS),
+                      call_latency: float = 0.0002,
+                      frame_shape: tuple[int, int] = (512, 512),
+                      write_to_disk: bool = True,
+                      save_dir: str | None = None):
+    """
+    Runs the problem 1 and problem 2 acquisition scripts against the
+    simulated backend (see simulation module) and reports frames per second
+    and bridge round trips per image of each, followed by per-stage latency
+    from the pycro tracer. Each script runs in its own process with its
+    working directory in a temp directory, so relative save_dir paths are
+    written there. "script_per_frame" runs problem_1_script with sequencing
+    unsupported by the simulated devices, and "script_ndtiff" runs it with
+    native_ndtiff, which writes NDTiff from Python. "problem_2_zlib" runs
+    problem_2 with frames compressed with zlib.
+
+    Parameters:
+
+    scripts: tuple[str, ...]
+        Names in ACQUISITION_SCRIPTS to run.
+
+    call_latency: float
+        Simulated seconds per bridge call.
+
+    frame_shape: tuple[int, int]
+        Simulated camera frame shape.
+
+    write_to_disk: bool
+        Whether simulated datastores write frames to disk.
+
+    save_dir: str | None
+        Directory the temp directory is created in. Defaults to the temp
+        directory.
+    """
+    results = {}
+    with tempfile.TemporaryDirectory(dir=save_dir) as temp_dir:
+        for name in scripts:
+            script, overrides, parameters = ACQUISITION_SCRIPTS[name]
+            sim_settings = {"call_latency": call_latency, "frame_shape": frame_shape,
+                            "write_to_disk": write_to_disk, **overrides}
+            work_dir = os.path.join(temp_dir, name)
+            os.makedirs(work_dir)
+            with concurrent.futures.ProcessPoolExecutor(1) as executor:
+                future = executor.submit(_run_acquisition_script, script,
+                                         sim_settings, parameters, work_dir)
+                results[name] = future.result()
+    print(f"{'script':>18} {'images':>8} {'seconds':>9} {'fps':>9} {'trips/image':>12}")
+    for name, (num_images, seconds, trips, _) in results.items():
+        print(f"{name:>18} {num_images:>8} {seconds:9.2f} {num_images/seconds:9.1f} {trips:12.1f}")
+    for name, (*_, summary) in results.items():
+        print(f"\n-- {name} per-stage latency")
+        print(summary)
+
+
+BENCHMARKS = {
+    "blanking": bench_blanking,
+    "region_blanking": bench_region_blanking,
+    "processing_stage": bench_processing_stage,
+    "large_frame": bench_large_frame,
+    "page_reader": bench_page_reader,
+    "pixel_statistics": bench_pixel_statistics,
+    "compression": bench_compression,
+    "event_generation": bench_event_generation,
+    "stage_path": bench_stage_path,
+    "position_list": bench_position_list,
+    "acquisition": bench_acquisition,
+}
+
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        print(f"== {name}")
+        BENCHMARKS[name]()
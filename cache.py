@@ -0,0 +1,87 @@
+"""
+Module that contains an on-disk cache for per-page analysis results, keyed
+by a hash of the page content and the parameters used to compute them.
+"""
+import contextlib
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+
+#bump when the segmentation code changes in a way that changes its output,
+#so that old cache entries are no longer used.
+CACHE_VERSION = 1
+
+
+class PageCache():
+    """
+    Size-bounded on-disk cache of per-page results (e.g. feature tables)
+    stored as .npy files. Entries are keyed by a hash of the page's pixel
+    data, shape and dtype together with the parameters that affect the
+    result, so only pages whose data or parameters changed are recomputed.
+
+    When the cache grows past max_bytes, evict() removes least recently used
+    entries first. Reading an entry marks it as used. Entries are written
+    atomically, so the cache can be shared by pool workers.
+
+    ## Methods:
+
+    #### key(image: np.ndarray, params: tuple) -> str
+        returns cache key of image computed with params.
+
+    #### get(key: str) -> np.ndarray | None
+        returns cached array for key, or None if it isn't cached.
+
+    #### put(key: str, array: np.ndarray)
+        stores array under key.
+
+    #### evict()
+        removes least recently used entries until cache is within max_bytes.
+    """
+    def __init__(self, cache_dir: str, max_bytes: int = 1_000_000_000):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.npy")
+
+    def key(self, image: np.ndarray, params: tuple) -> str:
+        hasher = hashlib.blake2b(digest_size=20)
+        hasher.update(repr((CACHE_VERSION, image.shape, image.dtype.str, params)).encode())
+        hasher.update(np.ascontiguousarray(image).data)
+        return hasher.hexdigest()
+
+    def get(self, key: str) -> np.ndarray | None:
+        path = self._path(key)
+        try:
+            array = np.load(path, allow_pickle=False)
+        except (FileNotFoundError, ValueError, EOFError):
+            #missing, or partially written by a crashed process
+            return None
+        #mtime is used as last use time for LRU eviction
+        os.utime(path)
+        return array
+
+    def put(self, key: str, array: np.ndarray):
+        #written to temp file and renamed so readers never see partial files
+        file, temp_path = tempfile.mkstemp(".tmp", dir=self.cache_dir)
+        with os.fdopen(file, "wb") as temp_file:
+            np.save(temp_file, array, allow_pickle=False)
+        os.replace(temp_path, self._path(key))
+
+    def evict(self):
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(".npy"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            #entry may have been removed by another process
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+            total -= size
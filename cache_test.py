@@ -0,0 +1,78 @@
+"""
+File used to test the on-disk page cache and its use by
+segmentation.get_feature_table().
+"""
+import os
+
+import numpy as np
+import tifffile
+
+import cache
+import segmentation
+from segmentation_test import synthetic_page, write_stack
+
+
+def test_hit_and_miss(tmp_path):
+    page_cache = cache.PageCache(str(tmp_path))
+    image = np.arange(64, dtype=np.uint16).reshape(8, 8)
+    key = page_cache.key(image, ("features",))
+    assert page_cache.get(key) is None
+    page_cache.put(key, np.arange(5))
+    assert np.array_equal(page_cache.get(key), np.arange(5))
+    #other pixels, shape, dtype or parameters are other entries
+    changed = image.copy()
+    changed[0, 0] += 1
+    assert page_cache.key(changed, ("features",)) != key
+    assert page_cache.key(image.reshape(4, 16), ("features",)) != key
+    assert page_cache.key(image.astype(np.uint32), ("features",)) != key
+    assert page_cache.key(image, ("eccentricity",)) != key
+    #non contiguous views hash by content
+    assert page_cache.key(np.asfortranarray(image), ("features",)) == key
+
+
+def test_partial_entry_is_a_miss(tmp_path):
+    page_cache = cache.PageCache(str(tmp_path))
+    with open(os.path.join(tmp_path, "broken.npy"), "wb") as file:
+        file.write(b"\x93NUMPY")
+    assert page_cache.get("broken") is None
+
+
+def test_lru_eviction(tmp_path):
+    page_cache = cache.PageCache(str(tmp_path))
+    entry = np.zeros(1000, np.uint8)
+    for num, key in enumerate("abcd"):
+        page_cache.put(key, entry)
+        #mtimes far enough apart to order entries on any filesystem
+        os.utime(page_cache._path(key), (num, num))
+    entry_bytes = os.path.getsize(page_cache._path("a"))
+    #"a" is used, so "b" and "c" are least recently used
+    page_cache.get("a")
+    page_cache.max_bytes = 2*entry_bytes
+    page_cache.evict()
+    assert sorted(name for name in os.listdir(tmp_path)) == ["a.npy", "d.npy"]
+
+
+def test_feature_table_cache(tmp_path, monkeypatch):
+    filename = str(tmp_path/"stack.tif")
+    write_stack(filename, 3, (128, 128))
+    page_cache = cache.PageCache(str(tmp_path/"cache"))
+    table = segmentation.get_feature_table(filename, workers=1, page_cache=page_cache)
+    assert np.array_equal(table, segmentation.get_feature_table(filename, workers=1))
+    #pages that are cached aren't segmented again
+    segmented = []
+    extract_features = segmentation.extract_features
+    monkeypatch.setattr(segmentation, "extract_features",
+                        lambda image, page_num, properties: (
+                            segmented.append(page_num),
+                            extract_features(image, page_num, properties))[1])
+    cached = segmentation.get_feature_table(filename, workers=1, page_cache=page_cache)
+    assert segmented == [] and np.array_equal(cached, table)
+    #when the file changes, only the changed page is segmented again
+    pages = [synthetic_page(page_num, (128, 128)) for page_num in range(3)]
+    pages[1] = synthetic_page(10, (128, 128))
+    with tifffile.TiffWriter(filename) as writer:
+        for page in pages:
+            writer.write(page, contiguous=False)
+    changed = segmentation.get_feature_table(filename, workers=1, page_cache=page_cache)
+    assert segmented == [1]
+    assert np.array_equal(changed, segmentation.get_feature_table(filename, workers=1))
@@ -0,0 +1,148 @@
+"""
+Module that contains vectorized pixel statistics of image stacks, used to
+check that test data looks as the segmentation in problem 3 expects (a
+background and a foreground population of pixel values) and to choose
+thresholds from the data.
+"""
+import numpy as np
+from skimage.filters import threshold_otsu
+
+import readers
+
+#Ashman's D above which the two pixel populations are considered separated.
+#Splitting a single normal population at its Otsu threshold already gives
+#about 2.7, so a dip between the modes is required as well.
+MIN_SEPARATION = 2
+#smoothed count at the valley over the smaller mode below which there is a
+#dip between the two populations
+MAX_VALLEY_RATIO = 0.5
+
+
+def pixel_histogram(image: np.ndarray, ignore_zero: bool = True) -> np.ndarray:
+    """
+    returns counts of every pixel value of integer image, indexed by value.
+    Zero pixels (e.g. blanked or padding) aren't counted if ignore_zero.
+    """
+    if image.dtype.kind not in "ub":
+        raise ValueError(f"pixel histograms need unsigned integer images, not {image.dtype}")
+    counts = np.bincount(image.ravel())
+    if ignore_zero:
+        counts[0] = 0
+    return counts
+
+
+def sample_pages(num_pages: int, sample: int | None = None, seed: int = 0) -> np.ndarray:
+    """
+    returns sorted page numbers of sample random pages of num_pages, or all
+    pages if sample is None or not less than num_pages.
+    """
+    if sample is None or sample >= num_pages:
+        return np.arange(num_pages)
+    return np.sort(np.random.default_rng(seed).choice(num_pages, sample, replace=False))
+
+
+def stack_pixel_histogram(filename: str, sample: int | None = None, seed: int = 0,
+                          ignore_zero: bool = True, axes: dict | None = None
+                          ) -> tuple[np.ndarray, np.ndarray]:
+    """
+    returns (counts, page_nums), where counts is the summed pixel_histogram()
+    of the pages page_nums of TIFF stack or NDTiff dataset (see
+    readers.open_reader() for axes). sample is the number of random pages
+    used, None uses every page.
+    """
+    counts = np.zeros(0, np.int64)
+    with readers.open_reader(filename, axes) as reader:
+        page_nums = sample_pages(len(reader), sample, seed)
+        for page_num in page_nums:
+            page_counts = pixel_histogram(reader.read(page_num), ignore_zero)
+            if len(page_counts) > len(counts):
+                counts = np.pad(counts, (0, len(page_counts) - len(counts)))
+            counts[:len(page_counts)] += page_counts
+    return counts, page_nums
+
+
+def _smooth(counts, width):
+    return np.convolve(counts, np.ones(width)/width, mode="same")
+
+
+def bimodality(counts: np.ndarray, min_separation: float = MIN_SEPARATION,
+               max_valley_ratio: float = MAX_VALLEY_RATIO) -> dict:
+    """
+    returns statistics of the two pixel populations in histogram counts
+    (indexed by pixel value), split at the Otsu threshold, and thresholds
+    chosen from them:
+
+    otsu_threshold: Otsu threshold of the histogram, the same that
+        threshold_otsu() gives for the pixels.
+
+    valley_threshold: least frequent value between the modes of the
+        populations, after smoothing the histogram over 1% of the value
+        range.
+
+    background_threshold: background mean plus 3 standard deviations.
+
+    Also returns count, mean and std of each population, the foreground
+    fraction, Ashman's D (separation of the means in units of their
+    spread), valley_ratio (smoothed count at the valley over the smaller
+    mode, low when there's a clear dip) and bimodal, which is whether
+    Ashman's D is above min_separation and valley_ratio below
+    max_valley_ratio.
+    """
+    counts = np.asarray(counts, np.int64)
+    nonzero = np.flatnonzero(counts)
+    if len(nonzero) < 2:
+        raise ValueError("histogram needs at least two distinct pixel values")
+    values = np.arange(len(counts))
+    #same split as threshold_otsu(image): values <= threshold are background
+    otsu = int(threshold_otsu(hist=(counts[nonzero[0]:nonzero[-1] + 1],
+                                    values[nonzero[0]:nonzero[-1] + 1])))
+    populations = []
+    for part in (slice(None, otsu + 1), slice(otsu + 1, None)):
+        part_counts, part_values = counts[part], values[part]
+        total = part_counts.sum()
+        mean = (part_counts*part_values).sum()/total
+        std = np.sqrt((part_counts*(part_values - mean)**2).sum()/total)
+        populations.append((int(total), float(mean), float(std)))
+    (background_count, background_mean, background_std), \
+        (foreground_count, foreground_mean, foreground_std) = populations
+    ashman_d = (np.sqrt(2)*(foreground_mean - background_mean)
+                / max(np.sqrt(background_std**2 + foreground_std**2), 1e-12))
+
+    width = max(1, (nonzero[-1] - nonzero[0])//100)
+    smoothed = _smooth(counts, width)
+    #for a single population, one mode is at the Otsu threshold and there's
+    #no valley below it
+    low = int(np.argmax(smoothed[:otsu + 1]))
+    high = otsu + 1 + int(np.argmax(smoothed[otsu + 1:]))
+    valley = low + int(np.argmin(smoothed[low:high + 1]))
+    valley_ratio = smoothed[valley]/min(smoothed[low], smoothed[high])
+    return {"otsu_threshold": otsu,
+            "valley_threshold": valley,
+            "background_threshold": background_mean + 3*background_std,
+            "background_count": background_count,
+            "background_mean": background_mean,
+            "background_std": background_std,
+            "foreground_count": foreground_count,
+            "foreground_mean": foreground_mean,
+            "foreground_std": foreground_std,
+            "foreground_fraction": foreground_count/(background_count + foreground_count),
+            "ashman_d": float(ashman_d),
+            "valley_ratio": float(valley_ratio),
+            "bimodal": bool(ashman_d > min_separation
+                            and valley_ratio < max_valley_ratio)}
+
+
+def calibrate(filename: str, sample: int | None = None, seed: int = 0,
+              min_separation: float = MIN_SEPARATION,
+              max_valley_ratio: float = MAX_VALLEY_RATIO, axes: dict | None = None
+              ) -> dict:
+    """
+    returns bimodality() statistics and thresholds of nonzero pixels of
+    sample random pages (None for all) of TIFF stack or NDTiff dataset,
+    plus the page numbers used and the histogram counts.
+    """
+    counts, page_nums = stack_pixel_histogram(filename, sample, seed, axes=axes)
+    statistics = bimodality(counts, min_separation, max_valley_ratio)
+    statistics["page_nums"] = page_nums.tolist()
+    statistics["counts"] = counts
+    return statistics
@@ -0,0 +1,140 @@
+"""
+Module that contains the lossless codecs used to compress acquisition output
+(see writers.NDTiffWriter) and read it back (see readers.NDTiffReader).
+
+Frames are split into strips of rows that are compressed independently on a
+shared thread pool (zlib and zstd release the GIL), so compression of one
+frame uses every core. Strips are stored as a standard compressed TIFF page,
+so tifffile can read the files as well.
+"""
+import concurrent.futures
+import os
+import threading
+import zlib
+
+import numpy as np
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+#strips are about this many bytes before compression
+STRIP_BYTES = 256*1024
+
+
+class Codec():
+    """
+    Lossless codec with its TIFF compression tag value.
+
+    ## Methods:
+
+    #### encode(data: bytes, level: int = None) -> bytes
+        returns data compressed at level (None uses default_level).
+
+    #### decode(data: bytes) -> bytes
+        returns decompressed data.
+    """
+    def __init__(self, name, tiff_compression, default_level, encode, decode):
+        self.name = name
+        self.tiff_compression = tiff_compression
+        self.default_level = default_level
+        self._encode = encode
+        self._decode = decode
+
+    def encode(self, data, level=None):
+        return self._encode(data, self.default_level if level is None else level)
+
+    def decode(self, data):
+        return self._decode(data)
+
+
+def _zstd_encode(data, level):
+    #compressor objects aren't thread safe, and are cheap to create
+    return zstandard.ZstdCompressor(level).compress(data)
+
+
+def _zstd_decode(data):
+    return zstandard.ZstdDecompressor().decompress(data)
+
+
+#available codecs, fastest first. zlib is always available.
+CODECS = {}
+if zstandard:
+    CODECS["zstd"] = Codec("zstd", 50000, 3, _zstd_encode, _zstd_decode)
+#level 1 is several times faster than the default 6 for a few % in size
+CODECS["zlib"] = Codec("zlib", 8, 1, zlib.compress, zlib.decompress)
+CODECS_BY_TIFF_COMPRESSION = {codec.tiff_compression: codec for codec in CODECS.values()}
+#fastest available codec
+DEFAULT_CODEC = next(iter(CODECS))
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> concurrent.futures.ThreadPoolExecutor:
+    """
+    returns thread pool shared by all compression and decompression, with
+    one thread per core. Created on first use.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = concurrent.futures.ThreadPoolExecutor(
+                os.cpu_count(), thread_name_prefix="compression")
+    return _executor
+
+
+def get_codec(name: str) -> Codec:
+    """
+    returns codec name, raising ValueError with the available codecs if it
+    isn't available.
+    """
+    if name not in CODECS:
+        raise ValueError(f"codec {name!r} isn't available, use one of {list(CODECS)}")
+    return CODECS[name]
+
+
+def get_strip_rows(shape: tuple[int, int], itemsize: int,
+                   strip_bytes: int = STRIP_BYTES) -> int:
+    """
+    returns rows per strip of frame shape, so strips are about strip_bytes.
+    """
+    return max(1, min(shape[0], strip_bytes//(shape[1]*itemsize)))
+
+
+def encode_strips(pixels: np.ndarray, codec: Codec, level: int | None = None,
+                  strip_rows: int | None = None) -> tuple[int, list[bytes]]:
+    """
+    returns (strip_rows, strips) of C contiguous 2D pixels compressed in
+    strips of strip_rows rows (None chooses with get_strip_rows()), encoded
+    in parallel on the shared thread pool.
+    """
+    strip_rows = strip_rows or get_strip_rows(pixels.shape, pixels.itemsize)
+    views = [pixels[row:row + strip_rows].data
+             for row in range(0, pixels.shape[0], strip_rows)]
+    if len(views) == 1:
+        return strip_rows, [codec.encode(views[0], level)]
+    return strip_rows, list(get_executor().map(codec.encode, views,
+                                               [level]*len(views)))
+
+
+def decode_strips(strips: list[bytes], shape: tuple[int, int], dtype: np.dtype,
+                  codec: Codec, strip_rows: int) -> np.ndarray:
+    """
+    returns frame of shape and dtype decoded from strips of strip_rows rows,
+    decoded in parallel on the shared thread pool.
+    """
+    image = np.empty(shape, dtype)
+
+    def decode(row, strip):
+        image[row:row + strip_rows] = np.frombuffer(
+            codec.decode(strip), dtype).reshape(-1, shape[1])
+
+    rows = range(0, shape[0], strip_rows)
+    if len(strips) == 1:
+        decode(0, strips[0])
+    else:
+        #list() raises any error from decoding
+        list(get_executor().map(decode, rows, strips))
+    return image
@@ -0,0 +1,36 @@
+"""
+File used to test that the compressors codecs and strip encoding round trip
+images losslessly.
+"""
+import numpy as np
+import pytest
+
+import compressors
+
+
+@pytest.mark.parametrize("codec_name", list(compressors.CODECS))
+@pytest.mark.parametrize("dtype", [np.uint8, np.uint16])
+def test_strips_round_trip(codec_name, dtype):
+    codec = compressors.get_codec(codec_name)
+    rng = np.random.default_rng(0)
+    pixels = rng.integers(0, 200, (101, 64), dtype=dtype)
+    #one strip, strips that divide the rows unevenly and one row per strip
+    for strip_rows in (None, 10, 1):
+        rows, strips = compressors.encode_strips(pixels, codec, strip_rows=strip_rows)
+        assert len(strips) == -(-pixels.shape[0]//rows)
+        decoded = compressors.decode_strips(strips, pixels.shape, dtype, codec, rows)
+        assert decoded.dtype == dtype
+        assert np.array_equal(decoded, pixels)
+
+
+def test_get_strip_rows():
+    assert compressors.get_strip_rows((2048, 2048), 2) == compressors.STRIP_BYTES//4096
+    assert compressors.get_strip_rows((10, 64), 2) == 10
+    #rows wider than a strip still get a row per strip
+    assert compressors.get_strip_rows((10, 2**20), 2) == 1
+
+
+def test_get_codec():
+    assert compressors.get_codec(compressors.DEFAULT_CODEC).name == compressors.DEFAULT_CODEC
+    with pytest.raises(ValueError):
+        compressors.get_codec("lzw")
@@ -0,0 +1,174 @@
+"""
+Module that contains a lazy acquisition event generator, used instead of
+pycromanager's multi_d_acquisition_events, which builds the whole event list
+before acquisition can start. Events are generated one at a time from
+integer indices, so memory doesn't depend on the size of the plan and
+numbers of z slices are always exact.
+"""
+import itertools
+import threading
+
+#axes of acquisition order letters, as in multi_d_acquisition_events
+ORDER_AXES = {"t": "time", "p": "position", "c": "channel", "z": "z"}
+#seconds between checks for errors and aborts while waiting for a batch
+POLL_INTERVAL_S = 0.1
+
+
+def acquisition_events(num_time_points: int | None = None, time_interval_s: float = 0,
+                       z_start: float | None = None, z_step: float | None = None,
+                       num_z_slices: int | None = None, channel_group: str | None = None,
+                       channels: list[str] | None = None,
+                       channel_exposures_ms: list[float] | None = None,
+                       xy_positions: list[tuple[float, float]] | None = None,
+                       order: str = "tpcz"):
+    """
+    Yields pycromanager acquisition events (same as multi_d_acquisition_events
+    gives) one at a time. Axes that aren't given aren't in the events.
+
+    Parameters:
+
+    num_time_points: int
+        Number of time points, min_start_time of time point t is
+        t*time_interval_s.
+
+    z_start: float
+        z position of first slice in um.
+
+    z_step: float
+        Distance between slices in um, negative to step down.
+
+    num_z_slices: int
+        Number of z slices. Slice i is at z_start + i*z_step, computed from i
+        so there's no rounding in the number of slices.
+
+    channel_group: str
+        Config group of channels. Required if channels are given.
+
+    channels: list[str]
+        Channel config names.
+
+    channel_exposures_ms: list[float]
+        Exposure of each channel. Optional.
+
+    xy_positions: list[tuple[float, float]]
+        Stage positions as (x, y), e.g. from utils.get_stage_grid_positions().
+        The position axis is the index in the list.
+
+    order: str
+        Order of axes, outermost first, as letters of "tpcz".
+    """
+    if sorted(order) != sorted(set(order)) or set(order) - set(ORDER_AXES):
+        raise ValueError(f"order must be distinct letters of 'tpcz', not {order!r}")
+    if channels is not None and channel_group is None:
+        raise ValueError("channels need a channel_group")
+    if channel_exposures_ms is not None and (channels is None
+                                             or len(channel_exposures_ms) != len(channels)):
+        raise ValueError("channel_exposures_ms needs an exposure for every channel")
+    if xy_positions is not None:
+        #positions are indexed by every event, so iterators are read once
+        xy_positions = list(xy_positions)
+    has_z = num_z_slices is not None
+    if has_z and (z_start is None or z_step is None):
+        raise ValueError("z slices need z_start and z_step")
+    sizes = {"t": num_time_points,
+             "p": None if xy_positions is None else len(xy_positions),
+             "c": None if channels is None else len(channels),
+             "z": num_z_slices}
+    #only axes that are given are iterated
+    letters = [letter for letter in order if sizes[letter] is not None]
+    #products of ranges hold one index per slice, not one per event
+    for indices in itertools.product(*(range(sizes[letter]) for letter in letters)):
+        axes = {}
+        event = {"axes": axes}
+        for letter, i in zip(letters, indices):
+            if letter == "t":
+                axes["time"] = i
+                event["min_start_time"] = i*time_interval_s
+            elif letter == "p":
+                axes["position"] = i
+                event["x"], event["y"] = xy_positions[i][:2]
+            elif letter == "c":
+                axes["channel"] = channels[i]
+                event["config_group"] = [channel_group, channels[i]]
+                if channel_exposures_ms is not None:
+                    event["exposure"] = channel_exposures_ms[i]
+            else:
+                axes["z"] = i
+                event["z"] = z_start + i*z_step
+        yield event
+
+
+def iter_event_batches(events, batch_axes: tuple[str, ...] = ("time", "position")):
+    """
+    Yields lists of consecutive events of events that have the same
+    batch_axes, e.g. the z stacks and channels of one position at one time
+    point for the default. Events in one call to Acquisition.acquire() can
+    be sequenced by the acquisition engine, so batches should hold the axes
+    that can be sequenced.
+    """
+    def key(event):
+        return tuple(event["axes"].get(axis) for axis in batch_axes)
+
+    for _, batch in itertools.groupby(events, key):
+        yield list(batch)
+
+
+def _acquisition_state(acq):
+    #returns (exception, Java acquisition) from private attributes of
+    #pycromanager 0.30.3 JavaBackendAcquisition, which has no public way to
+    #check them. Missing attributes after an upgrade fail loudly here rather
+    #than leaving errors and aborts unnoticed.
+    try:
+        return acq._exception, acq._acq
+    except AttributeError as e:
+        raise RuntimeError(f"can't check {type(acq).__name__} for errors and aborts, "
+                           "acquire_events() was written for pycromanager 0.30.3") from e
+
+
+def _await_batch(acq, future, axes):
+    #AcqNotification.Hardware.POST_HARDWARE. Waits for the batch to start
+    #rather than its images to be saved, since image_process_fn can discard
+    #images. await_execution() waits without a timeout, so it's waited for
+    #on a thread while the acquisition is checked, so that an aborted or
+    #failed acquisition doesn't leave the caller waiting forever.
+    waiter = threading.Thread(target=future.await_execution,
+                              args=(axes, "post_hardware"), daemon=True)
+    waiter.start()
+    while True:
+        waiter.join(POLL_INTERVAL_S)
+        if not waiter.is_alive():
+            return
+        exception, java_acq = _acquisition_state(acq)
+        if exception is not None:
+            raise exception
+        if java_acq is None or java_acq.are_events_finished():
+            #notification of the batch can still be on its way
+            waiter.join(POLL_INTERVAL_S)
+            if waiter.is_alive():
+                raise RuntimeError(f"acquisition stopped before events {axes} ran")
+            return
+
+
+def acquire_events(acq, events, batch_axes: tuple[str, ...] = ("time", "position"),
+                   max_pending: int = 2):
+    """
+    Submits events (e.g. from acquisition_events()) to Acquisition acq in
+    batches (see iter_event_batches()) as acquisition goes on, so
+    acquisition starts with the first batch and at most max_pending batches
+    are waiting in the acquisition's queue. Returns number of events.
+
+    Raises the acquisition's exception if it fails, and RuntimeError if it's
+    aborted, while waiting for a batch to start.
+    """
+    #(future, first event axes) of submitted batches
+    pending = []
+    num_events = 0
+    for batch in iter_event_batches(events, batch_axes):
+        if len(pending) >= max_pending:
+            _await_batch(acq, *pending.pop(0))
+        future = acq.acquire(batch)
+        num_events += len(batch)
+        #simulated acquisitions run events in acquire() and return no future
+        if future is not None:
+            pending.append((future, batch[0]["axes"]))
+    return num_events
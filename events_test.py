@@ -0,0 +1,162 @@
+"""
+File used to test the lazy acquisition event generator and batched event
+submission against a stand in Acquisition.
+"""
+import threading
+
+import pytest
+
+import events
+
+
+def test_event_order():
+    acq_events = list(events.acquisition_events(
+        num_time_points=2, time_interval_s=5, z_start=10, z_step=0.5, num_z_slices=3,
+        channel_group="Channel", channels=["DAPI", "FITC"], channel_exposures_ms=[10, 20],
+        xy_positions=[(0, 1), (2, 3)]))
+    assert len(acq_events) == 2*2*2*3
+    #time outermost and z innermost for "tpcz"
+    assert [tuple(event["axes"].values()) for event in acq_events[:7]] == [
+        (0, 0, "DAPI", 0), (0, 0, "DAPI", 1), (0, 0, "DAPI", 2),
+        (0, 0, "FITC", 0), (0, 0, "FITC", 1), (0, 0, "FITC", 2), (0, 1, "DAPI", 0)]
+    assert acq_events[-1] == {"axes": {"time": 1, "position": 1, "channel": "FITC", "z": 2},
+                              "min_start_time": 5, "x": 2, "y": 3,
+                              "config_group": ["Channel", "FITC"], "exposure": 20, "z": 11}
+    reordered = list(events.acquisition_events(
+        z_start=0, z_step=1, num_z_slices=2, channel_group="Channel",
+        channels=["DAPI", "FITC"], order="zc"))
+    assert [(event["axes"]["z"], event["axes"]["channel"]) for event in reordered] == [
+        (0, "DAPI"), (0, "FITC"), (1, "DAPI"), (1, "FITC")]
+
+
+def test_exact_slice_counts():
+    #steps that aren't exact in binary still give num_z_slices slices
+    for z_step in (0.1, -0.3, 1/3):
+        for num_z_slices in (1, 7, 1000):
+            acq_events = list(events.acquisition_events(
+                z_start=1.7, z_step=z_step, num_z_slices=num_z_slices))
+            assert len(acq_events) == num_z_slices
+            assert [event["axes"]["z"] for event in acq_events] == list(range(num_z_slices))
+            assert acq_events[-1]["z"] == pytest.approx(1.7 + (num_z_slices - 1)*z_step)
+
+
+def test_invalid_arguments():
+    with pytest.raises(ValueError):
+        list(events.acquisition_events(channels=["DAPI"]))
+    with pytest.raises(ValueError):
+        list(events.acquisition_events(num_z_slices=3, z_start=0))
+    with pytest.raises(ValueError):
+        list(events.acquisition_events(num_time_points=2, order="tt"))
+    with pytest.raises(ValueError):
+        list(events.acquisition_events(num_z_slices=2, z_start=0, z_step=1,
+                                       channel_exposures_ms=[10]))
+    with pytest.raises(ValueError):
+        list(events.acquisition_events(channel_group="Channel", channels=["DAPI"],
+                                       channel_exposures_ms=[10, 20]))
+
+
+class FakeFuture():
+    def __init__(self, axes_list):
+        self.axes_list = axes_list
+        self.started = threading.Event()
+
+    def await_execution(self, axes, phase):
+        assert axes in self.axes_list and phase == "post_hardware"
+        self.started.wait()
+
+
+class FakeEngine():
+    def __init__(self):
+        self.events_finished = False
+
+    def are_events_finished(self):
+        return self.events_finished
+
+
+class FakeAcquisition():
+    #runs batches only when run_batch() is called, like an acquisition that
+    #is still busy with earlier batches
+    def __init__(self):
+        self._exception = None
+        self._acq = FakeEngine()
+        self.futures = []
+
+    def acquire(self, batch):
+        self.futures.append(FakeFuture([event["axes"] for event in batch]))
+        return self.futures[-1]
+
+    def run_batch(self, batch_num):
+        self.futures[batch_num].started.set()
+
+
+def acquire_in_thread(acq, acq_events, **kwargs):
+    result = {}
+
+    def acquire():
+        try:
+            result["num_events"] = events.acquire_events(acq, acq_events, **kwargs)
+        except Exception as e:
+            result["error"] = e
+
+    thread = threading.Thread(target=acquire, daemon=True)
+    thread.start()
+    return thread, result
+
+
+def position_events(num_positions):
+    return events.acquisition_events(z_start=0, z_step=1, num_z_slices=3,
+                                     xy_positions=[(0, 0)]*num_positions)
+
+
+def test_acquire_events_max_pending(monkeypatch):
+    monkeypatch.setattr(events, "POLL_INTERVAL_S", 0.01)
+    acq = FakeAcquisition()
+    thread, result = acquire_in_thread(acq, position_events(4), max_pending=2)
+    thread.join(0.2)
+    #third batch waits for the first to start
+    assert len(acq.futures) == 2
+    assert [len(future.axes_list) for future in acq.futures] == [3, 3]
+    acq.run_batch(0)
+    acq.run_batch(1)
+    thread.join(5)
+    assert not thread.is_alive()
+    assert result == {"num_events": 12}
+    assert len(acq.futures) == 4
+
+
+def test_acquire_events_error(monkeypatch):
+    monkeypatch.setattr(events, "POLL_INTERVAL_S", 0.01)
+    acq = FakeAcquisition()
+    thread, result = acquire_in_thread(acq, position_events(4), max_pending=1)
+    thread.join(0.1)
+    assert thread.is_alive()
+    acq._exception = OSError("stage didn't respond")
+    thread.join(5)
+    assert not thread.is_alive()
+    assert result["error"] is acq._exception
+
+
+def test_acquire_events_abort(monkeypatch):
+    monkeypatch.setattr(events, "POLL_INTERVAL_S", 0.01)
+    acq = FakeAcquisition()
+    thread, result = acquire_in_thread(acq, position_events(4), max_pending=1)
+    thread.join(0.1)
+    assert thread.is_alive()
+    #aborted acquisitions finish their events without running the batch
+    acq._acq.events_finished = True
+    thread.join(5)
+    assert not thread.is_alive()
+    assert isinstance(result["error"], RuntimeError)
+
+
+def test_acquire_events_unknown_acquisition(monkeypatch):
+    #acquisitions without the attributes of pycromanager 0.30.3 fail instead
+    #of waiting without checking for errors
+    monkeypatch.setattr(events, "POLL_INTERVAL_S", 0.01)
+    acq = FakeAcquisition()
+    del acq._exception
+    thread, result = acquire_in_thread(acq, position_events(4), max_pending=1)
+    thread.join(5)
+    assert not thread.is_alive()
+    assert isinstance(result["error"], RuntimeError)
+    assert "0.30.3" in str(result["error"])
@@ -0,0 +1,80 @@
+"""
+Module that contains the columnar per-object feature table used by the
+analysis code. A feature table is a NumPy structured array with one row per
+segmented object and one field per feature, named the same as the columns
+of skimage.measure.regionprops_table (e.g. "area", "eccentricity",
+"centroid-0", "bbox-3") plus "page" for the page index.
+
+Tables are saved as .npy, or as Parquet/Feather if pyarrow is installed, so
+that histograms and later queries don't need to re-segment the stack.
+"""
+import os
+
+import numpy as np
+
+try:
+    import pyarrow
+    import pyarrow.feather
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+PAGE = "page"
+
+
+def from_columns(columns: dict[str, np.ndarray], dtype: np.dtype) -> np.ndarray:
+    """
+    Creates feature table of given dtype from dict of equal length columns.
+    Columns are cast to the dtype of their field.
+    """
+    num_rows = len(next(iter(columns.values()))) if columns else 0
+    table = np.empty(num_rows, dtype)
+    for name in dtype.names:
+        table[name] = columns[name]
+    return table
+
+
+def filter_area(table: np.ndarray, min_area: float, max_area: float) -> np.ndarray:
+    """
+    returns rows of table with area in [min_area, max_area].
+    """
+    area = table["area"]
+    return table[(min_area <= area) & (area <= max_area)]
+
+
+def save_table(table: np.ndarray, path: str):
+    """
+    Saves feature table to path. Format is chosen by extension: ".parquet"
+    and ".feather" require pyarrow, anything else is saved with np.save().
+    """
+    extension = os.path.splitext(path)[1]
+    if extension in (".parquet", ".feather"):
+        if pyarrow is None:
+            raise ImportError(f"pyarrow is required to save {extension} files")
+        arrow_table = pyarrow.table({name: table[name] for name in table.dtype.names})
+        if extension == ".parquet":
+            pyarrow.parquet.write_table(arrow_table, path)
+        else:
+            pyarrow.feather.write_feather(arrow_table, path)
+    else:
+        #np.save appends .npy if path doesn't already end with it
+        np.save(path, table, allow_pickle=False)
+
+
+def load_table(path: str) -> np.ndarray:
+    """
+    Loads feature table saved with save_table().
+    """
+    extension = os.path.splitext(path)[1]
+    if extension in (".parquet", ".feather"):
+        if pyarrow is None:
+            raise ImportError(f"pyarrow is required to load {extension} files")
+        if extension == ".parquet":
+            arrow_table = pyarrow.parquet.read_table(path)
+        else:
+            arrow_table = pyarrow.feather.read_table(path)
+        columns = {name: column.to_numpy()
+                   for name, column in zip(arrow_table.column_names, arrow_table.columns)}
+        dtype = np.dtype([(name, column.dtype) for name, column in columns.items()])
+        return from_columns(columns, dtype)
+    return np.load(path, allow_pickle=False)
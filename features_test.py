@@ -0,0 +1,43 @@
+"""
+File used to test feature table filtering and saving.
+"""
+import numpy as np
+import pytest
+
+import features
+import segmentation
+from segmentation_test import synthetic_page
+
+
+def make_table():
+    return np.concatenate([segmentation.extract_features(synthetic_page(seed), seed)
+                           for seed in range(2)])
+
+
+def test_filter_area():
+    table = make_table()
+    filtered = features.filter_area(table, 100, 2000)
+    assert len(filtered) > 0
+    assert np.array_equal(filtered, table[(table["area"] >= 100) & (table["area"] <= 2000)])
+    #bounds are inclusive
+    area = int(table["area"][0])
+    assert table[0] in features.filter_area(table, area, area)
+
+
+@pytest.mark.parametrize("extension", [".npy", ".parquet", ".feather"])
+def test_save_load_round_trip(tmp_path, extension):
+    if extension != ".npy":
+        pytest.importorskip("pyarrow")
+    table = make_table()
+    path = str(tmp_path/f"features{extension}")
+    features.save_table(table, path)
+    loaded = features.load_table(path)
+    assert loaded.dtype == table.dtype
+    assert np.array_equal(loaded, table)
+
+
+def test_save_empty_table(tmp_path):
+    table = np.empty(0, segmentation.feature_dtype())
+    path = str(tmp_path/"features.npy")
+    features.save_table(table, path)
+    assert features.load_table(path).dtype == table.dtype
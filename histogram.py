@@ -0,0 +1,130 @@
+"""
+Module that contains a fixed-bin streaming histogram with running moments,
+used to aggregate per-object features (e.g. nucleus eccentricity in problem
+3) page by page in constant memory. Histograms from different pages or
+workers are merged exactly.
+"""
+import json
+import os
+
+import numpy as np
+from matplotlib.figure import Figure
+
+
+class StreamingHistogram():
+    """
+    Histogram with fixed bins over value_range plus running count, mean,
+    variance, min and max of all values added. Memory doesn't depend on the
+    number of values. Values outside value_range are counted in
+    out_of_range but not binned, and still count towards the moments.
+
+    Moments are merged with Chan et al.'s parallel update, so merging per-page
+    histograms gives the same result (up to float rounding) as adding all
+    values to one histogram.
+
+    ## Methods:
+
+    #### add(values: np.ndarray)
+        adds values.
+
+    #### merge(other: StreamingHistogram)
+        adds counts and moments of other, which must have the same bins.
+
+    #### quantile(fraction: float) -> float
+        returns quantile estimated from bins (linear within a bin).
+
+    #### summary() -> dict
+        returns count, mean, std, min, max, median, p10, p90, out_of_range,
+        bin edges and counts. Statistics of an empty histogram are None.
+
+    #### save_summary(path: str)
+        saves summary() as JSON.
+
+    #### save_png(path: str, title: str, xlabel: str, ylabel: str)
+        saves plot of histogram.
+    """
+    def __init__(self, bins: int = 40, value_range: tuple[float, float] = (0, 1)):
+        self.edges = np.linspace(value_range[0], value_range[1], bins + 1)
+        self.counts = np.zeros(bins, np.int64)
+        self.out_of_range = 0
+        self.count = 0
+        self.mean = 0.
+        #sum of squared differences from mean
+        self._m2 = 0.
+        self.min = np.inf
+        self.max = -np.inf
+
+    def add(self, values):
+        values = np.asarray(values, np.float64).ravel()
+        if not values.size:
+            return
+        counts, _ = np.histogram(values, self.edges)
+        self.counts += counts
+        self.out_of_range += values.size - int(counts.sum())
+        self._merge_moments(values.size, values.mean(), ((values - values.mean())**2).sum(),
+                            values.min(), values.max())
+
+    def merge(self, other: "StreamingHistogram"):
+        if not np.array_equal(self.edges, other.edges):
+            raise ValueError("can only merge histograms with the same bins")
+        self.counts += other.counts
+        self.out_of_range += other.out_of_range
+        if other.count:
+            self._merge_moments(other.count, other.mean, other._m2, other.min, other.max)
+
+    def _merge_moments(self, count, mean, m2, minimum, maximum):
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta*count/total
+        self._m2 += m2 + delta**2*self.count*count/total
+        self.count = total
+        self.min = min(self.min, minimum)
+        self.max = max(self.max, maximum)
+
+    @property
+    def std(self) -> float:
+        return float(np.sqrt(self._m2/self.count)) if self.count else float("nan")
+
+    def quantile(self, fraction):
+        binned = self.counts.sum()
+        if not binned:
+            return float("nan")
+        cumulative = np.concatenate([[0], np.cumsum(self.counts)])
+        return float(np.interp(fraction*binned, cumulative, self.edges))
+
+    def summary(self) -> dict:
+        #statistics of an empty histogram are None, since NaN isn't valid JSON
+        def value(statistic):
+            return None if np.isnan(statistic) else float(statistic)
+
+        empty = not self.count
+        return {"count": self.count,
+                "mean": None if empty else float(self.mean),
+                "std": value(self.std),
+                "min": None if empty else float(self.min),
+                "max": None if empty else float(self.max),
+                "median": value(self.quantile(0.5)),
+                "p10": value(self.quantile(0.1)),
+                "p90": value(self.quantile(0.9)),
+                "out_of_range": self.out_of_range,
+                "edges": self.edges.tolist(),
+                "counts": self.counts.tolist()}
+
+    def save_summary(self, path):
+        #written to a temp file first so readers never see a partial file
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w") as file:
+            json.dump(self.summary(), file, indent=1, allow_nan=False)
+        os.replace(temp_path, path)
+
+    def save_png(self, path, title="", xlabel="", ylabel="Count"):
+        #Figure instead of pyplot, so no global state is touched
+        figure = Figure()
+        axes = figure.subplots()
+        axes.stairs(self.counts, self.edges, fill=True, color="orange")
+        axes.set_title(title)
+        axes.set_xlabel(xlabel)
+        axes.set_ylabel(ylabel)
+        temp_path = f"{path}.tmp.png"
+        figure.savefig(temp_path)
+        os.replace(temp_path, path)
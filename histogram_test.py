@@ -0,0 +1,58 @@
+"""
+File used to test the streaming histogram used in problem 3.
+"""
+import json
+
+import numpy as np
+import pytest
+
+import histogram
+
+
+def test_merge_matches_adding_all_values():
+    rng = np.random.default_rng(0)
+    pages = [rng.beta(5, 2, size) for size in (0, 1, 50, 1000)]
+    #out of range values count towards the moments but aren't binned
+    pages.append(np.array([-0.5, 1.5]))
+    merged = histogram.StreamingHistogram(20)
+    for page in pages:
+        page_histogram = histogram.StreamingHistogram(20)
+        page_histogram.add(page)
+        merged.merge(page_histogram)
+    values = np.concatenate(pages)
+    direct = histogram.StreamingHistogram(20)
+    direct.add(values)
+    assert merged.count == direct.count == values.size
+    assert merged.out_of_range == direct.out_of_range == 2
+    assert np.array_equal(merged.counts, direct.counts)
+    assert np.array_equal(merged.counts, np.histogram(values, 20, (0, 1))[0])
+    for hist in (merged, direct):
+        assert hist.mean == pytest.approx(values.mean())
+        assert hist.std == pytest.approx(values.std())
+        assert hist.min == values.min()
+        assert hist.max == values.max()
+
+
+def test_quantile_within_bin():
+    values = np.random.default_rng(1).random(10000)
+    hist = histogram.StreamingHistogram(100)
+    hist.add(values)
+    for fraction in (0.1, 0.5, 0.9):
+        assert abs(hist.quantile(fraction) - np.quantile(values, fraction)) <= 0.01
+
+
+def test_merge_needs_same_bins():
+    with pytest.raises(ValueError):
+        histogram.StreamingHistogram(10).merge(histogram.StreamingHistogram(20))
+
+
+def test_empty_summary_is_valid_json(tmp_path):
+    hist = histogram.StreamingHistogram(10)
+    hist.merge(histogram.StreamingHistogram(10))
+    path = tmp_path/"summary.json"
+    hist.save_summary(path)
+    with open(path) as file:
+        summary = json.load(file, parse_constant=lambda name: pytest.fail(name))
+    assert summary["count"] == 0
+    for name in ("mean", "std", "min", "max", "median", "p10", "p90"):
+        assert summary[name] is None
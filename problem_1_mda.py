@@ -13,6 +13,11 @@ step_size = 0.1
 z_start = 0
 #set to 1 for positive and -1 for negative
 z_stack_direction = 1
+#latency summary is printed and timeline is saved here as Chrome trace JSON
+trace_path = f"{save_dir}/trace.json"
+
+#MDA runs on the Java side, so only setup and the whole run are traced
+tracer = pycro.enable_tracing()
 
 #other acquisition parameters
 z_end = z_start + z_stack_direction*(z_slices - 1)*step_size
@@ -37,4 +42,7 @@ seq_builder = seq_builder \
                   .use_position_list(True) \
                   .use_slices(True)
 seq_settings = seq_builder.build()
-studio.acquisitions().run_acquisition_with_settings(seq_settings, True)
+with tracer.span("mda.run_acquisition_with_settings"):
+    studio.acquisitions().run_acquisition_with_settings(seq_settings, True)
+print(tracer.summary())
+tracer.save_chrome_trace(trace_path)
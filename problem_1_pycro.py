@@ -1,10 +1,11 @@
 """
 Problem 1 using Pycromanager Acquisition class to perform acquisition.
 """
-from pycromanager import Acquisition, multi_d_acquisition_events
-
+import events
 import pycro
+import segmentation
 import utils
+from pycro import Acquisition
 
 #user parameters
 save_dir = r"C:/cz/problem_1_pycro"
@@ -14,20 +15,36 @@ step_size = 0.1
 z_start = 0
 #set to 1 for positive and -1 for negative
 z_stack_direction = 1
+#latency summary is printed and timeline is saved here as Chrome trace JSON
+trace_path = f"{save_dir}/trace.json"
+#if set, nuclei are segmented as images arrive (same segmentation as
+#problem_3) and their features are saved here, so the dataset doesn't have
+#to be read again for analysis
+features_path = None
 
 #other acquisition parameters
-#for some reason, (z_slices - 1) takes 13 slices but (z_slices - 1) 
-#takes 11! z_end_correction is used as a correction to compensate for this.
-z_end_correction = -z_stack_direction*step_size/100
-z_end = z_start + z_stack_direction*(z_slices - 1)*step_size + z_end_correction
 xy_positions = utils.get_stage_grid_positions()
 
-with Acquisition(save_dir, "acquisition") as acq:
-    events = multi_d_acquisition_events(z_start=z_start,
-                                        z_end=z_end,
-                                        z_step=step_size,
-                                        channel_group=pycro.CHANNEL,
-                                        channels=channels,
-                                        xy_positions=xy_positions)
-    acq.acquire(events)
-    
\ No newline at end of file
+#hooks record hardware, camera and save time of every event
+tracer = pycro.enable_tracing()
+hooks = pycro.get_tracing_hooks()
+segmenter = segmentation.OnlineSegmenter(features_path) if features_path else None
+if segmenter:
+    hooks["image_process_fn"] = segmenter
+with tracer.span("acquisition"), \
+     Acquisition(save_dir, "acquisition", **hooks) as acq:
+    #events are generated and submitted as acquisition goes on, one z stack
+    #and channel sequence per position
+    acq_events = events.acquisition_events(z_start=z_start,
+                                           z_step=z_stack_direction*step_size,
+                                           num_z_slices=z_slices,
+                                           channel_group=pycro.CHANNEL,
+                                           channels=channels,
+                                           xy_positions=xy_positions)
+    events.acquire_events(acq, acq_events)
+if segmenter:
+    #lag shows whether segmentation kept up with the acquisition
+    segmenter.close()
+    print(segmenter.stats())
+print(tracer.summary())
+tracer.save_chrome_trace(trace_path)
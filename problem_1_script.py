@@ -4,10 +4,9 @@ written in this style, mainly because we require the use of other external
 hardware devices and this scripting style allows for finer control of timing 
 and hardware.
 """
-import contextlib
-
 import pycro
 import utils
+import writers
 from pycro import core
 
 #user parameters
@@ -18,34 +17,91 @@ step_size = 0.1
 z_start = 0
 #set to 1 for positive and -1 for negative
 z_stack_direction = 1
+#images are written on a background thread. When more than write_queue_size
+#images are waiting, write_policy "block" waits and "drop" discards images.
+write_queue_size = 64
+write_policy = "block"
+#use hardware sequencing of z and channel when the devices support it
+use_sequencing = True
+#write NDTiff from Python (see writers module) instead of putting images in
+#an MM datastore. Pixels then cross the bridge once, as NumPy arrays, and 
+#aren't sent back to Java to be saved.
+native_ndtiff = False
+#codec images are compressed with when native_ndtiff (see compressors.CODECS),
+#e.g. "zlib". None doesn't compress.
+compression = None
+#latency summary is printed and timeline is saved here as Chrome trace JSON
+trace_path = f"{save_dir}/trace.json"
 
 #other acquisition parameters
 z_end = z_start + z_stack_direction*(z_slices - 1)*step_size
+#z position depends on which direction stage is moving
+z_positions = [z_start + z*z_stack_direction*step_size for z in range(z_slices)]
 xy_positions = utils.get_stage_grid_positions()
+#connects and warms up the bridge now, so it isn't paid at the first position
+pycro.connect()
+#records latency of stage moves, snaps, builders and datastore writes
+tracer = pycro.enable_tracing()
+#z and channel sequences are the same for every position
+sequence = pycro.ZChannelSequence(z_positions, channels, use_sequencing)
+
+
+def close_datastore(data, pos_num):
+    #writes remaining images and raises any error from writing them
+    data.close()
+    if data.dropped:
+        print(f"position {pos_num}: dropped {data.dropped} images")
+
 
+#counts round trips over the bridge to show bridge overhead per image
+round_trip_counter = pycro.RoundTripCounter()
+round_trip_counter.start()
+previous_data = None
 for pos_num, pos in enumerate(xy_positions):
     x_pos = pos[0]
     y_pos = pos[1]
     #new datastore and metadta for each position to be consistent with
     #MM's convention of doing so.
-    data = pycro.MultipageDatastore(f"{save_dir}/pos_{pos_num}")
-    summary = pycro.SummaryMetadataBuilder().channel_list(
-        channels).z(z_slices).step(step_size).build()
+    save_path = f"{save_dir}/pos_{pos_num}"
+    if native_ndtiff:
+        data = pycro.WriteBehindDatastore(save_path, write_queue_size, write_policy,
+                                          writers.NDTiffWriter(save_path,
+                                                               compression=compression))
+        summary = writers.SummaryMetadataBuilder().channel_list(
+            channels).z(z_slices).step(step_size).build()
+    else:
+        data = pycro.WriteBehindDatastore(save_path, write_queue_size, write_policy)
+        summary = pycro.SummaryMetadataBuilder().channel_list(
+            channels).z(z_slices).step(step_size).build()
     data.set_summary_metadata(summary)
     #in our software, stage has its own module and set of api, so doesn't
     #violate abstraction layer principles.
     core.set_xy_position(x_pos, y_pos)
-    for z in range(z_slices):
-        #z position depends on which direction stage is moving
-        z_pos = z_start + z*z_stack_direction*step_size
-        core.set_position(z_pos)
-        for channel_num, channel in enumerate(channels):
-            pycro.set_channel(channel)
-            image = pycro.snap_image()
-            coords = pycro.ImageCoordsBuilder().z(z).c(channel_num).build()
-            meta = pycro.ImageMetadataBuilder(image).x(x_pos).y(y_pos).z(z_pos).build()
-            image = image.copy_with(coords, meta)
-            #supress NullPointerException on Java side. 
-            with contextlib.suppress(Exception):
-                data.put_image(image)
-    data.close()
+    if native_ndtiff:
+        #metadata is built in Python, so images are written as they arrive
+        for z, channel_num, (pixels, tags) in sequence.acquire(as_numpy=True):
+            metadata = {**tags, "XPositionUm": x_pos, "YPositionUm": y_pos,
+                        "ZPositionUm": z_positions[z]}
+            data.put_image(pixels, {"channel": channels[channel_num], "z": z}, metadata)
+    else:
+        #coords and metadata are built for the whole z/channel block at once to
+        #keep bridge calls out of the snap loop.
+        block = pycro.ImageBlockBuilder(x_pos, y_pos)
+        for z, channel_num, image in sequence.acquire():
+            block.add(image, z, channel_num, z_positions[z])
+        for image in block.build():
+            data.put_image(image)
+    mode = "sequenced" if sequence.sequenced else "per-frame"
+    print(f"position {pos_num}: {sequence.fps:.1f} fps ({mode})")
+    #previous position is closed after this position is acquired so that its
+    #writes overlap with this position's acquisition.
+    if previous_data:
+        close_datastore(previous_data, pos_num - 1)
+    previous_data = data
+if previous_data:
+    close_datastore(previous_data, len(xy_positions) - 1)
+round_trip_counter.stop()
+num_images = len(xy_positions)*z_slices*len(channels)
+print(f"bridge round trips per image: {round_trip_counter.per_image(num_images):.1f}")
+print(tracer.summary())
+tracer.save_chrome_trace(trace_path)
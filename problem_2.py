@@ -1,11 +1,14 @@
 """
 Problem 2 using pycromanager and its image_process_fn hook to process images.
 """
-import numpy as np
-from pycromanager import Acquisition, multi_d_acquisition_events
+import contextlib
 
+from pycromanager import multi_d_acquisition_events
+
+import processing
 import pycro
-from pycro import core
+import writers
+from pycro import Acquisition, core
 
 #user parameters
 save_dir = r"problem_2_output"
@@ -14,33 +17,71 @@ exposure = 10
 num_time_points = 100
 pixel_value_target = 700
 radius = 15
+#regions of interest as (y, x, height, width) in pixels. Only these parts of
+#each frame are processed, e.g. processing.tile_grid((512, 512), (128, 128))[:4]
+#for the top row of 128x128 tiles. None processes the full frame.
+regions = None
+#frames are processed in parallel on this many threads and saved in order.
+#When processing_queue_size frames are in flight, the acquisition waits.
+processing_workers = 4
+processing_queue_size = 8
+#for live monitoring: if processing can't keep up, only the newest frame is
+#processed and skipped frames aren't saved
+latest_frame_only = False
+#codec frames are compressed with (see compressors.CODECS), e.g. "zlib".
+#Compressed frames are saved from Python as NDTiff in a "problem 2_compressed"
+#folder in save_dir, on the processing threads, instead of by the 
+#Acquisition, which then has no directory and creates no dataset of its own.
+#None saves uncompressed.
+compression = None
+
+
+#sets pixels within radius of target pixels to black, and then sets target
+#pixels back to target value. Footprint is precomputed and only the bounding
+#box of each target pixel is touched (or FFT is used for very noisy frames).
+#Only regions are scanned and blanked, in place.
+blanking_engine = processing.RegionProcessor(
+    processing.BlankingEngine(pixel_value_target, radius), regions)
+
+
+if compression:
+    writer = writers.NDTiffWriter(
+        writers.unique_path(save_dir, "problem 2_compressed"),
+        writers.SummaryMetadataBuilder().channel_list(channels).t(num_time_points).build(),
+        compression=compression)
+else:
+    writer = contextlib.nullcontext()
 
 
 def image_process_fn(image, metadata):
-    #creates array of pixels coords where pixel value is equal to target value
-    pixel_coords = np.argwhere(image == pixel_value_target)
-    #grid to create mask
-    y_range, x_range = np.ogrid[:image.shape[0], :image.shape[1]]
-    for coord in pixel_coords:
-        #coords are (y,x) because ndarray
-        y, x = coord
-        #binary mask for pixels within radius of target pixel
-        mask = (x_range - x)**2 + (y_range - y)**2 <= radius**2
-        #sets pixels in image to black according to binary mask
-        image[mask] = 0
-        #set target pixel back to target value.
-        image[y][x] = pixel_value_target
+    image = blanking_engine(image)
+    if compression:
+        writer.put_image(image, metadata["Axes"], metadata)
+        #frame is already saved, so the Acquisition discards it
+        return None
     return image, metadata
 
 
 mode_prop = core.get_property(core.get_camera_device(), "Mode")
 core.set_exposure(exposure)
 core.set_property(core.get_camera_device(), "Mode", "Noise")
-with Acquisition(save_dir, 
-                 name="problem 2",
-                 image_process_fn=image_process_fn) as acq:
+processing_stage = processing.ProcessingStage(
+    image_process_fn, processing_workers, processing_queue_size,
+    mode="latest" if latest_frame_only else "ordered",
+    num_frames=num_time_points*len(channels))
+if compression:
+    #frames are all discarded by image_process_fn, so without a directory the
+    #Acquisition doesn't leave an empty "problem 2" dataset (or viewer) behind
+    acq_kwargs = {"directory": None, "show_display": False}
+else:
+    acq_kwargs = {"directory": save_dir}
+with writer, processing_stage, \
+     Acquisition(name="problem 2",
+                 image_process_fn=processing_stage,
+                 **acq_kwargs) as acq:
     events = multi_d_acquisition_events(num_time_points=num_time_points,
                                         channel_group=pycro.CHANNEL,
                                         channels=channels)
     acq.acquire(events)
 core.set_property(core.get_camera_device(), "Mode", mode_prop)
+print(processing_stage.stats())
@@ -0,0 +1,65 @@
+"""
+File used to test image processing functionality for problem 2.
+"""
+import numpy as np
+
+import processing
+
+#user parameters
+pixel_value_target = 700
+radius = 15
+
+
+def reference_image_process(image):
+    #original per-pixel loop from problem_2.image_process_fn
+    pixel_coords = np.argwhere(image == pixel_value_target)
+    y_range, x_range = np.ogrid[:image.shape[0], :image.shape[1]]
+    for y, x in pixel_coords:
+        mask = (x_range - x)**2 + (y_range - y)**2 <= radius**2
+        image[mask] = 0
+        image[y][x] = pixel_value_target
+    return image
+
+
+def test_blanking_engine():
+    rng = np.random.default_rng(0)
+    for hit_fraction in (0, 1e-4, 1e-3, 1e-2, 0.2):
+        image = rng.integers(0, 1000, (200, 300), dtype=np.uint16)
+        image[rng.random(image.shape) < hit_fraction] = pixel_value_target
+        expected = reference_image_process(image.copy())
+        for method in ("bbox", "fft", "auto"):
+            engine = processing.BlankingEngine(pixel_value_target, radius, method)
+            assert np.array_equal(engine(image.copy()), expected)
+
+
+def test_region_processor():
+    rng = np.random.default_rng(1)
+    image = rng.integers(0, 1000, (200, 300), dtype=np.uint16)
+    image[rng.random(image.shape) < 1e-3] = pixel_value_target
+    regions = processing.tile_grid(image.shape, (64, 128))[::2]
+    engine = processing.BlankingEngine(pixel_value_target, radius)
+    result = processing.RegionProcessor(engine, regions)(image.copy())
+    expected = image.copy()
+    for y, x, height, width in regions:
+        tile = expected[y:y + height, x:x + width]
+        tile[:] = reference_image_process(tile.copy())
+    assert np.array_equal(result, expected)
+
+
+def test_processing_stage():
+    rng = np.random.default_rng(2)
+    engine = processing.BlankingEngine(pixel_value_target, radius)
+    images = [rng.integers(0, 1000, (100, 100), dtype=np.uint16) for _ in range(20)]
+    expected = [reference_image_process(image.copy()) for image in images]
+
+    def process_fn(image, metadata):
+        return engine(image), metadata
+
+    with processing.ProcessingStage(process_fn, 4, num_frames=len(images)) as stage:
+        results = []
+        for frame_num, image in enumerate(images):
+            results.extend(stage(image.copy(), {"frame": frame_num}) or [])
+    assert [metadata["frame"] for _, metadata in results] == list(range(len(images)))
+    assert all(np.array_equal(image, expected_image)
+               for (image, _), expected_image in zip(results, expected))
+    assert stage.stats()["dropped"] == 0
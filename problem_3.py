@@ -1,34 +1,94 @@
 """
 Problem 3 using skimage to segment and calculate eccentriity of cells.
 """
-import tifffile
+import time
+
 import matplotlib.pyplot as plt
 
-from skimage.filters import threshold_otsu
-from skimage.measure import label, regionprops
+import cache
+import features
+import histogram
+import segmentation
+import sweep
 
 #user parameters
+#TIFF stack, or NDTiff dataset folder saved by an acquisition (e.g.
+#"problem_2_output/problem 2_1"), which is read through its index.
 filename = "Assoc_RDEng_test.tif"
+#only for NDTiff datasets: images with these axes are segmented, e.g.
+#{"channel": "DAPI"}. None segments every image.
+axes = None
 hist_save_path = "problem 3 output/nucleus_eccentricity.png"
+#per-object features of every segmented region are saved here (.npy, or
+#.parquet/.feather if pyarrow is installed).
+features_path = "problem 3 output/nucleus_features.npy"
+#per-page features are cached here by page content, so re-runs only segment
+#pages whose data or properties changed. Set to None to disable.
+cache_dir = "problem 3 output/segmentation_cache"
+cache_max_bytes = 1_000_000_000
+properties = segmentation.FEATURE_PROPERTIES
+#area range in pixels used to remove objects that are too small to be
+#cells and too large to be single cells.
+min_area = 100
+max_area = 2000
+#number of processes pages are sharded across. None uses all cores and 1
+#segments serially in this process.
+workers = None
+#number of consecutive pages sent to a worker at a time
+chunk_size = 16
+#streaming mode only aggregates an eccentricity histogram and running
+#statistics, in constant memory. The histogram and summary are rewritten
+#every update_seconds while the stack is processed, so long runs can be
+#monitored. No feature table is saved in this mode.
+streaming = False
+summary_path = "problem 3 output/nucleus_eccentricity.json"
+hist_bins = 40
+update_seconds = 10
+#sweep mode segments the stack once with every combination of the grids
+#below and saves a table of object counts and eccentricity statistics per
+#setting (features.save_table() formats), instead of the feature table.
+#Thresholds are each page's Otsu threshold plus the offset in pixel values,
+#and smoothing is the Gaussian sigma in pixels (0 doesn't smooth).
+sweep_mode = False
+sweep_path = "problem 3 output/segmentation_sweep.npy"
+sweep_threshold_offsets = (-100, -50, 0, 50, 100)
+sweep_area_bounds = ((50, 2000), (100, 2000), (100, 3000), (200, 2000))
+sweep_smoothings = (0, 1)
+
+
+def save_histogram(eccentricity_histogram):
+    eccentricity_histogram.save_png(hist_save_path, "Cell Nucleus Eccentricities",
+                                    "Ecentricity", "Nucleus Count")
+    eccentricity_histogram.save_summary(summary_path)
+
+
+#guard is required since pool workers re-import this module on Windows.
+if __name__ == "__main__" and streaming:
+    last_update = time.perf_counter()
+    #empty if no pages are segmented, e.g. axes that match no images
+    eccentricity_histogram = histogram.StreamingHistogram(hist_bins, (0, 1))
+    for page_num, eccentricity_histogram in segmentation.iter_eccentricity_histogram(
+            filename, hist_bins, (0, 1), workers, chunk_size, min_area, max_area,
+            axes):
+        if time.perf_counter() - last_update > update_seconds:
+            save_histogram(eccentricity_histogram)
+            print(f"page {page_num}: {eccentricity_histogram.count} nuclei")
+            last_update = time.perf_counter()
+    save_histogram(eccentricity_histogram)
+elif __name__ == "__main__" and sweep_mode:
+    sweep_table = sweep.sweep(filename, sweep_threshold_offsets, sweep_area_bounds,
+                              sweep_smoothings, workers, chunk_size, axes)
+    features.save_table(sweep_table, sweep_path)
+    print(sweep.format_table(sweep_table))
+elif __name__ == "__main__":
+    page_cache = cache.PageCache(cache_dir, cache_max_bytes) if cache_dir else None
+    feature_table = segmentation.get_feature_table(filename, properties, workers,
+                                                   chunk_size, page_cache, axes)
+    features.save_table(feature_table, features_path)
+    nuclei = features.filter_area(feature_table, min_area, max_area)
 
-image_stack = tifffile.TiffFile(filename)
-eccentricities = []
-for page_num, page in enumerate(image_stack.pages):
-    #labeling code adapted from this website:
-    #https://scikit-image.org/docs/stable/auto_examples/segmentation/plot_label.html
-    image = page.asarray()
-    #Image set is clearly bimodal (see testing), so otsu's seems reasonable
-    thresh = threshold_otsu(image)
-    #label image with thresholded
-    labeled = label(image > thresh)
-    for region in regionprops(labeled):
-        #use regions in area range to remove objects that are too small to be
-        #cells and too large to be single cells.
-        if 100 <= region.area <= 2000:
-            eccentricities.append(region.eccentricity)
-
-plt.hist(eccentricities, 40, color="orange")
-plt.title("Cell Nucleus Eccentricities")
-plt.xlabel("Ecentricity")
-plt.ylabel("Nucleus Count")
-plt.savefig(hist_save_path)
+    plt.hist(nuclei["eccentricity"], 40, color="orange")
+    plt.title("Cell Nucleus Eccentricities")
+    plt.xlabel("Ecentricity")
+    plt.ylabel("Nucleus Count")
+    plt.savefig(hist_save_path)
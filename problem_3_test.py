@@ -1,6 +1,7 @@
 """
 File used to test segmentation functionality for problem 3.
 """
+import numpy as np
 import tifffile
 import matplotlib.pyplot as plt
 import matplotlib.patches as mpatches
@@ -9,8 +10,13 @@ from skimage.filters import threshold_otsu
 from skimage.measure import label, regionprops
 from skimage.color import label2rgb
 
+import calibration
+
 #user parameters
 filename = "Assoc_RDEng_test.tif"
+#number of random pages pixel statistics are computed from. None uses every
+#page.
+sample_pages = 16
 
 image_stack = tifffile.TiffFile(filename)
 image = image_stack.pages[0].asarray()
@@ -39,14 +45,39 @@ def test_segmentation():
     plt.show()
 
 
-def test_pixel_values():
+def test_pixel_histogram():
+    #original per-pixel loop on a crop, kept as the reference
+    crop = image[:64, :64]
     pixel_values = []
-    for y in range(image.shape[1]):
-        for x in range(image.shape[0]):
-            pixel_value = image[x][y]
+    for y in range(crop.shape[0]):
+        for x in range(crop.shape[1]):
+            pixel_value = crop[y][x]
             if pixel_value > 0:
                 pixel_values.append(pixel_value)
+    counts = calibration.pixel_histogram(crop)
+    assert np.array_equal(np.repeat(np.arange(len(counts)), counts), np.sort(pixel_values))
+
+
+def test_pixel_values():
+    #nonzero pixels of a background and a nucleus population are expected,
+    #and thresholds are chosen from their statistics
+    statistics = calibration.calibrate(filename, sample_pages)
+    thresholds = {name: statistics[name] for name in
+                  ("otsu_threshold", "valley_threshold", "background_threshold")}
+    print(f"pages {statistics['page_nums']}")
+    print({name: value for name, value in statistics.items()
+           if name not in ("counts", "page_nums")})
+    assert statistics["bimodal"]
+    assert (statistics["background_mean"] < statistics["otsu_threshold"]
+            < statistics["foreground_mean"])
+    #whole-stack Otsu threshold should be close to page 0's
+    assert abs(statistics["otsu_threshold"] - threshold_otsu(image[image > 0])) \
+        < statistics["background_std"] + statistics["foreground_std"]
 
-    plt.hist(pixel_values, bins=100)
+    counts = statistics["counts"]
+    plt.stairs(counts, np.arange(len(counts) + 1))
+    for name, value in thresholds.items():
+        plt.axvline(value, linestyle="--", label=f"{name} = {value:.0f}")
+    plt.legend()
     plt.show()
     
\ No newline at end of file
@@ -0,0 +1,388 @@
+"""
+Module that contains image processing engines used by the acquisition
+image_process_fn hooks (see problem_2).
+"""
+import collections
+import concurrent.futures
+import math
+import os
+import threading
+import time
+from collections.abc import Callable
+
+import numpy as np
+from scipy import fft
+
+
+def disk_footprint(radius: float) -> np.ndarray:
+    """
+    Creates boolean disk footprint of given radius. Footprint has shape
+    (2*R + 1, 2*R + 1) where R = floor(radius), with the center pixel at
+    (R, R). A pixel is in the footprint if dx**2 + dy**2 <= radius**2, which
+    is the same test used by the original per-pixel ogrid mask.
+
+    Parameters:
+
+    radius: float
+        Radius of disk in pixels.
+    """
+    half = max(int(math.floor(radius)), 0)
+    y_range, x_range = np.ogrid[-half:half + 1, -half:half + 1]
+    return x_range**2 + y_range**2 <= radius**2
+
+
+class BlankingEngine():
+    """
+    Sets every pixel within radius of a pixel equal to target to 0, and then
+    sets the target pixels back to target. Output is pixel-identical to
+    looping over np.argwhere(image == target) and applying a full-frame ogrid
+    mask per hit, including the sequential side effect of that loop: a target
+    pixel is blanked if a later hit (in row-major order) lies within radius
+    of it.
+
+    Two methods are available:
+
+    "bbox" - loops over hits but only touches the bounding box of the
+    precomputed disk footprint around each hit, so cost is
+    O(hits*radius**2) instead of O(hits*H*W).
+
+    "fft" - computes the blank mask and surviving targets in one pass with
+    FFT convolutions of the hit map against the disk footprint (and the
+    forward half of it). Cost is independent of the number of hits, so it
+    wins on very noisy frames.
+
+    "auto" (default) picks between the two per frame based on hit count.
+
+    ## Methods:
+
+    #### __call__(image: np.ndarray) -> np.ndarray
+        blanks image in place and returns it.
+    """
+    #bbox is used while hits*footprint area (pixels the bbox method touches)
+    #is below this many times the frame area. Found with
+    #benchmarks.bench_blanking().
+    AUTO_FFT_COST_FACTOR = 5
+
+    def __init__(self, target: int, radius: float, method: str = "auto"):
+        if method not in ("auto", "bbox", "fft"):
+            raise ValueError(f"unknown blanking method: {method}")
+        self.target = target
+        self.radius = radius
+        self.method = method
+        self.footprint = disk_footprint(radius)
+        self._half = self.footprint.shape[0] // 2
+        #kernel spectra are cached per padded frame shape
+        self._spectra = {}
+
+    def __call__(self, image: np.ndarray) -> np.ndarray:
+        hits = image == self.target
+        method = self.method
+        if method == "auto":
+            num_hits = np.count_nonzero(hits)
+            cost = num_hits*np.count_nonzero(self.footprint)
+            method = "bbox" if cost < self.AUTO_FFT_COST_FACTOR*image.size else "fft"
+        if method == "bbox":
+            self._blank_bbox(image, np.argwhere(hits))
+        else:
+            self._blank_fft(image, hits)
+        return image
+
+    def _blank_bbox(self, image, pixel_coords):
+        half = self._half
+        height, width = image.shape
+        for y, x in pixel_coords:
+            y_0, y_1 = max(y - half, 0), min(y + half + 1, height)
+            x_0, x_1 = max(x - half, 0), min(x + half + 1, width)
+            #crop footprint to part of the bounding box inside the frame
+            footprint = self.footprint[y_0 - y + half:y_1 - y + half,
+                                       x_0 - x + half:x_1 - x + half]
+            image[y_0:y_1, x_0:x_1][footprint] = 0
+            image[y, x] = self.target
+
+    def _get_spectra(self, shape):
+        if shape not in self._spectra:
+            half = self._half
+            #forward offsets are those after the center in row-major order.
+            #Kernel is flipped so that convolving counts hits at +offset.
+            forward = np.zeros_like(self.footprint)
+            forward[half, half + 1:] = self.footprint[half, half + 1:]
+            forward[half + 1:] = self.footprint[half + 1:]
+            backward = forward[::-1, ::-1]
+            disk_spectrum = fft.rfft2(self.footprint.astype(np.float64),
+                                      s=shape, workers=-1)
+            kill_spectrum = fft.rfft2(backward.astype(np.float64),
+                                      s=shape, workers=-1)
+            self._spectra[shape] = (disk_spectrum, kill_spectrum)
+        return self._spectra[shape]
+
+    def _blank_fft(self, image, hits):
+        half = self._half
+        height, width = image.shape
+        #pad to full linear convolution size so there's no wraparound
+        shape = (fft.next_fast_len(height + 2*half, True),
+                 fft.next_fast_len(width + 2*half, True))
+        disk_spectrum, kill_spectrum = self._get_spectra(shape)
+        hit_spectrum = fft.rfft2(hits.astype(np.float64), s=shape, workers=-1)
+        crop = (slice(half, half + height), slice(half, half + width))
+        #convolution values are integer counts, so 0.5 threshold is exact
+        mask = fft.irfft2(hit_spectrum*disk_spectrum, s=shape, workers=-1)
+        killed = fft.irfft2(hit_spectrum*kill_spectrum, s=shape, workers=-1)
+        mask = mask[crop] > 0.5
+        killed = killed[crop] > 0.5
+        image[mask] = 0
+        image[hits & ~killed] = self.target
+
+
+def tile_grid(frame_shape: tuple[int, int], tile_shape: tuple[int, int]
+              ) -> list[tuple[int, int, int, int]]:
+    """
+    returns regions (y, x, height, width) of tiles of tile_shape covering a
+    frame of frame_shape in row-major order. Tiles on the bottom and right
+    edges are cropped to the frame.
+    """
+    return [(y, x, min(tile_shape[0], frame_shape[0] - y), min(tile_shape[1], frame_shape[1] - x))
+            for y in range(0, frame_shape[0], tile_shape[0])
+            for x in range(0, frame_shape[1], tile_shape[1])]
+
+
+class RegionProcessor():
+    """
+    Runs an in-place processing engine (e.g. BlankingEngine) only on regions
+    of interest of each frame. Each region is passed to the engine as a view,
+    so results are written straight back into the frame with no copy, and
+    pixels outside the regions are neither compared nor changed. Cost scales
+    with region area instead of frame area.
+
+    Each region is processed as if it were the whole frame: for blanking,
+    target pixels outside a region don't blank pixels inside it, and disks
+    are cut off at its edges. Regions shouldn't overlap.
+
+    regions can be replaced at any time (e.g. with a different set of tiles
+    from tile_grid() as the objects of interest move), and the next frame
+    uses the new regions. None processes the full frame.
+
+    ## Methods:
+
+    #### __call__(image: np.ndarray) -> np.ndarray
+        processes regions of image in place and returns it.
+
+    ## Attributes:
+
+    #### regions: list[tuple[int, int, int, int]] | None
+        regions as (y, x, height, width) in pixels. Parts of regions outside
+        the frame are ignored.
+    """
+    def __init__(self, engine, regions: list[tuple[int, int, int, int]] | None = None):
+        self.engine = engine
+        self.regions = regions
+
+    def __call__(self, image: np.ndarray) -> np.ndarray:
+        #regions is read once so a replacement mid-frame doesn't mix sets
+        regions = self.regions
+        if regions is None:
+            return self.engine(image)
+        for y, x, height, width in regions:
+            view = image[max(y, 0):max(y + height, 0), max(x, 0):max(x + width, 0)]
+            if view.size:
+                self.engine(view)
+        return image
+
+
+class ProcessingStage():
+    """
+    image_process_fn for pycromanager Acquisition that fans frames out to a
+    thread pool, so processing slower than the frame interval doesn't back
+    up the acquisition. NumPy (and scipy.fft) release the GIL, so frames are
+    processed in parallel. process_fn(image, metadata) must be thread safe
+    and return what an image_process_fn would: (image, metadata), a list of
+    them, or None to discard the image.
+
+    Each call submits the frame and returns the results that are ready, as a
+    list (None if there are none), which pycromanager saves in order.
+
+    In "ordered" mode results are returned in frame order, even when later
+    frames finish first. When max_queue frames are in flight, policy decides
+    what happens to a new frame: "block" waits for the oldest frame, which
+    pushes back on the acquisition, and "drop" discards the new frame.
+
+    In "latest" mode (for live monitoring) at most one frame per worker is 
+    processed at a time and only the newest waiting frame is kept, so
+    results are always recent. Replaced frames are dropped.
+
+    pycromanager doesn't call the hook after the last image. If num_frames
+    is given, the call with the last frame waits for all frames in flight
+    and returns their results. Otherwise drain() returns them after the
+    acquisition, and they have to be saved by the caller.
+
+    ## Methods:
+
+    #### __call__(image: np.ndarray, metadata: dict) -> list | None
+        submits frame and returns list of ready results.
+
+    #### drain() -> list
+        waits for all frames in flight and returns their results.
+
+    #### stats() -> dict
+        returns counts of frames received, processed and dropped, queue
+        depth (frames in flight or waiting), max queue depth and mean
+        processing latency in ms.
+
+    #### close()
+        drains and shuts down the thread pool. Also called on context 
+        manager exit.
+    """
+    _MODES = ("ordered", "latest")
+    _POLICIES = ("block", "drop")
+
+    def __init__(self, process_fn: Callable, workers: int | None = None,
+                 max_queue: int | None = None, mode: str = "ordered",
+                 policy: str = "block", num_frames: int | None = None):
+        if mode not in self._MODES:
+            raise ValueError(f"mode must be one of {self._MODES}")
+        if policy not in self._POLICIES:
+            raise ValueError(f"policy must be one of {self._POLICIES}")
+        self._process_fn = process_fn
+        self._workers = workers or os.cpu_count()
+        self._max_queue = max_queue or 2*self._workers
+        self._mode = mode
+        self._policy = policy
+        self._num_frames = num_frames
+        self._executor = concurrent.futures.ThreadPoolExecutor(self._workers)
+        #lock guards everything below, since done callbacks run on workers.
+        #Reentrant because a callback runs right away in the thread adding it
+        #if the frame is already done.
+        self._lock = threading.RLock()
+        #ordered: futures in frame order. latest: running futures.
+        self._in_flight = collections.deque()
+        #latest mode: (frame_num, image, metadata) waiting for a worker
+        self._waiting = None
+        #latest mode: (frame_num, result) of finished frames
+        self._finished = []
+        self._last_returned = -1
+        self._received = 0
+        self._processed = 0
+        self._dropped = 0
+        self._max_depth = 0
+        self._latency_ns = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _timed_process(self, image, metadata):
+        start = time.perf_counter_ns()
+        result = self._process_fn(image, metadata)
+        with self._lock:
+            self._processed += 1
+            self._latency_ns += time.perf_counter_ns() - start
+        return result
+
+    def __call__(self, image, metadata):
+        with self._lock:
+            frame_num = self._received
+            self._received += 1
+        if self._mode == "ordered":
+            results = self._submit_ordered(image, metadata)
+        else:
+            results = self._submit_latest(frame_num, image, metadata)
+        if self._num_frames and frame_num + 1 >= self._num_frames:
+            results.extend(self.drain())
+        return results or None
+
+    def _depth(self):
+        return len(self._in_flight) + (self._waiting is not None)
+
+    #ordered mode
+    def _submit_ordered(self, image, metadata):
+        results = self._pop_ordered()
+        if len(self._in_flight) >= self._max_queue:
+            if self._policy == "drop":
+                with self._lock:
+                    self._dropped += 1
+                return results
+            concurrent.futures.wait([self._in_flight[0]])
+            results.extend(self._pop_ordered())
+        self._in_flight.append(self._executor.submit(self._timed_process, image, metadata))
+        with self._lock:
+            self._max_depth = max(self._max_depth, self._depth())
+        return results + self._pop_ordered()
+
+    def _pop_ordered(self, wait=False):
+        results = []
+        while self._in_flight and (wait or self._in_flight[0].done()):
+            results.extend(_as_result_list(self._in_flight.popleft().result()))
+        return results
+
+    #latest mode
+    def _submit_latest(self, frame_num, image, metadata):
+        with self._lock:
+            if len(self._in_flight) < self._workers:
+                self._start_latest(frame_num, image, metadata)
+            else:
+                if self._waiting:
+                    self._dropped += 1
+                self._waiting = (frame_num, image, metadata)
+            self._max_depth = max(self._max_depth, self._depth())
+            return self._pop_latest()
+
+    def _start_latest(self, frame_num, image, metadata):
+        #called with lock held
+        future = self._executor.submit(self._timed_process, image, metadata)
+        self._in_flight.append(future)
+        future.add_done_callback(lambda future: self._latest_done(frame_num, future))
+
+    def _latest_done(self, frame_num, future):
+        with self._lock:
+            self._in_flight.remove(future)
+            self._finished.append((frame_num, future))
+            waiting, self._waiting = self._waiting, None
+            if waiting:
+                self._start_latest(*waiting)
+
+    def _pop_latest(self):
+        #called with lock held. Results older than one already returned are
+        #stale, so they're dropped.
+        results = []
+        for frame_num, future in sorted(self._finished, key=lambda item: item[0]):
+            if frame_num < self._last_returned:
+                self._dropped += 1
+                continue
+            self._last_returned = frame_num
+            results.extend(_as_result_list(future.result()))
+        self._finished = []
+        return results
+
+    def drain(self) -> list:
+        if self._mode == "ordered":
+            return self._pop_ordered(wait=True)
+        while True:
+            with self._lock:
+                if not self._in_flight and not self._waiting:
+                    return self._pop_latest()
+                pending = list(self._in_flight)
+            concurrent.futures.wait(pending)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"received": self._received,
+                    "processed": self._processed,
+                    "dropped": self._dropped,
+                    "queue_depth": self._depth(),
+                    "max_queue_depth": self._max_depth,
+                    "mean_latency_ms": self._latency_ns/max(self._processed, 1)/1e6}
+
+    def close(self):
+        try:
+            self.drain()
+        finally:
+            self._executor.shutdown()
+
+
+def _as_result_list(result):
+    if result is None:
+        return []
+    if isinstance(result, list):
+        return result
+    return [result]
@@ -4,19 +4,121 @@ acquisition program I wrote for my lab, LS_Pycro_App. It holds the studio
 and core objects, some useful constants, and some classes and functions that
 help abstract the studio and core API. 
 
+The backend is chosen with the PYCRO_BACKEND environment variable: "mm" 
+(default) connects to a running Micro-Manager, and "sim" uses the in-process
+simulated studio and core from the simulation module, so acquisition code 
+can run and be benchmarked without Micro-Manager.
+
+Importing this module doesn't connect or import pycromanager. studio and 
+core connect on first use (or when connect() is called), and the connection
+is then reused for the life of the process. MULTIPAGE_TIFF and Acquisition 
+are also looked up on first use.
 """
 import contextlib
+import functools
+import json
+import os
+import queue
+import tempfile
+import threading
+import time
 from datetime import datetime
 
-import pycromanager
-from pycromanager import Studio, Core, JavaObject
+import tracing
+
+BACKEND = os.environ.get("PYCRO_BACKEND", "mm")
+if BACKEND not in ("mm", "sim"):
+    raise ValueError(f"PYCRO_BACKEND must be 'mm' or 'sim', not {BACKEND!r}")
+
+#backend objects by name ("studio" and "core"), created by _connect()
+_connections = {}
+_connect_lock = threading.Lock()
+
+
+def _connect(name):
+    #lock makes sure threads that first use studio or core at the same time 
+    #share one connection
+    if name not in _connections:
+        with _connect_lock:
+            if name not in _connections:
+                if BACKEND == "sim":
+                    import simulation
+                    #every simulated call stands in for one round trip
+                    simulation.call_hooks.append(_count_round_trip)
+                    _connections["studio"], _connections["core"] = simulation.create_backend()
+                else:
+                    import pycromanager
+                    _patch_bridge()
+                    if name == "studio":
+                        _connections[name] = pycromanager.Studio()
+                    else:
+                        _connections[name] = pycromanager.Core()
+    return _connections[name]
+
+
+class _LazyConnection():
+    """
+    Stands in for the studio or core object, which is connected on first 
+    attribute access. Attributes are looked up on the connected object every
+    time, so attributes set on it (see enable_tracing()) are used.
+    """
+    def __init__(self, name):
+        object.__setattr__(self, "_name", name)
+
+    def __getattr__(self, attr):
+        return getattr(_connect(self._name), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(_connect(self._name), attr, value)
 
-studio = Studio()
-core = Core()
+    def __repr__(self):
+        state = "connected" if self._name in _connections else "not connected"
+        return f"<pycro {self._name} ({BACKEND}, {state})>"
+
+
+studio = _LazyConnection("studio")
+core = _LazyConnection("core")
 
 #Public constants
 CHANNEL = "Channel"
-MULTIPAGE_TIFF = studio.data().get_preferred_save_mode().MULTIPAGE_TIFF
+#set_position_list() sends fewer changed positions than this one by one
+#(a few round trips each) instead of loading the whole list from a file
+MAX_DIFF_CHANGES = 64
+
+
+def __getattr__(name):
+    #MULTIPAGE_TIFF and Acquisition need the backend, so they're created on 
+    #first access and then stored as normal module attributes.
+    if name == "MULTIPAGE_TIFF":
+        value = _data_manager().get_preferred_save_mode().MULTIPAGE_TIFF
+    elif name == "Acquisition" and BACKEND == "sim":
+        import simulation
+        #simulated acquisition runs events against the simulated core
+        value = functools.partial(simulation.SimAcquisition, core=core)
+    elif name == "Acquisition":
+        import pycromanager
+        _patch_bridge()
+        value = pycromanager.Acquisition
+    else:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    globals()[name] = value
+    return value
+
+
+def connect(warm_up: bool = True):
+    """
+    Connects studio and core now instead of on first use. If warm_up is 
+    True, the managers used by this module are fetched and a core call is 
+    made, so first-call overhead on both sides of the bridge isn't paid 
+    later in the acquisition loop.
+    """
+    _connect("studio")
+    _connect("core")
+    if warm_up:
+        _data_manager()
+        _acquisition_manager()
+        _live_manager()
+        core.get_camera_device()
 
 
 #private constants
@@ -27,6 +129,29 @@ _T_AXIS = "time"
 _Z_AXIS = "z"
 _P_AXIS= "position"
 
+#RoundTripCounters that are currently counting
+_active_counters = []
+#tracing.Tracer set by enable_tracing()
+tracer = None
+
+
+#Every call on a Java object is a round trip over the bridge, including the
+#manager getters like studio.data(). Managers never change for a given
+#studio, so they're fetched once and cached.
+@functools.cache
+def _data_manager():
+    return studio.data()
+
+
+@functools.cache
+def _acquisition_manager():
+    return studio.acquisitions()
+
+
+@functools.cache
+def _live_manager():
+    return studio.live()
+
 
 class ImageCoordsBuilder():
     """
@@ -55,7 +180,7 @@ class ImageCoordsBuilder():
     """
     
     def __init__(self):
-        self._coords_builder = studio.data().coords_builder()
+        self._coords_builder = _data_manager().coords_builder()
 
     def c(self, num_c):
         self._coords_builder.c(num_c)
@@ -126,30 +251,26 @@ class SummaryMetadataBuilder():
     def __init__(self):
         #unfortunately, can't just use a python list as axis_order() takes a 
         #java iterable object. Easiest one to grab and use is ArrayList.
-        self._axis_order = JavaObject("java.util.ArrayList")
+        self._axis_order = new_java_object("java.util.ArrayList")
         #default 1 is set for each coord so that the axes appear in the 
         #metadata. If nothing or 0 are set for an axis and coords is built, 
         #it won't appear.
         self._intended_builder = ImageCoordsBuilder().c(1).z(1).t(1).p(1)
-        self._summary_builder = studio.acquisitions().generate_summary_metadata().copy_builder()
+        self._summary_builder = _acquisition_manager().generate_summary_metadata().copy_builder()
     
     def channel_list(self, channels):
         self._axis_order.add(_C_AXIS)
         
-        #unfortunately, can't just use a python list as channel_names() takes a 
-        #java iterable object. Easiest one to grab and use is ArrayList.
-        channel_array = JavaObject("java.util.ArrayList")
         if isinstance(channels, (list, tuple)):
             #Adds channel to intended builder for axis order
             self._intended_builder.c(len(channels))
-            for channel in channels:
-                channel_array.add(channel)
+            channels = tuple(channels)
         elif isinstance(channels, str):
             #if channels is str, only one channel, so intended c is 1
             self._intended_builder.c(1)
-            channel_array.add(channels)
+            channels = (channels,)
 
-        self._summary_builder.channel_names(channel_array)
+        self._summary_builder.channel_names(get_channel_array(channels))
         return self
 
     def z(self, num_z):
@@ -229,9 +350,9 @@ class ImageMetadataBuilder():
 
     def __init__(self, image=None):
         if image:
-            self._meta_builder = studio.acquisitions().generate_metadata(image, True).copy_builder_preserving_uuid()
+            self._meta_builder = _acquisition_manager().generate_metadata(image, True).copy_builder_preserving_uuid()
         else:
-            self._meta_builder = studio.data().metadata_builder()
+            self._meta_builder = _data_manager().metadata_builder()
 
     def x(self, x_pos):
         """
@@ -268,7 +389,7 @@ class MultipageDatastore():
     See: https://micro-manager.org/apidoc/mmstudio/latest/org/micromanager/data/Datastore.html
     """
     def __init__(self, save_path):
-        self._datastore = studio.data().create_multipage_tiff_datastore(save_path, True, False)
+        self._datastore = _data_manager().create_multipage_tiff_datastore(save_path, True, False)
     
     def freeze(self):
         self._datastore.freeze()
@@ -290,13 +411,449 @@ class MultipageDatastore():
             self._datastore.close()
 
 
+class WriteBehindDatastore():
+    """
+    MultipageDatastore that writes images on a background thread, so that 
+    put_image() returns immediately and disk or bridge latency doesn't stall
+    the acquisition loop. Images are written in the order they're put.
+
+    If datastore is given (e.g. a writers.NDTiffWriter), it's used instead of
+    a new MultipageDatastore, and the arguments of put_image() are passed on
+    to its put_image().
+
+    Images wait in a queue of at most max_queue images. When the queue is 
+    full, policy decides what put_image() does: "block" waits for space, and
+    "drop" discards the image and counts it in dropped.
+
+    If writing an image raises an exception, no further images are written 
+    and the exception is raised by the next call to put_image(), flush(), 
+    save() or close(). close() and save() write all queued images first.
+
+    See MultipageDatastore for the other methods.
+
+    ## Methods:
+
+    #### flush()
+        waits until all queued images are written.
+    """
+    _POLICIES = ("block", "drop")
+
+    def __init__(self, save_path, max_queue=64, policy="block", datastore=None):
+        if policy not in self._POLICIES:
+            raise ValueError(f"policy must be one of {self._POLICIES}")
+        self._datastore = datastore or MultipageDatastore(save_path)
+        self._queue = queue.Queue(max_queue)
+        self._policy = policy
+        self._error = None
+        self.dropped = 0
+        self._writer = threading.Thread(target=self._write_images, daemon=True)
+        self._writer.start()
+
+    def _write_images(self):
+        while True:
+            args = self._queue.get()
+            try:
+                #None is put by close() to stop the writer
+                if args is None:
+                    return
+                #after an error, queue is still drained so flush() returns
+                if not self._error:
+                    self._datastore.put_image(*args)
+            except Exception as e:
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _raise_error(self):
+        if self._error:
+            raise self._error
+
+    def put_image(self, *args):
+        self._raise_error()
+        if self._policy == "block":
+            self._queue.put(args)
+        else:
+            try:
+                self._queue.put_nowait(args)
+            except queue.Full:
+                self.dropped += 1
+
+    def flush(self):
+        self._queue.join()
+        self._raise_error()
+
+    def freeze(self):
+        self.flush()
+        self._datastore.freeze()
+
+    def save(self):
+        self.flush()
+        self._datastore.save()
+
+    def set_summary_metadata(self, summary_metadata):
+        self.flush()
+        self._datastore.set_summary_metadata(summary_metadata)
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self._queue.put(None)
+            self._writer.join()
+            self._datastore.close()
+
+
+class ImageBlockBuilder():
+    """
+    Batched alternative to building ImageCoordsBuilder and 
+    ImageMetadataBuilder objects for every image. Images of a z/channel block
+    (all images taken at one xy position) are added as they're snapped, and 
+    their coords and metadata are built by build().
+
+    Metadata is generated with the hardware state (same as 
+    ImageMetadataBuilder(image)) once per channel of the block, from the 
+    first image of the channel, and x and y are set on it once. Each image's
+    metadata is then a copy of its channel's template with a new UUID and 
+    only z set. Coords are taken from get_coords(), so each (z, c) coords 
+    object is only built once for the whole acquisition. For a block of 12 z
+    slices and 2 channels, add() and build() take 4.5 round trips to the 
+    Java side per image, against 11 for new ImageCoordsBuilder and 
+    ImageMetadataBuilder objects for every image (measured with 
+    RoundTripCounter in pycro_test).
+
+    ## Methods:
+
+    every method returns self (akin the builder design), except for build() 
+    which returns a list of MM Image objects with coords and metadata set.
+
+    #### add(image, z_num:int, c_num:int, z_pos:float)
+        adds image with z slice number, channel number and z_pos as 
+        z_position_um in image metadata.
+
+    #### build()
+        returns list of images added since last build() in order added, with
+        coords and metadata set (x_pos and y_pos given to constructor as 
+        x_position_um and y_position_um).
+    """
+    def __init__(self, x_pos, y_pos):
+        self._x_pos = x_pos
+        self._y_pos = y_pos
+        self._images = []
+        #metadata of the first image of each channel with x and y set
+        self._templates = {}
+
+    def add(self, image, z_num, c_num, z_pos):
+        if c_num not in self._templates:
+            metadata = _acquisition_manager().generate_metadata(image, True)
+            self._templates[c_num] = metadata.copy_builder_with_new_uuid() \
+                                             .x_position_um(self._x_pos) \
+                                             .y_position_um(self._y_pos) \
+                                             .build()
+        self._images.append((image, z_num, c_num, z_pos))
+        return self
+
+    def build(self):
+        images = []
+        for image, z_num, c_num, z_pos in self._images:
+            meta = self._templates[c_num].copy_builder_with_new_uuid() \
+                                         .z_position_um(z_pos) \
+                                         .build()
+            images.append(image.copy_with(get_coords(z=z_num, c=c_num), meta))
+        self._images = []
+        self._templates = {}
+        return images
+
+
+class ZChannelSequence():
+    """
+    Acquires a z/channel block (every channel at every z position, with 
+    channel iterated innermost) at the current xy position.
+
+    If use_sequencing is True, the focus stage supports stage sequences and
+    every property that differs between the channel configs supports 
+    property sequences (both long enough for the block), the z and channel 
+    sequences are loaded into the devices and the block is acquired as one 
+    camera sequence acquisition. The camera isn't checked, since every 
+    Micro-Manager camera can run sequence acquisitions. Images are popped from the 
+    circular buffer and converted back to MM Images, so their pixels cross 
+    the bridge twice (once with as_numpy). Otherwise it falls back to moving
+    the stage, setting the channel and snapping for every frame.
+
+    ## Methods:
+
+    #### acquire(as_numpy: bool = False)
+        returns iterator of (z_num, c_num, image) for every image of the 
+        block in acquisition order, where image is an MM Image object. After
+        iterating, fps holds the frames per second of the block. If as_numpy,
+        image is (pixels, tags) of the core's tagged image instead (see 
+        get_tagged_image()), for writing in Python (see writers module). 
+        Pixels then cross the bridge once and aren't sent back.
+
+    ## Attributes:
+
+    #### sequenced: bool
+        whether the block is acquired with hardware sequencing.
+
+    #### fps: float
+        frames per second of the last acquire().
+    """
+    #shortest seconds to wait for the camera before checking the circular
+    #buffer again. Otherwise waits one exposure.
+    _MIN_POLL_INTERVAL = 0.001
+
+    def __init__(self, z_positions, channels, use_sequencing=True):
+        self._z_positions = list(z_positions)
+        self._channels = list(channels)
+        self.fps = 0.
+        self._focus = core.get_focus_device()
+        #(device, property): values for each channel, of channel properties 
+        #that change between channels
+        self._channel_props = self._get_channel_props()
+        self.sequenced = use_sequencing and self._is_sequenceable()
+        if self.sequenced:
+            self._load_vectors()
+
+    def _get_channel_props(self):
+        values = {}
+        for channel in self._channels:
+            config = core.get_config_data(CHANNEL, channel)
+            for num in range(config.size()):
+                setting = config.get_setting(num)
+                key = (setting.get_device_label(), setting.get_property_name())
+                values.setdefault(key, []).append(setting.get_property_value())
+        return {key: prop_values for key, prop_values in values.items() 
+                if len(set(prop_values)) > 1}
+
+    def _is_sequenceable(self):
+        num_frames = len(self._z_positions)*len(self._channels)
+        if len(self._z_positions) > 1:
+            if not core.is_stage_sequenceable(self._focus):
+                return False
+            if core.get_stage_sequence_max_length(self._focus) < num_frames:
+                return False
+        for device, prop in self._channel_props:
+            if not core.is_property_sequenceable(device, prop):
+                return False
+            if core.get_property_sequence_max_length(device, prop) < num_frames:
+                return False
+        return True
+
+    def _load_vectors(self):
+        #z and channel sequences are the same for every block, so the java 
+        #vectors are only built once.
+        self._z_vector = new_java_object("mmcorej.DoubleVector")
+        self._prop_vectors = {key: new_java_object("mmcorej.StrVector") 
+                              for key in self._channel_props}
+        for z_pos in self._z_positions:
+            for c_num in range(len(self._channels)):
+                self._z_vector.add(float(z_pos))
+                for key, vector in self._prop_vectors.items():
+                    vector.add(self._channel_props[key][c_num])
+
+    def acquire(self, as_numpy=False):
+        start = time.perf_counter()
+        if self.sequenced:
+            frames = self._acquire_sequence(as_numpy)
+        else:
+            frames = self._acquire_frames(as_numpy)
+        num_frames = 0
+        for num_frames, frame in enumerate(frames, 1):
+            yield frame
+        self.fps = num_frames/(time.perf_counter() - start)
+
+    def _acquire_frames(self, as_numpy):
+        for z_num, z_pos in enumerate(self._z_positions):
+            core.set_position(z_pos)
+            for c_num, channel in enumerate(self._channels):
+                set_channel(channel)
+                if as_numpy:
+                    core.snap_image()
+                    yield z_num, c_num, get_tagged_image(core.get_tagged_image())
+                else:
+                    yield z_num, c_num, snap_image()
+
+    def _acquire_sequence(self, as_numpy):
+        num_frames = len(self._z_positions)*len(self._channels)
+        #first channel and z position set all properties that aren't sequenced
+        set_channel(self._channels[0])
+        core.set_position(self._z_positions[0])
+        sequence_z = len(self._z_positions) > 1
+        if sequence_z:
+            core.load_stage_sequence(self._focus, self._z_vector)
+            core.start_stage_sequence(self._focus)
+        for (device, prop), vector in self._prop_vectors.items():
+            core.load_property_sequence(device, prop, vector)
+            core.start_property_sequence(device, prop)
+        #every check of the buffer is a round trip, so it's checked about
+        #once per frame (one exposure until frames have arrived, then the
+        #measured frame interval), and every image in it is popped before 
+        #the next check
+        poll_interval = max(core.get_exposure()/1000, self._MIN_POLL_INTERVAL)
+        try:
+            core.start_sequence_acquisition(num_frames, 0, True)
+            start = time.perf_counter()
+            frame_num = 0
+            was_empty = False
+            while frame_num < num_frames:
+                next_poll = time.perf_counter() + poll_interval
+                num_available = core.get_remaining_image_count()
+                #checked when the buffer stays empty for a whole interval, 
+                #since the camera is then late or the sequence has stopped
+                if num_available == 0 and was_empty and not core.is_sequence_running():
+                    #last images can arrive between the two checks, so the
+                    #buffer is checked again once the sequence has stopped
+                    num_available = core.get_remaining_image_count()
+                    if num_available == 0:
+                        raise RuntimeError(f"sequence acquisition stopped after "
+                                           f"{frame_num} of {num_frames} images")
+                was_empty = num_available == 0
+                if num_available:
+                    poll_interval = max(poll_interval, 
+                                        (time.perf_counter() - start)/(frame_num + num_available))
+                for _ in range(min(num_available, num_frames - frame_num)):
+                    tagged_image = core.pop_next_tagged_image()
+                    if as_numpy:
+                        image = get_tagged_image(tagged_image)
+                    else:
+                        image = _data_manager().convert_tagged_image(tagged_image)
+                    z_num, c_num = divmod(frame_num, len(self._channels))
+                    frame_num += 1
+                    yield z_num, c_num, image
+                if frame_num < num_frames:
+                    #time spent on the yielded images counts toward the wait
+                    time.sleep(max(0, next_poll - time.perf_counter()))
+        finally:
+            if core.is_sequence_running():
+                core.stop_sequence_acquisition()
+            if sequence_z:
+                core.stop_stage_sequence(self._focus)
+            for device, prop in self._prop_vectors:
+                core.stop_property_sequence(device, prop)
+
+
+class RoundTripCounter():
+    """
+    Counts round trips to the Java side over the pycromanager bridge (on all 
+    threads) between start() and stop(), or while in use as a context 
+    manager. Used to measure bridge overhead of acquisition code.
+
+    Example:
+        with pycro.RoundTripCounter() as counter:
+            image = pycro.snap_image()
+        print(counter.count)
+
+    ## Methods:
+
+    #### start()
+        starts counting.
+
+    #### stop()
+        stops counting.
+
+    #### per_image(num_images:int)
+        returns average number of round trips per image.
+    """
+    def __init__(self):
+        self.count = 0
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def start(self):
+        _active_counters.append(self)
+
+    def stop(self):
+        _active_counters.remove(self)
+
+    def per_image(self, num_images):
+        return self.count/max(num_images, 1)
+
+
+def _count_round_trip():
+    for counter in _active_counters:
+        counter.count += 1
+
+
+def _patch_bridge():
+    #pyjavaz receives exactly one reply per message sent on its request/reply
+    #sockets, so counting their replies counts round trips. Push/pull sockets
+    #that stream images and events to and from Acquisition aren't round 
+    #trips, so they aren't counted. Patched once, before the first connection.
+    import zmq
+    from pyjavaz import bridge
+    if getattr(bridge._DataSocket.receive, "_counts_round_trips", False):
+        return
+    socket_receive = bridge._DataSocket.receive
+
+    @functools.wraps(socket_receive)
+    def counting_receive(self, *args, **kwargs):
+        if self._socket is not None and self._socket.type == zmq.REQ:
+            _count_round_trip()
+        return socket_receive(self, *args, **kwargs)
+
+    counting_receive._counts_round_trips = True
+    bridge._DataSocket.receive = counting_receive
+
+
 #misc functions
+def new_java_object(classpath: str, args: list | None = None):
+    """
+    returns new Java object of class classpath constructed with args, from 
+    the selected backend.
+    """
+    if BACKEND == "sim":
+        import simulation
+        return simulation.java_object(classpath, args)
+    import pycromanager
+    _patch_bridge()
+    return pycromanager.JavaObject(classpath, args=args)
+
+
+@functools.cache
+def get_coords(**axes):
+    """
+    returns MM Coords object with given axes (c, z, t, p) set. Coords are 
+    immutable, so each distinct set of coords is only built once over the 
+    bridge and then reused.
+    """
+    coords_builder = ImageCoordsBuilder()
+    for axis, num in axes.items():
+        getattr(coords_builder, axis)(num)
+    return coords_builder.build()
+
+
+@functools.cache
+def get_channel_array(channels: tuple[str, ...]):
+    """
+    gets channels as pycromanager JavaObject of class java.util.ArrayList,
+    which is needed where MM takes a java iterable. Cached, so the list is 
+    only created over the bridge once for each channel tuple.
+    """
+    channel_array = new_java_object("java.util.ArrayList")
+    for channel in channels:
+        channel_array.add(channel)
+    return channel_array
+
+
 def set_channel(channel: str):
     core.set_config(CHANNEL, channel)
 
 
 def snap_image():
-    return studio.live().snap(False).get(0)
+    return _live_manager().snap(False).get(0)
+
+
+def get_tagged_image(tagged_image):
+    """
+    returns (pixels, tags) of core TaggedImage, with the flat pixels 
+    reshaped to (height, width).
+    """
+    tags = tagged_image.tags
+    return tagged_image.pix.reshape(tags["Height"], tags["Width"]), tags
 
 
 def get_channel_spec_list(channels: list):
@@ -304,9 +861,9 @@ def get_channel_spec_list(channels: list):
     gets channel_spec_list as pycromanager JavaObject of class
     java.util.ArrayList to be passed in to sequence settings.
     """
-    channel_list = JavaObject("java.util.ArrayList")
+    channel_list = new_java_object("java.util.ArrayList")
     for channel in channels:
-        spec_builder = studio.acquisitions().channel_spec_builder()
+        spec_builder = _acquisition_manager().channel_spec_builder()
         spec_builder = spec_builder \
                            .channel_group(CHANNEL) \
                            .config(channel) \
@@ -315,20 +872,234 @@ def get_channel_spec_list(channels: list):
     return channel_list
 
 
-def set_position_list(xyz_positions: list[tuple[float, float, float]]):
+def _property(value_type, value, array=False):
+    #value in Micro-Manager property map JSON
+    return {"type": value_type, "array" if array else "scalar": value}
+
+
+def save_position_list(xyz_positions: list[tuple[float, float, float]], path: str,
+                       xy_stage: str, z_stage: str):
     """
-    sets the position list in Micro-Manager to positions in xyz_positions.
+    saves xyz_positions as Micro-Manager position list file (.pos, property
+    map JSON) at path, with xy_stage and z_stage as the devices. Positions
+    are labelled str(position), as set_position_list() labels them.
     """
-    position_list = studio.positions().get_position_list()
-    position_list.clear_all_positions()
+    stage_positions = []
     for pos in xyz_positions:
-        multi_args = [core.get_xy_stage_device(), 
-                      pos[0], 
-                      pos[1], 
-                      core.get_focus_device(), 
-                      pos[2]]
-        multi_position = pycromanager.JavaObject("org.micromanager.MultiStagePosition", args=multi_args)
-        multi_position.set_label(str(pos))
-        position_list.add_position(multi_position)
+        device_positions = [
+            {"Device": _property("STRING", z_stage),
+             "Position_um": _property("DOUBLE", [float(pos[2])], array=True)},
+            {"Device": _property("STRING", xy_stage),
+             "Position_um": _property("DOUBLE", [float(pos[0]), float(pos[1])], array=True)}]
+        stage_positions.append({
+            "DefaultXYStage": _property("STRING", xy_stage),
+            "DefaultZStage": _property("STRING", z_stage),
+            "DevicePositions": _property("PROPERTY_MAP", device_positions, array=True),
+            "GridCol": _property("INTEGER", 0),
+            "GridRow": _property("INTEGER", 0),
+            "Label": _property("STRING", str(pos)),
+            "Properties": _property("PROPERTY_MAP", {})})
+    property_map = {"encoding": "UTF-8",
+                    "format": "Micro-Manager Property Map",
+                    "major_version": 2,
+                    "minor_version": 0,
+                    "map": {"StagePositions": _property("PROPERTY_MAP", stage_positions,
+                                                        array=True)}}
+    #written to a temp file first so Micro-Manager never loads a partial file
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w") as file:
+        #dumps() uses the C encoder, dump() encodes in Python
+        file.write(json.dumps(property_map))
+    os.replace(temp_path, path)
+
+
+def _scalar(property_map, key):
+    return property_map.get(key, {}).get("scalar")
+
+
+def read_position_list(path: str) -> list[tuple]:
+    """
+    returns positions of Micro-Manager position list file at path as
+    (label, xy_stage, z_stage, x, y, z) tuples. Coordinates of stages that
+    a position doesn't have are None.
+    """
+    with open(path) as file:
+        stage_positions = json.load(file)["map"]["StagePositions"]["array"]
+    positions = []
+    for stage_position in stage_positions:
+        xy_stage = _scalar(stage_position, "DefaultXYStage")
+        z_stage = _scalar(stage_position, "DefaultZStage")
+        device_positions = {_scalar(device, "Device"): device["Position_um"]["array"]
+                            for device in stage_position["DevicePositions"]["array"]}
+        x_pos, y_pos = device_positions.get(xy_stage, (None, None))
+        z_pos = device_positions.get(z_stage, (None,))[0]
+        positions.append((_scalar(stage_position, "Label"), xy_stage, z_stage,
+                          x_pos, y_pos, z_pos))
+    return positions
+
+
+def _new_multi_position(pos, xy_stage, z_stage):
+    multi_position = new_java_object("org.micromanager.MultiStagePosition",
+                                     [xy_stage, pos[0], pos[1], z_stage, pos[2]])
+    multi_position.set_label(str(pos))
+    return multi_position
+
+
+@contextlib.contextmanager
+def _position_list_path(path):
+    #unique temp file if path isn't given, removed afterwards
+    if path:
+        yield os.path.abspath(path)
+        return
+    file, path = tempfile.mkstemp(suffix=".pos")
+    os.close(file)
+    try:
+        yield path
+    finally:
+        os.remove(path)
+
+
+def _diff_position_list(position_list, xyz_positions, devices, path):
+    #exports Micro-Manager's list in one call and sends the positions that
+    #differ from it. Returns whether the list is up to date, which it isn't
+    #if MAX_DIFF_CHANGES or more positions differ.
+    position_list.save(path)
+    current = read_position_list(path)
+    expected = [(str(pos), *devices, *pos) for pos in xyz_positions]
+    common = min(len(expected), len(current))
+    changed = [num for num in range(common) if expected[num] != current[num]]
+    num_changes = len(changed) + abs(len(expected) - len(current))
+    if num_changes >= MAX_DIFF_CHANGES:
+        return False
+    if not num_changes:
+        return True
+    for num in changed:
+        position_list.replace_position(num, _new_multi_position(xyz_positions[num], *devices))
+    #removed from the end, so indices of the rest don't change
+    for num in reversed(range(len(expected), len(current))):
+        position_list.remove_position(num)
+    for pos in xyz_positions[len(current):]:
+        position_list.add_position(_new_multi_position(pos, *devices))
     studio.positions().set_position_list(position_list)
-    
\ No newline at end of file
+    return True
+
+
+def set_position_list(xyz_positions: list[tuple[float, float, float]],
+                      diff: bool = True, path: str | None = None):
+    """
+    sets the position list in Micro-Manager to positions in xyz_positions.
+
+    The list is saved as a position list file (see save_position_list()) 
+    and loaded by Micro-Manager in one call, so the number of round trips 
+    doesn't depend on the number of positions. If diff, Micro-Manager's 
+    current list is exported to the file in one call first, and if fewer 
+    than MAX_DIFF_CHANGES of its positions (coordinates, stages or labels) 
+    differ, only those are sent instead.
+
+    Parameters:
+
+    xyz_positions: list[tuple[float, float, float]]
+        Stage positions as (x, y, z) in um.
+
+    diff: bool
+        Whether to only send positions that differ from Micro-Manager's list.
+
+    path: str
+        Path the position list file is saved to. Defaults to a new temp 
+        file, which is removed afterwards.
+    """
+    xyz_positions = [tuple(pos) for pos in xyz_positions]
+    devices = (core.get_xy_stage_device(), core.get_focus_device())
+    with _position_list_path(path) as path:
+        if diff:
+            position_list = studio.positions().get_position_list()
+            if _diff_position_list(position_list, xyz_positions, devices, path):
+                return
+        save_position_list(xyz_positions, path, *devices)
+        position_list = new_java_object("org.micromanager.PositionList")
+        position_list.load(path)
+        studio.positions().set_position_list(position_list)
+    
+
+#hot-path calls wrapped by enable_tracing()
+_TRACED_CORE_METHODS = ("set_xy_position", "set_position")
+_TRACED_FUNCTIONS = ("set_channel", "snap_image", "get_channel_spec_list", 
+                     "set_position_list")
+_TRACED_CLASS_METHODS = {
+    "ImageCoordsBuilder": ("__init__", "build"),
+    "SummaryMetadataBuilder": ("__init__", "build"),
+    "ImageMetadataBuilder": ("__init__", "build"),
+    "ImageBlockBuilder": ("add", "build"),
+    "MultipageDatastore": ("put_image", "close"),
+    "WriteBehindDatastore": ("put_image", "close"),
+    "ZChannelSequence": ("acquire",),
+}
+
+
+def enable_tracing(max_events: int = 1_000_000) -> tracing.Tracer:
+    """
+    Wraps stage moves, set_channel(), snap_image(), the builders and the 
+    datastore writes (see _TRACED_* constants) so that the latency of every 
+    call is recorded in the returned tracing.Tracer, which is also stored as
+    pycro.tracer. Calls made before this is called aren't traced. Calling it
+    again returns the same tracer.
+    """
+    global tracer
+    if tracer:
+        return tracer
+    tracer = tracing.Tracer(max_events)
+    for name in _TRACED_CORE_METHODS:
+        setattr(core, name, tracer.wrap(getattr(core, name), f"core.{name}"))
+    for name in _TRACED_FUNCTIONS:
+        globals()[name] = tracer.wrap(globals()[name], name)
+    for class_name, method_names in _TRACED_CLASS_METHODS.items():
+        cls = globals()[class_name]
+        for name in method_names:
+            setattr(cls, name, tracer.wrap(getattr(cls, name), f"{class_name}.{name}"))
+    return tracer
+
+
+def get_tracing_hooks() -> dict:
+    """
+    returns pycromanager Acquisition hook functions as a dict of keyword 
+    arguments, to be used as Acquisition(..., **get_tracing_hooks()). 
+    Hardware (pre to post hardware hook), camera (post hardware to post 
+    camera hook) and save (post camera hook to image saved) time of every 
+    event are recorded in the tracer from enable_tracing().
+    """
+    enable_tracing()
+    #hooks run on acquisition threads, and events go through them in order
+    times = {"pre_hardware": 0, "post_hardware": 0, "post_camera": {}}
+
+    def pre_hardware_hook_fn(event):
+        times["pre_hardware"] = time.perf_counter_ns()
+        return event
+
+    def post_hardware_hook_fn(event):
+        times["post_hardware"] = time.perf_counter_ns()
+        tracer.record("acquisition.hardware", times["pre_hardware"], 
+                      times["post_hardware"])
+        return event
+
+    def post_camera_hook_fn(event):
+        now = time.perf_counter_ns()
+        tracer.record("acquisition.camera", times["post_hardware"], now)
+        #events can be a list if sequenced
+        for axes_event in event if isinstance(event, list) else [event]:
+            times["post_camera"][_axes_key(axes_event["axes"])] = now
+        return event
+
+    def image_saved_fn(axes, dataset):
+        start = times["post_camera"].pop(_axes_key(axes), None)
+        if start:
+            tracer.record("acquisition.save", start, time.perf_counter_ns())
+
+    return {"pre_hardware_hook_fn": pre_hardware_hook_fn,
+            "post_hardware_hook_fn": post_hardware_hook_fn,
+            "post_camera_hook_fn": post_camera_hook_fn,
+            "image_saved_fn": image_saved_fn}
+
+
+def _axes_key(axes):
+    #axes dicts aren't hashable, so their sorted items are used as key
+    return tuple(sorted(axes.items()))
@@ -0,0 +1,342 @@
+"""
+File used to test the pycro helpers against the simulated backend (see
+simulation module).
+"""
+import json
+import os
+import tempfile
+import threading
+import time
+
+#pycro picks its backend on import
+os.environ["PYCRO_BACKEND"] = "sim"
+
+import numpy as np
+import pytest
+import zmq
+
+import pycro
+import readers
+import simulation
+import writers
+
+
+def test_round_trip_counter_ignores_data_sockets():
+    #pyjavaz can only be imported after pycromanager
+    import pycromanager
+    from pyjavaz import bridge
+    pycro._patch_bridge()
+    context = zmq.Context.instance()
+    reply_socket = context.socket(zmq.REP)
+    reply_port = reply_socket.bind_to_random_port("tcp://127.0.0.1")
+    request_socket = bridge._DataSocket(context, reply_port, zmq.REQ)
+    push_socket = context.socket(zmq.PUSH)
+    push_port = push_socket.bind_to_random_port("tcp://127.0.0.1")
+    pull_socket = bridge._DataSocket(context, push_port, zmq.PULL)
+    try:
+        with pycro.RoundTripCounter() as counter:
+            request_socket.send({"request": 1})
+            reply_socket.recv_multipart()
+            reply_socket.send_multipart([json.dumps({"reply": 1}).encode()])
+            assert request_socket.receive() == {"reply": 1}
+            #streamed images and events aren't round trips
+            push_socket.send_multipart([json.dumps({"image": 1}).encode()])
+            assert pull_socket.receive() == {"image": 1}
+        assert counter.count == 1
+    finally:
+        for socket in (request_socket, pull_socket):
+            socket.close()
+        reply_socket.close()
+        push_socket.close()
+
+
+@pytest.fixture
+def fast_sim(monkeypatch):
+    #simulated devices without delays, so tests only take the time of the calls
+    for name, value in (("call_latency", 0), ("bridge_bandwidth", 0), ("xy_settle", 0),
+                        ("z_settle", 0), ("channel_switch_time", 0), ("readout_time", 0),
+                        ("frame_shape", (16, 16))):
+        monkeypatch.setattr(simulation.settings, name, value)
+    pycro.core.set_exposure(0.1)
+    return pycro._connect("core")
+
+
+def check_block(sequence, z_positions, channels):
+    frames = list(sequence.acquire(as_numpy=True))
+    expected = [(z_num, c_num) for z_num in range(len(z_positions))
+                for c_num in range(len(channels))]
+    assert [(z_num, c_num) for z_num, c_num, _ in frames] == expected
+    for z_num, c_num, (pixels, tags) in frames:
+        assert pixels.shape == (16, 16)
+        assert tags["ZPositionUm"] == z_positions[z_num]
+        assert tags[simulation.CHANNEL_GROUP] == channels[c_num]
+    images = list(sequence.acquire())
+    assert [(z_num, c_num) for z_num, c_num, _ in images] == expected
+    assert all(isinstance(image, simulation.SimImage) for *_, image in images)
+
+
+def test_z_channel_sequence(fast_sim):
+    z_positions, channels = [0., 0.5, 1.], ["DAPI", "FITC"]
+    sequence = pycro.ZChannelSequence(z_positions, channels)
+    assert sequence.sequenced
+    check_block(sequence, z_positions, channels)
+
+
+def test_z_channel_sequence_fallback(fast_sim, monkeypatch):
+    z_positions, channels = [0., 0.5, 1.], ["DAPI", "FITC"]
+    monkeypatch.setattr(simulation.settings, "sequenceable", False)
+    sequence = pycro.ZChannelSequence(z_positions, channels)
+    assert not sequence.sequenced
+    check_block(sequence, z_positions, channels)
+    #sequences longer than the devices support fall back too
+    monkeypatch.setattr(simulation.settings, "sequenceable", True)
+    monkeypatch.setattr(simulation.settings, "max_sequence_length", 4)
+    assert not pycro.ZChannelSequence(z_positions, channels).sequenced
+
+
+def test_z_channel_sequence_last_images_after_stop(fast_sim, monkeypatch):
+    #every image arrives between the empty buffer check and the running
+    #check, so the sequence has stopped with all images in the buffer
+    def is_sequence_running():
+        fast_sim._sequence_thread.join()
+        return False
+
+    monkeypatch.setattr(fast_sim, "is_sequence_running", is_sequence_running)
+    z_positions, channels = [0., 1.], ["DAPI", "FITC"]
+    sequence = pycro.ZChannelSequence(z_positions, channels)
+    frames = list(sequence.acquire(as_numpy=True))
+    assert len(frames) == len(z_positions)*len(channels)
+
+
+def test_write_behind_ndtiff_writer(tmp_path):
+    #freeze() and save() are passed on to the writer, same as to a datastore
+    path = str(tmp_path/"dataset")
+    images = [np.full((16, 16), time_point, np.uint16) for time_point in range(5)]
+    datastore = pycro.WriteBehindDatastore(None, datastore=writers.NDTiffWriter(path))
+    for time_point, image in enumerate(images):
+        datastore.put_image(image, {"time": time_point})
+    datastore.freeze()
+    datastore.save()
+    datastore.close()
+    with readers.NDTiffReader(path) as reader:
+        assert all(np.array_equal(read, image) for read, image in zip(reader, images))
+        assert len(reader) == len(images)
+
+
+def mm_positions():
+    return [(pos._x, pos._y, pos._z, pos._label) for pos in pycro.studio._position_list._positions]
+
+
+def expected_positions(xyz_positions):
+    return [(*pos, str(pos)) for pos in xyz_positions]
+
+
+@pytest.fixture
+def position_list(fast_sim, monkeypatch, tmp_path):
+    #temp files go to tmp_path, so leftover files can be checked
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path))
+    #records which list files Micro-Manager loads
+    loads = []
+    load = simulation.SimPositionList.load
+    monkeypatch.setattr(simulation.SimPositionList, "load",
+                        lambda self, path: (loads.append(path), load(self, path)))
+    pycro.studio.positions().set_position_list(simulation.SimPositionList())
+    return loads
+
+
+def test_set_position_list_file(position_list, tmp_path):
+    xyz_positions = [(x, 2*x, 0.5) for x in range(100)]
+    path = str(tmp_path/"positions.pos")
+    pycro.set_position_list(xyz_positions, diff=False, path=path)
+    assert position_list == [path]
+    assert mm_positions() == expected_positions(xyz_positions)
+    assert pycro.read_position_list(path) == [
+        (str(pos), simulation.XY_STAGE, simulation.FOCUS, *pos) for pos in xyz_positions]
+    #the default temp file is unique and removed
+    pycro.set_position_list(xyz_positions[:50], diff=False)
+    assert len(position_list) == 2 and position_list[1] != path
+    assert os.listdir(tmp_path) == ["positions.pos"]
+    assert mm_positions() == expected_positions(xyz_positions[:50])
+
+
+def test_set_position_list_diff(position_list, tmp_path):
+    xyz_positions = [(x, 2*x, 0.5) for x in range(100)]
+    pycro.set_position_list(xyz_positions)
+    #empty list, so every position changed
+    assert len(position_list) == 1
+    moved = list(xyz_positions)
+    moved[10] = (0, 0, 10)
+    with pycro.RoundTripCounter() as counter:
+        pycro.set_position_list(moved)
+    assert len(position_list) == 1
+    assert mm_positions() == expected_positions(moved)
+    #unchanged list only exports Micro-Manager's list
+    with pycro.RoundTripCounter() as unchanged_counter:
+        pycro.set_position_list(moved)
+    assert unchanged_counter.count < counter.count
+    #positions added and removed at the end
+    for positions in (moved + [(1, 1, 1), (2, 2, 2)], moved[:90]):
+        pycro.set_position_list(positions)
+        assert mm_positions() == expected_positions(positions)
+    assert len(position_list) == 1
+    assert os.listdir(tmp_path) == []
+
+
+def test_set_position_list_diff_changed_in_mm(position_list):
+    #positions and labels changed in Micro-Manager (e.g. in the GUI), with
+    #the number of positions unchanged, are set back
+    xyz_positions = [(x, 2*x, 0.5) for x in range(10)]
+    pycro.set_position_list(xyz_positions)
+    mm_list = pycro.studio._position_list._positions
+    mm_list[3]._x = 1000
+    mm_list[5]._label = "Pos5"
+    pycro.set_position_list(xyz_positions)
+    assert mm_positions() == expected_positions(xyz_positions)
+    #few enough positions to always be sent one by one
+    assert position_list == []
+
+
+def test_set_position_list_diff_many_changes(position_list):
+    xyz_positions = [(x, 2*x, 0.5) for x in range(200)]
+    pycro.set_position_list(xyz_positions)
+    shifted = [(x + 1, y, z) for x, y, z in xyz_positions]
+    pycro.set_position_list(shifted)
+    #too many changes to send one by one, so the list is loaded again
+    assert len(position_list) == 2
+    assert mm_positions() == expected_positions(shifted)
+
+
+def per_image_builders(images, x_pos, y_pos, z_positions):
+    #new builders for every image, which ImageBlockBuilder replaces
+    built = []
+    for z_num, c_num, image in images:
+        coords = pycro.ImageCoordsBuilder().z(z_num).c(c_num).build()
+        metadata = pycro.ImageMetadataBuilder(image).x(x_pos).y(y_pos) \
+                        .z(z_positions[z_num]).build()
+        built.append(image.copy_with(coords, metadata))
+    return built
+
+
+def test_z_channel_sequence_round_trips(fast_sim, monkeypatch):
+    #camera timing of the defaults, so the buffer is polled while frames
+    #arrive
+    monkeypatch.setattr(simulation.settings, "readout_time", 0.002)
+    pycro.core.set_exposure(10)
+    z_positions, channels = [0.1*z for z in range(12)], ["DAPI", "FITC"]
+    trips = {}
+    for sequenceable in (True, False):
+        monkeypatch.setattr(simulation.settings, "sequenceable", sequenceable)
+        sequence = pycro.ZChannelSequence(z_positions, channels)
+        assert sequence.sequenced == sequenceable
+        for as_numpy in (False, True):
+            with pycro.RoundTripCounter() as counter:
+                num_images = len(list(sequence.acquire(as_numpy)))
+            trips[sequenceable, as_numpy] = counter.per_image(num_images)
+    #polling the buffer costs less than moving and snapping every frame
+    assert trips[True, False] < trips[False, False]
+    assert trips[True, True] < trips[False, True]
+    assert trips[True, True] < 3
+
+
+def test_image_block_builder(fast_sim, monkeypatch):
+    #per-frame acquisition, so the hardware state follows the channel of
+    #each image when it's added
+    monkeypatch.setattr(simulation.settings, "sequenceable", False)
+    z_positions, channels = [0.1*z for z in range(12)], ["DAPI", "FITC"]
+    sequence = pycro.ZChannelSequence(z_positions, channels)
+    images = list(sequence.acquire())
+    #coords are cached for the whole acquisition, so the first block pays them
+    for z_num, c_num, _ in images:
+        pycro.get_coords(z=z_num, c=c_num)
+    #add() is called as images arrive, since metadata takes the hardware
+    #state at the time, and only add() and build() are counted
+    block_counter = pycro.RoundTripCounter()
+    block = pycro.ImageBlockBuilder(1, 2)
+    for z_num, c_num, image in sequence.acquire():
+        with block_counter:
+            block.add(image, z_num, c_num, z_positions[z_num])
+    with block_counter:
+        built = block.build()
+    with pycro.RoundTripCounter() as per_image_counter:
+        pycro.get_coords.cache_clear()
+        per_image_builders(images, 1, 2, z_positions)
+    #numbers given in the ImageBlockBuilder docstring
+    assert block_counter.per_image(len(images)) == pytest.approx(4.5, abs=0.05)
+    assert per_image_counter.per_image(len(images)) == pytest.approx(11, abs=0.05)
+    assert [image.get_coords()._axes for image in built] == [
+        {"z": z_num, "channel": c_num} for z_num, c_num, _ in images]
+    values = [image.get_metadata()._values for image in built]
+    assert [value["ZPositionUm"] for value in values] == [
+        z_positions[z_num] for z_num, _, _ in images]
+    assert all((value["XPositionUm"], value["YPositionUm"]) == (1, 2) for value in values)
+    #hardware state of each image's channel, and a UUID for every image
+    assert [value[simulation.CHANNEL_GROUP] for value in values] == [
+        channels[c_num] for _, c_num, _ in images]
+    assert len({value["UUID"] for value in values}) == len(images)
+
+
+class RecordingDatastore():
+    #datastore that records images, optionally failing or waiting on a
+    #put_image() call
+    def __init__(self, fail_at=None, release=None):
+        self.images = []
+        self.closed = False
+        self._fail_at = fail_at
+        self._release = release
+
+    def put_image(self, image):
+        if self._release:
+            self._release.wait()
+        if len(self.images) == self._fail_at:
+            raise OSError("disk full")
+        self.images.append(image)
+
+    def close(self):
+        self.closed = True
+
+
+def test_write_behind_flushes_on_close():
+    datastore = RecordingDatastore(release=threading.Event())
+    write_behind = pycro.WriteBehindDatastore(None, max_queue=8, datastore=datastore)
+    for image in range(5):
+        write_behind.put_image(image)
+    assert datastore.images == []
+    datastore._release.set()
+    write_behind.close()
+    assert datastore.images == list(range(5))
+    assert datastore.closed
+
+
+def test_write_behind_error():
+    datastore = RecordingDatastore(fail_at=2)
+    write_behind = pycro.WriteBehindDatastore(None, datastore=datastore)
+    for image in range(5):
+        write_behind.put_image(image)
+    with pytest.raises(OSError):
+        write_behind.flush()
+    #raised again by later calls, and no more images are written
+    with pytest.raises(OSError):
+        write_behind.put_image(5)
+    with pytest.raises(OSError):
+        write_behind.close()
+    assert datastore.images == [0, 1]
+    assert datastore.closed
+
+
+def test_write_behind_drop():
+    datastore = RecordingDatastore(release=threading.Event())
+    write_behind = pycro.WriteBehindDatastore(None, max_queue=2, policy="drop",
+                                              datastore=datastore)
+    write_behind.put_image(0)
+    #the writer takes image 0 and waits on it, so the queue holds 2 more
+    deadline = time.monotonic() + 5
+    while write_behind._queue.qsize() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    for image in range(1, 6):
+        write_behind.put_image(image)
+    assert write_behind.dropped == 3
+    datastore._release.set()
+    write_behind.close()
+    assert datastore.images == [0, 1, 2]
+    with pytest.raises(ValueError):
+        pycro.WriteBehindDatastore(None, policy="latest", datastore=datastore)
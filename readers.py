@@ -0,0 +1,322 @@
+"""
+Module that contains readers used by the analysis code to get image data
+from disk without allocating a new array for every page.
+"""
+import contextlib
+import io
+import os
+import queue
+import struct
+import threading
+from collections.abc import Iterator
+
+import numpy as np
+import tifffile
+
+import compressors
+
+#name of the index file in NDTiff dataset folders (saved by pycromanager
+#Acquisition), used to tell them apart from TIFF stacks.
+NDTIFF_INDEX = "NDTiff.index"
+#index of datasets compressed by writers.NDTiffWriter, which ndtiff can't
+#read on its own
+COMPRESSED_NDTIFF_INDEX = "NDTiff.compressed.index"
+
+
+class TiffPageReader():
+    """
+    Reads pages of a TIFF stack as NumPy arrays.
+
+    Pages that are stored uncompressed, contiguous and in native byte order
+    are memory-mapped and returned as read-only views into the file, so no
+    decode or copy takes place. Each page gets its own small mapping that is
+    released once the returned array is no longer referenced, so resident
+    memory doesn't grow with the size of the stack.
+
+    Other pages (compressed, tiled, byte-swapped) are decoded into a buffer
+    that is reused for every page with the same shape and dtype. Arrays
+    returned for these pages are only valid until the next page is read, so
+    copy them if they need to be kept.
+
+    Can be used as a context manager, and iterating over it yields every page
+    in order.
+
+    ## Methods:
+
+    #### read(page_num: int) -> np.ndarray
+        returns image data of page page_num.
+
+    #### is_memmapped(page_num: int) -> bool
+        returns whether page page_num is read as a memory-mapped view.
+
+    #### close()
+        closes the underlying file handles.
+    """
+    def __init__(self, filename: str, use_memmap: bool = True):
+        self._tiff_file = tifffile.TiffFile(filename)
+        self._pages = self._tiff_file.pages
+        self._use_memmap = use_memmap
+        #separate handle so that mappings don't depend on tifffile's handle
+        #position.
+        self._file = open(filename, "rb") if use_memmap else None
+        self._buffers = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return len(self._pages)
+
+    def __iter__(self) -> Iterator[np.ndarray]:
+        for page_num in range(len(self)):
+            yield self.read(page_num)
+
+    def is_memmapped(self, page_num: int) -> bool:
+        page = self._pages[page_num]
+        return (self._use_memmap and page.is_contiguous
+                and page.is_memmappable)
+
+    def read(self, page_num: int) -> np.ndarray:
+        page = self._pages[page_num]
+        if self.is_memmapped(page_num):
+            return np.memmap(self._file, page.dtype, "r",
+                             page.dataoffsets[0], page.shape)
+        key = (page.shape, page.dtype)
+        if key not in self._buffers:
+            self._buffers[key] = np.empty(page.shape, page.dtype)
+        return page.asarray(out=self._buffers[key])
+
+    def close(self):
+        self._tiff_file.close()
+        if self._file:
+            self._file.close()
+
+
+class NDTiffReader():
+    """
+    Reads images of an NDTiff dataset (the folder saved by pycromanager
+    Acquisition, e.g. problem_2_output) through its index, so any image can
+    be read by its axes without reading or parsing the others.
+
+    Pages are the images whose axes match axes given to the constructor
+    (e.g. channel="DAPI" reads only DAPI images), sorted by axis_order with
+    the first axis outermost. axis_order defaults to the dataset's axis
+    order. Pages can be read like TiffPageReader pages, so the segmentation
+    pipeline can run on acquisition output directly (see open_reader()).
+
+    Iterating over it yields every page in order. Up to prefetch pages are
+    read ahead on a background thread while the current page is processed.
+    Returned arrays of uncompressed images are read-only. Images compressed
+    by writers.NDTiffWriter are decompressed in strips on a thread pool.
+
+    Requires ndtiff, which is installed with pycromanager.
+
+    ## Methods:
+
+    #### read(page_num: int) -> np.ndarray
+        returns image data of page page_num.
+
+    #### page_axes(page_num: int) -> dict
+        returns axes of page page_num, e.g. {"time": 3, "channel": "DAPI"}.
+
+    #### read_axes(**axes) -> np.ndarray
+        returns image data of the image with axes, whether or not it's one
+        of the pages.
+
+    #### read_metadata(page_num: int) -> dict
+        returns image metadata of page page_num.
+
+    #### as_array(**axes) -> dask.array.Array
+        returns lazy array of all images with axes, with one dimension for
+        each other axis in dataset order followed by y and x. Images are
+        only read when the array is computed.
+
+    #### close()
+        closes the dataset's files.
+    """
+    def __init__(self, path: str, axis_order: list[str] | None = None,
+                 prefetch: int = 4, **axes):
+        #imported here so that TIFF stack analysis doesn't import dask
+        try:
+            import ndtiff
+        except ImportError as e:
+            raise ImportError("reading NDTiff datasets requires ndtiff") from e
+        if os.path.isfile(os.path.join(path, COMPRESSED_NDTIFF_INDEX)):
+            file_io = _compressed_file_io(ndtiff)
+        else:
+            file_io = ndtiff.file_io.BUILTIN_FILE_IO
+        #ndtiff prints progress while reading the index
+        with contextlib.redirect_stdout(io.StringIO()):
+            self._dataset = ndtiff.Dataset(path, file_io=file_io)
+        self.axes = {axis: list(values)
+                     for axis, values in self._dataset.axes.items()}
+        axis_order = list(axis_order or self.axes)
+        self._prefetch = prefetch
+        #rank of each axis value, so string-valued axes (channel names) sort
+        #in dataset order as well.
+        ranks = {axis: {value: rank for rank, value in enumerate(values)}
+                 for axis, values in self.axes.items()}
+
+        def sort_key(page_axes):
+            return tuple(ranks[axis].get(page_axes.get(axis), -1)
+                         for axis in axis_order if axis in ranks)
+
+        self._files = {}
+        self._files_lock = threading.Lock()
+        self._pages = sorted((page_axes for page_axes in self._dataset.get_index_keys()
+                              if all(page_axes.get(axis) == value
+                                     for axis, value in axes.items())),
+                             key=sort_key)
+        self._axes_filter = axes
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return len(self._pages)
+
+    def __iter__(self) -> Iterator[np.ndarray]:
+        if self._prefetch < 1:
+            for page_num in range(len(self)):
+                yield self.read(page_num)
+            return
+        pages = queue.Queue(self._prefetch)
+        stop = threading.Event()
+
+        def put(item):
+            #timeout so the thread notices when iteration stops early.
+            #returns whether the item was queued.
+            while not stop.is_set():
+                try:
+                    pages.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def read_ahead():
+            try:
+                for page_num in range(len(self)):
+                    if not put((self.read(page_num), None)):
+                        return
+            except Exception as e:
+                put((None, e))
+
+        thread = threading.Thread(target=read_ahead, daemon=True)
+        thread.start()
+        try:
+            for _ in range(len(self)):
+                image, error = pages.get()
+                if error:
+                    raise error
+                yield image
+        finally:
+            stop.set()
+            thread.join()
+
+    def page_axes(self, page_num: int) -> dict:
+        return dict(self._pages[page_num])
+
+    def read(self, page_num: int) -> np.ndarray:
+        return self.read_axes(**self._pages[page_num])
+
+    def read_axes(self, **axes) -> np.ndarray:
+        entry = self._dataset.index.get(frozenset(axes.items()))
+        if entry and entry["pixel_compression"]:
+            return self._read_compressed(entry)
+        return self._dataset.read_image(**axes)
+
+    def _read_compressed(self, entry):
+        #strip table layout is described in writers.NDTiffWriter
+        codec = compressors.CODECS_BY_TIFF_COMPRESSION.get(entry["pixel_compression"])
+        if not codec:
+            raise ValueError(f"codec with TIFF compression {entry['pixel_compression']} "
+                             f"isn't available")
+        with self._files_lock:
+            if entry["filename"] not in self._files:
+                self._files[entry["filename"]] = open(
+                    os.path.join(self._dataset.path, entry["filename"]), "rb")
+            file = self._files[entry["filename"]]
+            file.seek(entry["pixel_offset"])
+            num_strips, strip_rows = struct.unpack("<II", file.read(8))
+            strip_sizes = struct.unpack(f"<{num_strips}I", file.read(4*num_strips))
+            data = memoryview(file.read(sum(strip_sizes)))
+        starts = np.concatenate([[0], np.cumsum(strip_sizes)])
+        strips = [data[start:stop] for start, stop in zip(starts[:-1], starts[1:])]
+        dtype = np.uint8 if entry["pixel_type"] == 0 else np.uint16
+        return compressors.decode_strips(strips, (entry["image_height"], entry["image_width"]),
+                                         dtype, codec, strip_rows)
+
+    def read_metadata(self, page_num: int) -> dict:
+        return self._dataset.read_metadata(**self._pages[page_num])
+
+    def as_array(self, **axes):
+        import dask.array
+
+        axes = {**self._axes_filter, **axes}
+        stacked = {axis: values for axis, values in self.axes.items() if axis not in axes}
+        shape = (self._dataset.image_height, self._dataset.image_width)
+        dtype = self._dataset.dtype
+
+        def read_block(block_id):
+            image_axes = {**axes, **{axis: values[index] for (axis, values), index
+                                     in zip(stacked.items(), block_id)}}
+            if self._dataset.has_image(**image_axes):
+                image = self.read_axes(**image_axes)
+            else:
+                image = np.zeros(shape, dtype)
+            return image.reshape((1,)*len(stacked) + shape)
+
+        chunks = tuple((1,)*len(values) for values in stacked.values()) + shape
+        return dask.array.map_blocks(read_block, dtype=dtype, chunks=chunks,
+                                     meta=np.empty((0,)*(len(stacked) + 2), dtype))
+
+    def close(self):
+        self._dataset.close()
+        for file in self._files.values():
+            file.close()
+
+
+def _compressed_file_io(ndtiff):
+    #ndtiff file functions that open the index of a compressed dataset
+    #under the standard name. Pixels of compressed images are only read by
+    #NDTiffReader._read_compressed().
+    def open_file(file, *args, **kwargs):
+        if os.path.basename(file) == NDTIFF_INDEX:
+            file = os.path.join(os.path.dirname(file), COMPRESSED_NDTIFF_INDEX)
+        return open(file, *args, **kwargs)
+
+    def listdir(path):
+        names = os.listdir(path)
+        if COMPRESSED_NDTIFF_INDEX in names:
+            names.append(NDTIFF_INDEX)
+        return names
+
+    return ndtiff.file_io.NDTiffFileIO(open_function=open_file, listdir_function=listdir)
+
+
+def is_ndtiff(path: str) -> bool:
+    """
+    returns whether path is an NDTiff dataset folder (compressed or not).
+    """
+    return any(os.path.isfile(os.path.join(path, index))
+               for index in (NDTIFF_INDEX, COMPRESSED_NDTIFF_INDEX))
+
+
+def open_reader(path: str, axes: dict | None = None
+                ) -> TiffPageReader | NDTiffReader:
+    """
+    returns NDTiffReader of the images matching axes if path is an NDTiff
+    dataset folder, and TiffPageReader otherwise (axes must then be None).
+    """
+    if is_ndtiff(path):
+        return NDTiffReader(path, **(axes or {}))
+    if axes:
+        raise ValueError(f"{path} is not an NDTiff dataset, so axes can't be selected")
+    return TiffPageReader(path)
@@ -0,0 +1,119 @@
+"""
+File used to test the page readers on small TIFF stacks and on NDTiff
+datasets written with writers.NDTiffWriter.
+"""
+import threading
+import time
+
+import numpy as np
+import pytest
+import tifffile
+
+import readers
+import writers
+
+
+def write_stack(path, num_pages=5, shape=(32, 48), **kwargs):
+    rng = np.random.default_rng(0)
+    with tifffile.TiffWriter(path) as writer:
+        for _ in range(num_pages):
+            writer.write(rng.integers(0, 4096, shape, dtype=np.uint16),
+                         contiguous=False, **kwargs)
+    return str(path)
+
+
+def imread_pages(filename):
+    with tifffile.TiffFile(filename) as tiff:
+        return [page.asarray() for page in tiff.pages]
+
+
+def test_tiff_memmap(tmp_path):
+    filename = write_stack(tmp_path/"stack.tif")
+    expected = imread_pages(filename)
+    with readers.TiffPageReader(filename) as reader:
+        assert len(reader) == len(expected)
+        pages = list(reader)
+        assert all(reader.is_memmapped(page_num) for page_num in range(len(reader)))
+        assert all(isinstance(page, np.memmap) for page in pages)
+        #views into the file are read-only and stay valid
+        assert not pages[0].flags.writeable
+        assert all(np.array_equal(page, image) for page, image in zip(pages, expected))
+    with readers.TiffPageReader(filename, use_memmap=False) as reader:
+        assert not reader.is_memmapped(0)
+        assert all(np.array_equal(reader.read(num), image)
+                   for num, image in enumerate(expected))
+
+
+@pytest.mark.parametrize("layout", [{"compression": "zlib"}, {"tile": (16, 16)}])
+def test_tiff_decode_buffer(tmp_path, layout):
+    #compressed and tiled pages can't be memory-mapped
+    filename = write_stack(tmp_path/"stack.tif", **layout)
+    expected = imread_pages(filename)
+    with readers.TiffPageReader(filename) as reader:
+        assert not reader.is_memmapped(0)
+        for page_num, image in enumerate(expected):
+            assert np.array_equal(reader.read(page_num), image)
+        #decoded pages share one buffer, so a returned array is overwritten
+        #by the next read unless it's copied, as documented
+        first = reader.read(0)
+        kept = first.copy()
+        second = reader.read(1)
+        assert np.shares_memory(first, second)
+        assert np.array_equal(first, expected[1])
+        assert np.array_equal(kept, expected[0])
+
+
+def write_dataset(path, num_images=6, shape=(32, 48)):
+    images = [np.full(shape, time_point, np.uint16) for time_point in range(num_images)]
+    with writers.NDTiffWriter(path) as writer:
+        for time_point, image in enumerate(images):
+            writer.put_image(image, {"time": time_point})
+    return images
+
+
+def test_read_ahead(tmp_path):
+    path = str(tmp_path/"dataset")
+    images = write_dataset(path)
+    for prefetch in (0, 1, 4):
+        with readers.NDTiffReader(path, prefetch=prefetch) as reader:
+            assert all(np.array_equal(read, image) for read, image in zip(reader, images))
+
+
+def failing_reader(path, fail_page, delay=0):
+    reader = readers.NDTiffReader(path, prefetch=1)
+    read = reader.read
+
+    def read_or_fail(page_num):
+        if page_num == fail_page:
+            time.sleep(delay)
+            raise OSError(f"page {page_num} can't be read")
+        return read(page_num)
+
+    reader.read = read_or_fail
+    return reader
+
+
+def test_read_ahead_error(tmp_path):
+    path = str(tmp_path/"dataset")
+    write_dataset(path)
+    with failing_reader(path, 2) as reader:
+        with pytest.raises(OSError):
+            list(reader)
+
+
+def test_read_ahead_error_after_early_stop(tmp_path):
+    #the read error comes while the queue is full and iteration has stopped,
+    #which must not block stopping the read ahead thread
+    path = str(tmp_path/"dataset")
+    write_dataset(path)
+    with failing_reader(path, 2, delay=0.5) as reader:
+        def iterate_one_page():
+            for _ in reader:
+                #page 1 fills the queue while page 2 is being read
+                time.sleep(0.2)
+                break
+
+        thread = threading.Thread(target=iterate_one_page, daemon=True)
+        thread.start()
+        thread.join(5)
+        assert not thread.is_alive()
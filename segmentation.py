@@ -0,0 +1,677 @@
+"""
+Module that contains the nucleus segmentation used in problem 3, and a
+pipeline that runs it over the pages of a TIFF stack or NDTiff dataset,
+either serially or sharded across a process pool.
+"""
+import concurrent.futures
+import functools
+import itertools
+import json
+import os
+import threading
+import time
+from collections.abc import Callable, Iterator
+from typing import Any
+
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from skimage.filters import threshold_otsu
+from skimage.measure import label, regionprops, regionprops_table
+
+import cache
+import features
+import histogram
+import processing
+import readers
+
+#area range in pixels used to remove objects that are too small to be cells
+#and too large to be single cells.
+MIN_AREA = 100
+MAX_AREA = 2000
+#default properties computed for the feature table. Any scalar or fixed
+#size property of skimage.measure.regionprops can be used. area is always
+#computed since it's needed for the area filter.
+FEATURE_PROPERTIES = ("area", "eccentricity", "centroid", "bbox")
+
+#pages with at least this many pixels are labeled in tiles by
+#label_large_page(), since full-frame labels would be int64 and single
+#threaded.
+LARGE_FRAME_PIXELS = 8192*8192
+LARGE_FRAME_TILE_SHAPE = (4096, 4096)
+
+#page readers opened by pool workers, keyed by filename and axes. Kept open
+#for the life of the worker so each chunk doesn't re-parse the file.
+_worker_readers = {}
+#threads used by large-frame labeling in this process when not given. Set
+#in pool workers so that workers*threads doesn't oversubscribe the cores.
+_worker_threads = None
+
+
+def _num_threads(workers):
+    #explicit, since ThreadPoolExecutor(None) starts min(32, cpu_count + 4)
+    return workers or _worker_threads or os.cpu_count()
+
+
+def _init_worker(threads):
+    global _worker_threads
+    _worker_threads = threads
+
+
+def page_threshold(image: np.ndarray) -> float:
+    """
+    returns Otsu threshold of image, the threshold label_page() uses. Pages
+    with at least LARGE_FRAME_PIXELS pixels use tiled_threshold_otsu(),
+    which gives the same threshold for integer images.
+    """
+    if image.size >= LARGE_FRAME_PIXELS:
+        return tiled_threshold_otsu(image)
+    #Image set is clearly bimodal (see testing), so otsu's seems reasonable
+    return threshold_otsu(image)
+
+
+def label_page(image: np.ndarray, threshold_offset: float = 0,
+               threshold: float | None = None) -> np.ndarray:
+    """
+    returns label image of image thresholded at its Otsu threshold plus
+    threshold_offset. threshold is the Otsu threshold if already computed
+    (see page_threshold()). Pages with at least LARGE_FRAME_PIXELS pixels
+    are labeled with label_large_page(), which gives the same labels.
+    """
+    if image.size >= LARGE_FRAME_PIXELS:
+        return label_large_page(image, threshold_offset=threshold_offset,
+                                threshold=threshold)
+    #labeling code adapted from this website:
+    #https://scikit-image.org/docs/stable/auto_examples/segmentation/plot_label.html
+    if threshold is None:
+        threshold = page_threshold(image)
+    return label(image > threshold + threshold_offset)
+
+
+def smallest_label_dtype(max_label: int) -> np.dtype:
+    """
+    returns smallest unsigned integer dtype that holds max_label.
+    """
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if max_label <= np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    return np.dtype(np.uint64)
+
+
+def _tile_slices(shape, tile_shape):
+    return [(slice(y, y + height), slice(x, x + width))
+            for y, x, height, width in processing.tile_grid(shape, tile_shape)]
+
+
+def tiled_threshold_otsu(image: np.ndarray, tile_shape: tuple[int, int] = LARGE_FRAME_TILE_SHAPE,
+                         subsample: int = 1, workers: int | None = None) -> float:
+    """
+    returns Otsu threshold of image. For integer images, the histogram is
+    counted in tiles in parallel and merged, which gives exactly the same
+    threshold as threshold_otsu(image). If subsample > 1, the threshold is
+    estimated from every subsample'th pixel along each axis instead. Images
+    that aren't integer (e.g. float) are passed to threshold_otsu() whole.
+    uint64 images are counted as well, though threshold_otsu() can't take
+    them. workers is the number of threads, see label_large_page().
+    """
+    if subsample > 1 or image.dtype.kind not in "iu":
+        return threshold_otsu(image[::subsample, ::subsample])
+    image_min, image_max = int(image.min()), int(image.max())
+    if image_min == image_max:
+        return image_min
+
+    def count_tile(tile):
+        values = image[tile].ravel()
+        if image_min < 0:
+            #offset so negative values of signed images can be counted
+            offset = values.astype(np.int64) - image_min
+        elif not np.can_cast(values.dtype, np.intp):
+            #uint64 is offset in its own dtype, so large values fit in intp
+            offset = (values - values.dtype.type(image_min)).astype(np.intp)
+        else:
+            return np.bincount(values, minlength=image_max + 1)[image_min:]
+        return np.bincount(offset, minlength=image_max - image_min + 1)
+
+    with concurrent.futures.ThreadPoolExecutor(_num_threads(workers)) as executor:
+        counts = sum(executor.map(count_tile, _tile_slices(image.shape, tile_shape)))
+    #same histogram as skimage's bincount histogram of image
+    bin_centers = np.arange(image_min, image_max + 1)
+    return threshold_otsu(hist=(counts, bin_centers))
+
+
+def _label_tile(image, tile, thresh):
+    tile_labels, num_labels = label(image[tile] > thresh, return_num=True)
+    tile_labels = tile_labels.astype(smallest_label_dtype(num_labels))
+    #raster index (within the tile) of the first pixel of each label. label()
+    #numbers labels in raster order, so a label's first pixel is where the
+    #running max of labels goes up.
+    foreground = np.flatnonzero(tile_labels)
+    running_max = np.maximum.accumulate(tile_labels.ravel()[foreground])
+    first_pixels = foreground[np.flatnonzero(np.diff(running_max, prepend=0))]
+    return tile_labels, num_labels, first_pixels
+
+
+def _border_line(tile_results, tiles, offsets, index, axis, length):
+    #row (axis 0) or column (axis 1) index of the image, with labels offset
+    #to be unique across tiles
+    line = np.zeros(length, np.int64)
+    for (tile_labels, _, _), tile, offset in zip(tile_results, tiles, offsets):
+        if tile[axis].start <= index < tile[axis].stop:
+            values = np.take(tile_labels, index - tile[axis].start, axis)
+            line[tile[1 - axis]] = np.where(values > 0, values.astype(np.int64) + offset, 0)
+    return line
+
+
+def _border_pairs(tile_results, tiles, offsets, shape):
+    #pairs of foreground labels touching across tile borders, with 8
+    #connectivity (same as label() on a 2D image)
+    pairs = []
+    for axis in (0, 1):
+        length = shape[1 - axis]
+        for border in sorted({tile[axis].start for tile in tiles} - {0}):
+            before = _border_line(tile_results, tiles, offsets, border - 1, axis, length)
+            after = _border_line(tile_results, tiles, offsets, border, axis, length)
+            for shift in (-1, 0, 1):
+                a = before[max(shift, 0):length + min(shift, 0)]
+                b = after[max(-shift, 0):length + min(-shift, 0)]
+                touching = (a > 0) & (b > 0)
+                pairs.append((a[touching], b[touching]))
+    if not pairs:
+        return np.empty(0, np.int64), np.empty(0, np.int64)
+    return np.concatenate([a for a, _ in pairs]), np.concatenate([b for _, b in pairs])
+
+
+def label_large_page(image: np.ndarray, tile_shape: tuple[int, int] = LARGE_FRAME_TILE_SHAPE,
+                     workers: int | None = None, threshold_subsample: int = 1,
+                     threshold_offset: float = 0, threshold: float | None = None
+                     ) -> np.ndarray:
+    """
+    Labels image thresholded with Otsu's method in tiles, for frames too
+    large to label in one piece. Returns the same labels as label_page() (8
+    connected, numbered in raster order of each object's first pixel), in
+    the smallest unsigned dtype that fits instead of int32/int64.
+
+    The threshold is computed with tiled_threshold_otsu(), tiles are
+    thresholded and labeled in parallel threads, and labels of objects
+    crossing tile borders are merged. Besides the image and output labels,
+    memory use is the tile labels, each in the smallest dtype for its
+    number of labels (usually uint8 or uint16).
+
+    Parameters:
+
+    image: np.ndarray
+        2D image to label.
+
+    tile_shape: tuple[int, int]
+        Shape of tiles labeled in parallel.
+
+    workers: int | None
+        Number of threads. None uses os.cpu_count(), or in iter_pages() pool
+        workers, os.cpu_count() divided by the number of workers.
+
+    threshold_subsample: int
+        Subsampling step of threshold estimate. 1 gives the exact Otsu
+        threshold, so labels match label_page().
+
+    threshold_offset: float
+        Offset in pixel values added to the threshold.
+
+    threshold: float | None
+        Otsu threshold of image if already computed. None computes it.
+    """
+    workers = _num_threads(workers)
+    if threshold is None:
+        threshold = tiled_threshold_otsu(image, tile_shape, threshold_subsample, workers)
+    thresh = threshold + threshold_offset
+    tiles = _tile_slices(image.shape, tile_shape)
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        tile_results = list(executor.map(_label_tile, itertools.repeat(image), tiles,
+                                         itertools.repeat(thresh)))
+    #tile labels are offset to provisional labels that are unique across
+    #tiles
+    num_labels = [num for _, num, _ in tile_results]
+    offsets = np.concatenate([[0], np.cumsum(num_labels)[:-1]]).astype(np.int64)
+    num_provisional = int(sum(num_labels))
+    if not num_provisional:
+        return np.zeros(image.shape, np.uint8)
+    #raster index in the full image of each provisional label's first pixel
+    first_pixels = []
+    for (tile_labels, _, tile_first), tile in zip(tile_results, tiles):
+        y, x = np.divmod(tile_first, tile_labels.shape[1])
+        first_pixels.append((y + tile[0].start)*image.shape[1] + x + tile[1].start)
+    first_pixels = np.concatenate(first_pixels)
+
+    #objects crossing borders are connected components of the graph of
+    #touching provisional labels
+    a, b = _border_pairs(tile_results, tiles, offsets, image.shape)
+    graph = coo_matrix((np.ones(len(a), np.int32), (a - 1, b - 1)),
+                       shape=(num_provisional, num_provisional))
+    num_objects, components = connected_components(graph, directed=False)
+    #objects are numbered in raster order of their first pixel, like label().
+    #After sorting by first pixel, an object's first occurrence is its first
+    #pixel.
+    by_pixel = np.argsort(first_pixels)
+    _, object_first = np.unique(components[by_pixel], return_index=True)
+    rank = np.empty(num_objects, np.int64)
+    rank[np.argsort(object_first)] = np.arange(1, num_objects + 1)
+    dtype = smallest_label_dtype(num_objects)
+    labels = np.empty(image.shape, dtype)
+    for (tile_labels, num, _), tile, offset in zip(tile_results, tiles, offsets):
+        tile_lookup = np.zeros(num + 1, dtype)
+        tile_lookup[1:] = rank[components[offset:offset + num]]
+        np.take(tile_lookup, tile_labels, out=labels[tile])
+    return labels
+
+
+def segment_page(image: np.ndarray, min_area: int = MIN_AREA,
+                 max_area: int = MAX_AREA) -> list[float]:
+    """
+    Segments image with Otsu's threshold and returns the eccentricities of
+    labeled regions with area in [min_area, max_area].
+
+    Parameters:
+
+    image: np.ndarray
+        2D image to segment.
+
+    min_area: int
+        Minimum region area in pixels.
+
+    max_area: int
+        Maximum region area in pixels.
+    """
+    return [region.eccentricity for region in regionprops(label_page(image))
+            if min_area <= region.area <= max_area]
+
+
+@functools.lru_cache
+def feature_dtype(properties: tuple[str, ...] = FEATURE_PROPERTIES) -> np.dtype:
+    """
+    returns dtype of the feature table for given properties. Columns are
+    named as in regionprops_table, and integer columns are stored as int32.
+    """
+    if "area" not in properties:
+        properties = ("area",) + tuple(properties)
+    #regionprops_table of a 1 pixel region gives the column names and types
+    columns = regionprops_table(np.ones((1, 1), np.int32), np.ones((1, 1)),
+                                properties=properties)
+    fields = [(features.PAGE, np.int32)]
+    for name, column in columns.items():
+        if column.dtype.kind == "O":
+            raise ValueError(f"property {name} can't be stored in a column")
+        fields.append((name, np.int32 if column.dtype.kind in "iub" else column.dtype))
+    return np.dtype(fields)
+
+
+def extract_features(image: np.ndarray, page_num: int = 0,
+                     properties: tuple[str, ...] = FEATURE_PROPERTIES) -> np.ndarray:
+    """
+    Segments image and returns feature table with properties of every
+    labeled region (unfiltered by area) computed in bulk with
+    regionprops_table.
+
+    Parameters:
+
+    image: np.ndarray
+        2D image to segment.
+
+    page_num: int
+        Page index stored in the "page" column.
+
+    properties: tuple[str, ...]
+        regionprops properties to compute.
+    """
+    dtype = feature_dtype(tuple(properties))
+    names = [name for name in dtype.names if name != features.PAGE]
+    #regionprops_table expands multi-valued properties into name-i columns,
+    #so the property names are recovered from the column names.
+    properties = tuple(dict.fromkeys(name.split("-")[0] for name in names))
+    columns = regionprops_table(label_page(image), image, properties=properties)
+    columns[features.PAGE] = np.full(len(columns["area"]), page_num)
+    return features.from_columns(columns, dtype)
+
+
+def _cached_extract_features(image, page_num, properties, page_cache):
+    key = page_cache.key(image, ("features", properties))
+    table = page_cache.get(key)
+    if table is None:
+        table = extract_features(image, page_num, properties)
+        page_cache.put(key, table)
+    else:
+        #same page data may be at a different index than when it was cached
+        table[features.PAGE] = page_num
+    return table
+
+
+def _process_chunk(filename, start, stop, page_fn, axes=None):
+    #runs in pool worker. Pages are read in the worker so that only the
+    #results are sent back to the main process.
+    key = (filename, tuple(sorted((axes or {}).items())))
+    if key not in _worker_readers:
+        _worker_readers[key] = readers.open_reader(filename, axes)
+    reader = _worker_readers[key]
+    return [page_fn(reader.read(page_num), page_num)
+            for page_num in range(start, stop)]
+
+
+def iter_pages(filename: str, page_fn: Callable[[np.ndarray, int], Any],
+               workers: int | None = None, chunk_size: int = 16,
+               axes: dict | None = None) -> Iterator[tuple[int, Any]]:
+    """
+    Calls page_fn(image, page_num) on every page of TIFF stack and yields
+    (page_num, result) for each page in page order as results become
+    available.
+
+    Parameters:
+
+    filename: str
+        Path to TIFF stack, or to NDTiff dataset folder (e.g. saved by
+        problem_2), whose images are read through its index in axes order.
+        See readers.open_reader().
+
+    page_fn: Callable[[np.ndarray, int], Any]
+        Function applied to each page. Must be picklable (module level
+        function or functools.partial of one) when workers isn't 1.
+
+    workers: int | None
+        Number of worker processes. None uses os.cpu_count(), and 1 runs
+        serially in the calling process.
+
+    chunk_size: int
+        Number of consecutive pages sent to a worker at a time.
+
+    axes: dict | None
+        Only for NDTiff datasets. Only images with these axes are pages,
+        e.g. {"channel": "DAPI"}. None uses all images.
+    """
+    workers = workers or os.cpu_count()
+    if workers == 1:
+        with readers.open_reader(filename, axes) as reader:
+            for page_num, image in enumerate(reader):
+                yield page_num, page_fn(image, page_num)
+        return
+
+    with readers.open_reader(filename, axes) as reader:
+        num_pages = len(reader)
+    starts = range(0, num_pages, chunk_size)
+    stops = [min(start + chunk_size, num_pages) for start in starts]
+    #large frames are labeled with threads in each worker, which share the
+    #cores between them
+    with concurrent.futures.ProcessPoolExecutor(
+            workers, initializer=_init_worker,
+            initargs=(max(1, os.cpu_count()//workers),)) as executor:
+        #map returns chunks in submission order, which keeps pages in order
+        chunks = executor.map(_process_chunk, itertools.repeat(filename),
+                              starts, stops, itertools.repeat(page_fn),
+                              itertools.repeat(axes))
+        for start, chunk in zip(starts, chunks):
+            for page_num, result in enumerate(chunk, start):
+                yield page_num, result
+
+
+def _page_eccentricities(image, page_num, min_area, max_area):
+    return segment_page(image, min_area, max_area)
+
+
+def iter_page_eccentricities(filename: str, workers: int | None = None,
+                             chunk_size: int = 16, min_area: int = MIN_AREA,
+                             max_area: int = MAX_AREA, axes: dict | None = None
+                             ) -> Iterator[tuple[int, list[float]]]:
+    """
+    Segments every page of TIFF stack and yields (page_num, eccentricities)
+    for each page in page order. See iter_pages() for workers, chunk_size
+    and axes.
+
+    Parameters:
+
+    min_area: int
+        Minimum region area in pixels.
+
+    max_area: int
+        Maximum region area in pixels.
+    """
+    page_fn = functools.partial(_page_eccentricities, min_area=min_area,
+                                max_area=max_area)
+    yield from iter_pages(filename, page_fn, workers, chunk_size, axes)
+
+
+def get_eccentricities(filename: str, workers: int | None = None,
+                       chunk_size: int = 16, min_area: int = MIN_AREA,
+                       max_area: int = MAX_AREA, axes: dict | None = None
+                       ) -> list[float]:
+    """
+    returns eccentricities of all segmented regions in TIFF stack, merged
+    in page order. See iter_page_eccentricities() for parameters.
+    """
+    eccentricities = []
+    for _, page_eccentricities in iter_page_eccentricities(
+            filename, workers, chunk_size, min_area, max_area, axes):
+        eccentricities.extend(page_eccentricities)
+    return eccentricities
+
+
+def _page_histogram(image, page_num, bins, value_range, min_area, max_area):
+    page_histogram = histogram.StreamingHistogram(bins, value_range)
+    page_histogram.add(segment_page(image, min_area, max_area))
+    return page_histogram
+
+
+def iter_eccentricity_histogram(filename: str, bins: int = 40,
+                                value_range: tuple[float, float] = (0, 1),
+                                workers: int | None = None, chunk_size: int = 16,
+                                min_area: int = MIN_AREA, max_area: int = MAX_AREA,
+                                axes: dict | None = None
+                                ) -> Iterator[tuple[int, histogram.StreamingHistogram]]:
+    """
+    Segments every page of TIFF stack and yields (page_num, histogram) for
+    each page in page order, where histogram is a running
+    histogram.StreamingHistogram of the eccentricities of all pages so far.
+    The same histogram object is updated in place. Workers send back
+    per-page histograms instead of eccentricities, so memory is constant in
+    the number of objects. See iter_page_eccentricities() for the other
+    parameters.
+
+    Parameters:
+
+    bins: int
+        Number of histogram bins.
+
+    value_range: tuple[float, float]
+        Range covered by the bins.
+    """
+    page_fn = functools.partial(_page_histogram, bins=bins, value_range=value_range,
+                                min_area=min_area, max_area=max_area)
+    total = histogram.StreamingHistogram(bins, value_range)
+    for page_num, page_histogram in iter_pages(filename, page_fn, workers,
+                                               chunk_size, axes):
+        total.merge(page_histogram)
+        yield page_num, total
+
+
+def get_feature_table(filename: str, properties: tuple[str, ...] = FEATURE_PROPERTIES,
+                      workers: int | None = None, chunk_size: int = 16,
+                      page_cache: cache.PageCache | None = None,
+                      axes: dict | None = None) -> np.ndarray:
+    """
+    returns feature table (see features module) of every labeled region in
+    TIFF stack in page order. See extract_features() and iter_pages() for
+    the other parameters.
+
+    Parameters:
+
+    page_cache: cache.PageCache | None
+        If given, per-page tables are looked up by page content and
+        properties, and only pages that aren't cached are segmented. The
+        cache is trimmed to its size limit afterwards.
+    """
+    properties = tuple(properties)
+    if page_cache:
+        page_fn = functools.partial(_cached_extract_features, properties=properties,
+                                    page_cache=page_cache)
+    else:
+        page_fn = functools.partial(extract_features, properties=properties)
+    tables = [table for _, table in iter_pages(filename, page_fn, workers,
+                                               chunk_size, axes)]
+    if page_cache:
+        page_cache.evict()
+    if not tables:
+        return np.empty(0, feature_dtype(properties))
+    return np.concatenate(tables)
+
+
+class OnlineSegmenter():
+    """
+    image_process_fn for pycromanager Acquisition (see problem_1_pycro) that
+    segments frames as they arrive, so features don't need a second read of
+    the dataset. Frames are passed through unchanged, and segmentation
+    (extract_features()) runs on background threads, so it doesn't hold up
+    saving. The image isn't copied and must not be changed after the hook.
+
+    Each frame's objects get the frame index in the "page" column. The
+    feature table is saved to features_path with features.save_table(), and
+    the axes of every frame (metadata["Axes"]) are saved as a JSON list next
+    to it (<features_path stem>_frames.json). Both are saved every
+    save_interval_s while frames are segmented and again on close(), so a
+    crashed acquisition keeps the features of all but its last frames.
+    Saves write a temporary file that replaces the old one, so the files
+    on disk are always complete.
+
+    When max_queue frames are waiting, policy decides what happens to a new
+    frame: "block" waits for segmentation to catch up, which pushes back on
+    the acquisition, and "drop" doesn't segment it and counts it as dropped.
+    An error from segmentation or saving is raised by the next call, which
+    stops the acquisition.
+
+    ## Methods:
+
+    #### __call__(image: np.ndarray, metadata: dict) -> tuple
+        queues image for segmentation and returns (image, metadata).
+
+    #### save()
+        saves the table of the frames segmented so far and the axes of the
+        frames received so far.
+
+    #### stats() -> dict
+        returns counts of frames received, segmented and dropped, queue
+        depth, lag (s from arrival to features of the last segmented frame),
+        max lag and mean segmentation time in ms.
+
+    #### close()
+        waits for queued frames, saves the table and raises any error from
+        segmentation. Also called on context manager exit.
+    """
+    _POLICIES = ("block", "drop")
+
+    def __init__(self, features_path: str, properties: tuple[str, ...] = FEATURE_PROPERTIES,
+                 workers: int = 2, max_queue: int = 64, policy: str = "block",
+                 save_interval_s: float = 10):
+        if policy not in self._POLICIES:
+            raise ValueError(f"policy must be one of {self._POLICIES}")
+        self.features_path = features_path
+        stem, extension = os.path.splitext(features_path)
+        self._table_path = features_path
+        if extension not in (".npy", ".parquet", ".feather"):
+            #np.save appends .npy to paths that don't end with it
+            stem, extension = features_path, ".npy"
+            self._table_path += extension
+        self._frames_path = f"{os.path.splitext(features_path)[0]}_frames.json"
+        self._temp_paths = (f"{stem}.partial{extension}", f"{self._frames_path}.partial")
+        self._save_interval = save_interval_s
+        self._last_save = time.perf_counter()
+        self._save_lock = threading.Lock()
+        self._properties = tuple(properties)
+        self._policy = policy
+        self._executor = concurrent.futures.ThreadPoolExecutor(workers)
+        self._slots = threading.BoundedSemaphore(max_queue)
+        self._lock = threading.Lock()
+        self._tables = []
+        self._frame_axes = []
+        self._error = None
+        self._received = 0
+        self._segmented = 0
+        self._dropped = 0
+        self._lag = 0.
+        self._max_lag = 0.
+        self._segment_seconds = 0.
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __call__(self, image, metadata):
+        if self._error:
+            raise self._error
+        frame_num = self._received
+        self._received += 1
+        self._frame_axes.append(metadata.get("Axes", {}))
+        if not self._slots.acquire(blocking=self._policy == "block"):
+            with self._lock:
+                self._dropped += 1
+            return image, metadata
+        self._executor.submit(self._segment, image, frame_num, time.perf_counter())
+        return image, metadata
+
+    def _segment(self, image, frame_num, arrival):
+        try:
+            start = time.perf_counter()
+            table = extract_features(image, frame_num, self._properties)
+            end = time.perf_counter()
+            with self._lock:
+                self._tables.append(table)
+                self._segmented += 1
+                self._segment_seconds += end - start
+                self._lag = end - arrival
+                self._max_lag = max(self._max_lag, self._lag)
+            #one worker saves while the others keep segmenting
+            if (end - self._last_save >= self._save_interval
+                    and self._save_lock.acquire(blocking=False)):
+                try:
+                    self._last_save = end
+                    self._save()
+                finally:
+                    self._save_lock.release()
+        except Exception as e:
+            self._error = e
+        finally:
+            self._slots.release()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"received": self._received,
+                    "segmented": self._segmented,
+                    "dropped": self._dropped,
+                    "queue_depth": self._received - self._segmented - self._dropped,
+                    "lag_s": self._lag,
+                    "max_lag_s": self._max_lag,
+                    "mean_segment_ms": 1000*self._segment_seconds/max(self._segmented, 1)}
+
+    def save(self):
+        with self._save_lock:
+            self._save()
+
+    def _save(self):
+        with self._lock:
+            if self._tables:
+                #merged so that later saves don't concatenate every frame again
+                self._tables = [np.concatenate(self._tables)]
+                table = self._tables[0]
+            else:
+                table = np.empty(0, feature_dtype(self._properties))
+            frame_axes = list(self._frame_axes)
+        #frames finish out of order on multiple workers
+        table = table[np.argsort(table[features.PAGE], kind="stable")]
+        #frames first, so the saved frames always cover the saved table
+        table_temp, frames_temp = self._temp_paths
+        with open(frames_temp, "w") as file:
+            json.dump(frame_axes, file)
+        os.replace(frames_temp, self._frames_path)
+        features.save_table(table, table_temp)
+        os.replace(table_temp, self._table_path)
+
+    def close(self):
+        self._executor.shutdown()
+        if self._error:
+            raise self._error
+        self.save()
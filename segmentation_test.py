@@ -0,0 +1,253 @@
+"""
+File used to test the problem 3 segmentation pipeline on synthetic pages,
+so it runs without the test data.
+"""
+import concurrent.futures
+import json
+import os
+import threading
+import time
+
+import numpy as np
+import pytest
+import tifffile
+from skimage.filters import threshold_otsu
+from skimage.measure import label
+
+import features
+import segmentation
+
+
+def synthetic_page(seed, shape=(256, 256), num_nuclei=40):
+    #noisy background with elliptical nuclei of a range of sizes, some
+    #touching each other and the edges
+    rng = np.random.default_rng(seed)
+    page = rng.normal(300, 30, shape)
+    y_range, x_range = np.ogrid[:shape[0], :shape[1]]
+    for _ in range(num_nuclei):
+        y, x = rng.uniform(0, shape[0]), rng.uniform(0, shape[1])
+        radius_y, radius_x = rng.uniform(3, 25), rng.uniform(3, 25)
+        nucleus = ((y_range - y)/radius_y)**2 + ((x_range - x)/radius_x)**2 <= 1
+        page[nucleus] = rng.normal(1500, 150, nucleus.sum())
+    return np.clip(page, 0, 4095).astype(np.uint16)
+
+
+def write_stack(path, num_pages, shape=(256, 256)):
+    with tifffile.TiffWriter(path) as writer:
+        for page_num in range(num_pages):
+            writer.write(synthetic_page(page_num, shape), contiguous=False)
+    return str(path)
+
+
+def worker_threads(image, page_num):
+    #page_fn run in pool workers
+    return segmentation._worker_threads
+
+
+def test_label_large_page():
+    for seed in range(3):
+        image = synthetic_page(seed)
+        expected = label(image > threshold_otsu(image))
+        for tile_shape in ((64, 64), (100, 37)):
+            labels = segmentation.label_large_page(image, tile_shape, workers=2)
+            assert np.array_equal(labels, expected)
+        assert segmentation.tiled_threshold_otsu(image, (50, 50)) == threshold_otsu(image)
+
+
+def test_tiled_threshold_dtypes():
+    page = synthetic_page(0, (128, 128))
+    images = [page.astype(dtype) for dtype in (np.uint8, np.uint32, np.int64, np.float32)]
+    #signed images with negative values
+    images += [(page.astype(np.int32) - 2000).astype(dtype) for dtype in (np.int16, np.int64)]
+    for image in images:
+        assert segmentation.tiled_threshold_otsu(image, (50, 50)) == threshold_otsu(image)
+    #threshold_otsu() can't take uint64, whose values beyond int64 are
+    #counted offset from the minimum
+    expected = threshold_otsu(page.astype(np.int64)) + 2**63
+    large = page.astype(np.uint64) + np.uint64(2**63)
+    assert segmentation.tiled_threshold_otsu(large, (50, 50)) == expected
+
+
+def test_large_page_threads(monkeypatch):
+    #ThreadPoolExecutor(None) would start min(32, cpu_count + 4) threads
+    thread_counts = []
+    thread_pool = concurrent.futures.ThreadPoolExecutor
+
+    def recording_pool(max_workers=None, *args, **kwargs):
+        thread_counts.append(max_workers)
+        return thread_pool(max_workers, *args, **kwargs)
+
+    monkeypatch.setattr(concurrent.futures, "ThreadPoolExecutor", recording_pool)
+    image = synthetic_page(0)
+    segmentation.label_large_page(image, (64, 64))
+    assert thread_counts == [os.cpu_count()]*2
+    thread_counts.clear()
+    monkeypatch.setattr(segmentation, "_worker_threads", 3)
+    segmentation.label_large_page(image, (64, 64))
+    assert thread_counts == [3]*2
+
+
+def test_pool_worker_threads(tmp_path):
+    filename = write_stack(tmp_path/"stack.tif", 4, (32, 32))
+    results = [threads for _, threads in segmentation.iter_pages(
+        filename, worker_threads, workers=2, chunk_size=1)]
+    assert results == [max(1, os.cpu_count()//2)]*4
+
+
+def test_pool_matches_serial(tmp_path):
+    #pooled pages in chunks that don't divide the stack come back in page
+    #order with the same results as serial ones
+    filename = write_stack(tmp_path/"stack.tif", 7, (128, 128))
+    serial = list(segmentation.iter_page_eccentricities(filename, workers=1))
+    assert [page_num for page_num, _ in serial] == list(range(7))
+    for workers, chunk_size in ((2, 1), (2, 3), (3, 16)):
+        pooled = list(segmentation.iter_page_eccentricities(filename, workers=workers,
+                                                            chunk_size=chunk_size))
+        assert pooled == serial
+    table = segmentation.get_feature_table(filename, workers=1)
+    pooled_table = segmentation.get_feature_table(filename, workers=2, chunk_size=2)
+    assert np.array_equal(pooled_table, table)
+    assert np.all(np.diff(table["page"]) >= 0)
+
+
+def wait_for(condition, timeout=5):
+    end = time.perf_counter() + timeout
+    while not condition():
+        assert time.perf_counter() < end, "timed out"
+        time.sleep(0.005)
+
+
+def frame_metadata(frame_num):
+    return {"Axes": {"time": frame_num}}
+
+
+@pytest.mark.parametrize("extension", [".npy", ""])
+def test_online_segmenter_matches_offline(tmp_path, extension):
+    pages = [synthetic_page(seed, (128, 128)) for seed in range(6)]
+    path = str(tmp_path/f"features{extension}")
+    with segmentation.OnlineSegmenter(path, workers=3) as segmenter:
+        for frame_num, page in enumerate(pages):
+            image, metadata = segmenter(page, frame_metadata(frame_num))
+            assert image is page and metadata == frame_metadata(frame_num)
+    stats = segmenter.stats()
+    assert (stats["received"], stats["segmented"], stats["dropped"],
+            stats["queue_depth"]) == (6, 6, 0, 0)
+    assert 0 < stats["lag_s"] <= stats["max_lag_s"]
+    assert stats["mean_segment_ms"] > 0
+    expected = np.concatenate([segmentation.extract_features(page, page_num)
+                               for page_num, page in enumerate(pages)])
+    assert np.array_equal(features.load_table(str(tmp_path/"features.npy")), expected)
+    with open(tmp_path/"features_frames.json") as file:
+        assert json.load(file) == [frame_metadata(num)["Axes"] for num in range(6)]
+    assert sorted(os.listdir(tmp_path)) == ["features.npy", "features_frames.json"]
+
+
+class SlowFeatures():
+    #extract_features() that waits until released, like segmentation falling
+    #behind the acquisition
+    def __init__(self):
+        self.release = threading.Event()
+        self.extract_features = segmentation.extract_features
+
+    def __call__(self, image, page_num, properties):
+        assert self.release.wait(5)
+        return self.extract_features(image, page_num, properties)
+
+
+def test_online_segmenter_drop(tmp_path, monkeypatch):
+    slow_features = SlowFeatures()
+    monkeypatch.setattr(segmentation, "extract_features", slow_features)
+    page = synthetic_page(0, (64, 64))
+    segmenter = segmentation.OnlineSegmenter(str(tmp_path/"features.npy"), workers=1,
+                                             max_queue=2, policy="drop")
+    for frame_num in range(5):
+        segmenter(page, frame_metadata(frame_num))
+    stats = segmenter.stats()
+    assert (stats["received"], stats["segmented"], stats["dropped"],
+            stats["queue_depth"]) == (5, 0, 3, 2)
+    slow_features.release.set()
+    segmenter.close()
+    stats = segmenter.stats()
+    assert (stats["segmented"], stats["dropped"], stats["queue_depth"]) == (2, 3, 0)
+    #dropped frames have axes but no features
+    table = features.load_table(str(tmp_path/"features.npy"))
+    assert set(table["page"]) == {0, 1}
+    with open(tmp_path/"features_frames.json") as file:
+        assert len(json.load(file)) == 5
+
+
+def test_online_segmenter_block(tmp_path, monkeypatch):
+    slow_features = SlowFeatures()
+    monkeypatch.setattr(segmentation, "extract_features", slow_features)
+    page = synthetic_page(0, (64, 64))
+    segmenter = segmentation.OnlineSegmenter(str(tmp_path/"features.npy"), workers=1,
+                                             max_queue=2, policy="block")
+
+    def acquire():
+        for frame_num in range(4):
+            segmenter(page, frame_metadata(frame_num))
+
+    thread = threading.Thread(target=acquire, daemon=True)
+    thread.start()
+    #third frame waits for a free slot
+    thread.join(0.2)
+    assert thread.is_alive()
+    assert segmenter.stats()["received"] == 3
+    slow_features.release.set()
+    thread.join(5)
+    assert not thread.is_alive()
+    segmenter.close()
+    stats = segmenter.stats()
+    assert (stats["received"], stats["segmented"], stats["dropped"]) == (4, 4, 0)
+    assert stats["max_lag_s"] >= 0.2
+    assert set(features.load_table(str(tmp_path/"features.npy"))["page"]) == set(range(4))
+
+
+def test_online_segmenter_error(tmp_path, monkeypatch):
+    extract_features = segmentation.extract_features
+
+    def failing_features(image, page_num, properties):
+        if page_num == 1:
+            raise ValueError("bad frame")
+        return extract_features(image, page_num, properties)
+
+    monkeypatch.setattr(segmentation, "extract_features", failing_features)
+    page = synthetic_page(0, (64, 64))
+    segmenter = segmentation.OnlineSegmenter(str(tmp_path/"features.npy"), workers=1)
+    segmenter(page, frame_metadata(0))
+    segmenter(page, frame_metadata(1))
+    wait_for(lambda: segmenter._error is not None)
+    #next frame stops the acquisition instead of waiting for close()
+    with pytest.raises(ValueError, match="bad frame"):
+        segmenter(page, frame_metadata(2))
+    assert segmenter.stats()["received"] == 2
+    with pytest.raises(ValueError, match="bad frame"):
+        segmenter.close()
+
+
+def test_online_segmenter_periodic_save(tmp_path):
+    pages = [synthetic_page(seed, (64, 64)) for seed in range(3)]
+    path = str(tmp_path/"features.npy")
+    frames_path = str(tmp_path/"features_frames.json")
+    segmenter = segmentation.OnlineSegmenter(path, workers=1, save_interval_s=0)
+    for frame_num, page in enumerate(pages[:2]):
+        segmenter(page, frame_metadata(frame_num))
+    #saved while the acquisition is still running
+    wait_for(lambda: os.path.exists(path) and set(features.load_table(path)["page"]) == {0, 1})
+    with open(frames_path) as file:
+        assert len(json.load(file)) == 2
+    segmenter(pages[2], frame_metadata(2))
+    segmenter.close()
+    assert set(features.load_table(path)["page"]) == {0, 1, 2}
+    with open(frames_path) as file:
+        assert len(json.load(file)) == 3
+    #no saves while frames arrive within save_interval_s
+    path = str(tmp_path/"later.npy")
+    segmenter = segmentation.OnlineSegmenter(path, workers=1)
+    segmenter(pages[0], frame_metadata(0))
+    wait_for(lambda: segmenter.stats()["segmented"] == 1)
+    time.sleep(0.05)
+    assert not os.path.exists(path)
+    segmenter.save()
+    assert len(features.load_table(path)) == len(segmentation.extract_features(pages[0]))
+    segmenter.close()
@@ -0,0 +1,998 @@
+"""
+Module that contains an in-process simulation of the Micro-Manager studio
+and core, used by pycro.py when the PYCRO_BACKEND environment variable is
+"sim". Acquisition code can then be tested and benchmarked without a running
+Micro-Manager.
+
+Only the parts of the studio and core API used in this repo are simulated.
+Every method call on a simulated object waits settings.call_latency to stand
+in for a round trip over the pycromanager bridge, and stage moves, channel
+switches and exposures take time according to settings. The camera has the
+same "Noise" and "Artificial Waves" modes as the demo camera (see problem_2).
+Datastores and acquisitions create their directories like the real ones, and
+frames are saved in them with tifffile if settings.write_to_disk is True.
+"""
+import functools
+import json
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+
+import numpy as np
+import tifffile
+
+CAMERA = "Camera"
+FOCUS = "Z"
+XY_STAGE = "XY"
+WHEEL = "Wheel"
+CHANNEL_GROUP = "Channel"
+#channel configs of simulated channel group, as (device, property): value
+CHANNEL_CONFIGS = {channel: {(WHEEL, "Label"): channel}
+                   for channel in ("DAPI", "FITC", "Rhodamine", "Cy5")}
+#number of noise frames generated and cycled through in "Noise" mode
+_NUM_NOISE_FRAMES = 8
+
+
+class SimSettings():
+    """
+    Timing and camera settings shared by all simulated objects. Can be
+    changed at any time, e.g. pycro.core.settings.call_latency = 0.001.
+
+    ## Attributes:
+
+    #### call_latency: float
+        seconds every simulated bridge call takes.
+
+    #### bridge_bandwidth: float
+        bytes/s at which pixels cross the bridge, when tagged images are
+        sent to Python or converted back to MM Images. 0 is unlimited.
+
+    #### xy_speed, xy_settle: float
+        xy stage speed in um/s and settle time in s after a move.
+
+    #### z_speed, z_settle: float
+        focus stage speed in um/s and settle time in s after a move.
+
+    #### channel_switch_time: float
+        seconds it takes to change the channel (filter wheel).
+
+    #### readout_time: float
+        seconds of camera readout after each exposure.
+
+    #### frame_shape: tuple[int, int]
+        camera frame shape (rows, columns).
+
+    #### noise_mean, noise_std: float
+        mean and standard deviation of pixel values in "Noise" mode.
+
+    #### sequenceable: bool
+        whether focus stage and filter wheel support hardware sequencing.
+
+    #### max_sequence_length: int
+        maximum length of stage and property sequences.
+
+    #### write_to_disk: bool
+        whether datastores and acquisitions write frames to disk.
+    """
+    def __init__(self):
+        self.call_latency = 0.0002
+        self.bridge_bandwidth = 200e6
+        self.xy_speed = 10000.
+        self.xy_settle = 0.01
+        self.z_speed = 1000.
+        self.z_settle = 0.002
+        self.channel_switch_time = 0.01
+        self.readout_time = 0.002
+        self.frame_shape = (512, 512)
+        self.noise_mean = 500.
+        self.noise_std = 100.
+        self.sequenceable = True
+        self.max_sequence_length = 1024
+        self.write_to_disk = True
+
+
+settings = SimSettings()
+#functions called with no arguments on every simulated bridge call. Used by
+#pycro.RoundTripCounter.
+call_hooks = []
+
+
+def _wait(seconds):
+    if seconds > 0:
+        time.sleep(seconds)
+
+
+def _bridge_call():
+    for hook in call_hooks:
+        hook()
+    _wait(settings.call_latency)
+
+
+def _transfer(pixels):
+    #pixels crossing the bridge take time according to their size
+    if settings.bridge_bandwidth:
+        _wait(pixels.nbytes/settings.bridge_bandwidth)
+
+
+def _bridged(cls):
+    #wraps every public method so it behaves like a call over the bridge
+    def wrap(method):
+        @functools.wraps(method)
+        def bridged(*args, **kwargs):
+            _bridge_call()
+            return method(*args, **kwargs)
+        return bridged
+
+    for name, attr in list(vars(cls).items()):
+        if callable(attr) and not name.startswith("_"):
+            setattr(cls, name, wrap(attr))
+    return cls
+
+
+@_bridged
+class SimList(list):
+    """
+    java.util.ArrayList and mmcorej vector stand in.
+    """
+    def add(self, value):
+        self.append(value)
+        return True
+
+    def get(self, index):
+        return self[index]
+
+    def size(self):
+        return len(self)
+
+    def contains(self, value):
+        return value in self
+
+    def clear(self):
+        super().clear()
+
+
+@_bridged
+class SimPropertySetting():
+    def __init__(self, device, prop, value):
+        self._device = device
+        self._prop = prop
+        self._value = value
+
+    def get_device_label(self):
+        return self._device
+
+    def get_property_name(self):
+        return self._prop
+
+    def get_property_value(self):
+        return self._value
+
+
+@_bridged
+class SimConfiguration():
+    def __init__(self, config):
+        self._settings = [SimPropertySetting(device, prop, value)
+                          for (device, prop), value in config.items()]
+
+    def size(self):
+        return len(self._settings)
+
+    def get_setting(self, index_or_device, prop=None):
+        if prop is None:
+            return self._settings[index_or_device]
+        for setting in self._settings:
+            if (setting._device, setting._prop) == (index_or_device, prop):
+                return setting
+        raise KeyError(f"{index_or_device}-{prop} not in configuration")
+
+
+class SimTaggedImage():
+    """
+    TaggedImage stand in with flattened pixels in pix and tags dict.
+    """
+    def __init__(self, pix, tags):
+        self.pix = pix
+        self.tags = tags
+
+
+@_bridged
+class SimCore():
+    """
+    Simulated CMMCore. Public methods have the same snake case names as the
+    pycromanager Core.
+    """
+    def __init__(self, sim_settings: SimSettings = settings):
+        self.settings = sim_settings
+        self._properties = {(CAMERA, "Mode"): "Artificial Waves",
+                            (CAMERA, "Exposure"): "10.0",
+                            (WHEEL, "Label"): "DAPI"}
+        self._xy = (0., 0.)
+        self._z = 0.
+        self._image = None
+        self._frame_num = 0
+        self._noise_frames = {}
+        self._stage_sequence = None
+        self._property_sequences = {}
+        self._buffer = []
+        self._buffer_lock = threading.Lock()
+        self._sequence_thread = None
+        self._stop_sequence = threading.Event()
+
+    #device state
+    def _set_property(self, device, prop, value):
+        value = str(value)
+        if device == WHEEL and self._properties.get((device, prop)) != value:
+            _wait(self.settings.channel_switch_time)
+        self._properties[(device, prop)] = value
+
+    def _set_config(self, group, config):
+        for (device, prop), value in CHANNEL_CONFIGS[config].items():
+            self._set_property(device, prop, value)
+
+    def _set_xy(self, x_pos, y_pos):
+        delta = (abs(x_pos - self._xy[0]), abs(y_pos - self._xy[1]))
+        if any(delta):
+            _wait(max(delta)/self.settings.xy_speed + self.settings.xy_settle)
+        self._xy = (float(x_pos), float(y_pos))
+
+    def _set_z(self, z_pos):
+        delta = abs(z_pos - self._z)
+        if delta:
+            _wait(delta/self.settings.z_speed + self.settings.z_settle)
+        self._z = float(z_pos)
+
+    def _exposure_s(self):
+        return float(self._properties[(CAMERA, "Exposure")])/1000
+
+    def _make_frame(self):
+        shape = tuple(self.settings.frame_shape)
+        self._frame_num += 1
+        if self._properties[(CAMERA, "Mode")] == "Noise":
+            key = (shape, self.settings.noise_mean, self.settings.noise_std)
+            if key not in self._noise_frames:
+                rng = np.random.default_rng(0)
+                frames = rng.normal(key[1], key[2], (_NUM_NOISE_FRAMES,) + shape)
+                self._noise_frames[key] = np.clip(frames.round(), 0, 65535).astype(np.uint16)
+            return self._noise_frames[key][self._frame_num % _NUM_NOISE_FRAMES].copy()
+        #artificial waves drift with each frame and depend on z
+        phase = self._frame_num/10 + self._z
+        rows = np.sin(np.arange(shape[0])/20 + phase)
+        columns = np.cos(np.arange(shape[1])/30 - phase)
+        return (1000 + 800*np.add.outer(rows, columns)/2).astype(np.uint16)
+
+    def _snap(self):
+        _wait(self._exposure_s() + self.settings.readout_time)
+        self._image = self._make_frame()
+        return self._image
+
+    def _tags(self):
+        return {"Width": self.settings.frame_shape[1], "Height": self.settings.frame_shape[0],
+                "PixelType": "GRAY16", "XPositionUm": self._xy[0],
+                "YPositionUm": self._xy[1], "ZPositionUm": self._z,
+                "Exposure": self._exposure_s()*1000, CHANNEL_GROUP: self._channel(),
+                "ElapsedTime-ms": time.perf_counter()*1000}
+
+    def _channel(self):
+        label = self._properties[(WHEEL, "Label")]
+        return label if label in CHANNEL_CONFIGS else ""
+
+    #devices
+    def get_camera_device(self):
+        return CAMERA
+
+    def get_focus_device(self):
+        return FOCUS
+
+    def get_xy_stage_device(self):
+        return XY_STAGE
+
+    def get_property(self, device, prop):
+        return self._properties[(device, prop)]
+
+    def set_property(self, device, prop, value):
+        self._set_property(device, prop, value)
+
+    def set_exposure(self, exposure):
+        self._properties[(CAMERA, "Exposure")] = str(float(exposure))
+
+    def get_exposure(self):
+        return float(self._properties[(CAMERA, "Exposure")])
+
+    #config groups
+    def set_config(self, group, config):
+        self._set_config(group, config)
+
+    def get_current_config(self, group):
+        return self._channel()
+
+    def get_config_data(self, group, config):
+        return SimConfiguration(CHANNEL_CONFIGS[config])
+
+    #stages
+    def set_xy_position(self, x_pos, y_pos):
+        self._set_xy(x_pos, y_pos)
+
+    def get_x_position(self):
+        return self._xy[0]
+
+    def get_y_position(self):
+        return self._xy[1]
+
+    def set_position(self, z_pos):
+        self._set_z(z_pos)
+
+    def get_position(self):
+        return self._z
+
+    #camera
+    def snap_image(self):
+        self._snap()
+
+    def get_image(self):
+        return self._image
+
+    def get_tagged_image(self):
+        _transfer(self._image)
+        return SimTaggedImage(self._image.ravel(), self._tags())
+
+    def get_image_width(self):
+        return self.settings.frame_shape[1]
+
+    def get_image_height(self):
+        return self.settings.frame_shape[0]
+
+    def get_bytes_per_pixel(self):
+        return 2
+
+    def get_image_bit_depth(self):
+        return 16
+
+    #sequencing
+    def is_stage_sequenceable(self, device):
+        return self.settings.sequenceable
+
+    def get_stage_sequence_max_length(self, device):
+        return self.settings.max_sequence_length
+
+    def load_stage_sequence(self, device, sequence):
+        self._stage_sequence = [float(z_pos) for z_pos in sequence]
+
+    def start_stage_sequence(self, device):
+        pass
+
+    def stop_stage_sequence(self, device):
+        pass
+
+    def is_property_sequenceable(self, device, prop):
+        return self.settings.sequenceable
+
+    def get_property_sequence_max_length(self, device, prop):
+        return self.settings.max_sequence_length
+
+    def load_property_sequence(self, device, prop, sequence):
+        self._property_sequences[(device, prop)] = [str(value) for value in sequence]
+
+    def start_property_sequence(self, device, prop):
+        pass
+
+    def stop_property_sequence(self, device, prop):
+        pass
+
+    def _run_sequence(self, num_images):
+        #triggered devices switch during readout, so frames come every
+        #exposure + readout.
+        for frame_num in range(num_images):
+            if self._stop_sequence.is_set():
+                return
+            if self._stage_sequence:
+                self._z = self._stage_sequence[frame_num % len(self._stage_sequence)]
+            for (device, prop), values in self._property_sequences.items():
+                self._properties[(device, prop)] = values[frame_num % len(values)]
+            frame = self._snap()
+            with self._buffer_lock:
+                self._buffer.append(SimTaggedImage(frame.ravel(), self._tags()))
+
+    def start_sequence_acquisition(self, num_images, interval_ms, stop_on_overflow):
+        self._stop_sequence.clear()
+        self._sequence_thread = threading.Thread(target=self._run_sequence,
+                                                 args=(num_images,), daemon=True)
+        self._sequence_thread.start()
+
+    def stop_sequence_acquisition(self):
+        self._stop_sequence.set()
+        if self._sequence_thread:
+            self._sequence_thread.join()
+        self._stage_sequence = None
+        self._property_sequences = {}
+
+    def is_sequence_running(self):
+        return bool(self._sequence_thread and self._sequence_thread.is_alive())
+
+    def get_remaining_image_count(self):
+        return len(self._buffer)
+
+    def pop_next_tagged_image(self):
+        with self._buffer_lock:
+            tagged_image = self._buffer.pop(0)
+        _transfer(tagged_image.pix)
+        return tagged_image
+
+
+@_bridged
+class SimCoords():
+    def __init__(self, axes):
+        self._axes = dict(axes)
+
+    def get_c(self):
+        return self._axes.get("channel", 0)
+
+    def get_z(self):
+        return self._axes.get("z", 0)
+
+    def get_t(self):
+        return self._axes.get("time", 0)
+
+    def get_p(self):
+        return self._axes.get("position", 0)
+
+    def get_axes(self):
+        return SimList(self._axes)
+
+
+@_bridged
+class SimCoordsBuilder():
+    def __init__(self, axes=None):
+        self._axes = dict(axes or {})
+
+    def c(self, num):
+        self._axes["channel"] = num
+        return self
+
+    def z(self, num):
+        self._axes["z"] = num
+        return self
+
+    def t(self, num):
+        self._axes["time"] = num
+        return self
+
+    def p(self, num):
+        self._axes["position"] = num
+        return self
+
+    def build(self):
+        return SimCoords(self._axes)
+
+
+@_bridged
+class SimMetadata():
+    def __init__(self, values):
+        self._values = dict(values)
+
+    def copy_builder_preserving_uuid(self):
+        return SimMetadataBuilder(self._values)
+
+    def copy_builder_with_new_uuid(self):
+        return SimMetadataBuilder({**self._values, "UUID": str(uuid.uuid4())})
+
+
+@_bridged
+class SimMetadataBuilder():
+    def __init__(self, values=None):
+        self._values = dict(values or {"UUID": str(uuid.uuid4())})
+
+    def x_position_um(self, x_pos):
+        self._values["XPositionUm"] = x_pos
+        return self
+
+    def y_position_um(self, y_pos):
+        self._values["YPositionUm"] = y_pos
+        return self
+
+    def z_position_um(self, z_pos):
+        self._values["ZPositionUm"] = z_pos
+        return self
+
+    def build(self):
+        return SimMetadata(self._values)
+
+
+@_bridged
+class SimSummaryMetadata():
+    def __init__(self, values=None):
+        self._values = dict(values or {})
+
+    def copy_builder(self):
+        return SimSummaryMetadataBuilder(self._values)
+
+
+@_bridged
+class SimSummaryMetadataBuilder():
+    def __init__(self, values):
+        self._values = dict(values)
+
+    def channel_names(self, channels):
+        self._values["ChNames"] = list(channels)
+        return self
+
+    def z_step_um(self, step):
+        self._values["z-step_um"] = step
+        return self
+
+    def wait_interval(self, interval_ms):
+        self._values["Interval_ms"] = interval_ms
+        return self
+
+    def start_date(self, date):
+        self._values["StartTime"] = date
+        return self
+
+    def axis_order(self, axes):
+        self._values["AxisOrder"] = list(axes)
+        return self
+
+    def intended_dimensions(self, coords):
+        self._values["IntendedDimensions"] = dict(coords._axes)
+        return self
+
+    def build(self):
+        return SimSummaryMetadata(self._values)
+
+
+@_bridged
+class SimImage():
+    def __init__(self, pixels, coords=None, metadata=None):
+        self._pixels = pixels
+        self._coords = coords or SimCoords({})
+        self._metadata = metadata or SimMetadata({})
+
+    def copy_with(self, coords, metadata):
+        return SimImage(self._pixels, coords, metadata)
+
+    def get_coords(self):
+        return self._coords
+
+    def get_metadata(self):
+        return self._metadata
+
+    def get_raw_pixels(self):
+        return self._pixels
+
+    def get_width(self):
+        return self._pixels.shape[1]
+
+    def get_height(self):
+        return self._pixels.shape[0]
+
+
+class _SaveModes():
+    MULTIPAGE_TIFF = "MULTIPAGE_TIFF"
+    SINGLEPLANE_TIFF_SERIES = "SINGLEPLANE_TIFF_SERIES"
+
+
+@_bridged
+class SimDatastore():
+    """
+    Datastore stand in. Images are appended to a single TIFF file in
+    save_path if settings.write_to_disk is True.
+    """
+    def __init__(self, save_path):
+        os.makedirs(save_path, exist_ok=True)
+        self._save_path = save_path
+        self._writer = None
+        self._frozen = False
+        self.num_images = 0
+
+    def set_summary_metadata(self, summary_metadata):
+        self._summary = summary_metadata
+
+    def put_image(self, image):
+        if self._frozen:
+            raise RuntimeError("datastore is frozen")
+        if settings.write_to_disk:
+            if not self._writer:
+                name = f"{os.path.basename(self._save_path)}_MMStack.tif"
+                self._writer = tifffile.TiffWriter(os.path.join(self._save_path, name),
+                                                   bigtiff=True)
+            self._writer.write(image._pixels, contiguous=True)
+        self.num_images += 1
+
+    def freeze(self):
+        self._frozen = True
+
+    def save(self):
+        pass
+
+    def close(self):
+        if self._writer:
+            self._writer.close()
+            self._writer = None
+
+
+@_bridged
+class SimDataManager():
+    def __init__(self, core):
+        self._core = core
+
+    def coords_builder(self):
+        return SimCoordsBuilder()
+
+    def metadata_builder(self):
+        return SimMetadataBuilder()
+
+    def create_multipage_tiff_datastore(self, save_path, generate_separate_metadata,
+                                        split_positions):
+        return SimDatastore(save_path)
+
+    def get_preferred_save_mode(self):
+        return _SaveModes()
+
+    def convert_tagged_image(self, tagged_image):
+        tags = tagged_image.tags
+        _transfer(tagged_image.pix)
+        pixels = tagged_image.pix.reshape(tags["Height"], tags["Width"])
+        return SimImage(pixels, metadata=SimMetadata(tags))
+
+
+@_bridged
+class SimChannelSpec():
+    def __init__(self, values):
+        self.values = dict(values)
+
+
+@_bridged
+class SimChannelSpecBuilder():
+    def __init__(self):
+        self._values = {}
+
+    def channel_group(self, group):
+        self._values["group"] = group
+        return self
+
+    def config(self, config):
+        self._values["config"] = config
+        return self
+
+    def do_z_stack(self, do_z_stack):
+        self._values["do_z_stack"] = do_z_stack
+        return self
+
+    def build(self):
+        return SimChannelSpec(self._values)
+
+
+@_bridged
+class SimSequenceSettings():
+    def __init__(self, values):
+        self.values = dict(values)
+
+
+@_bridged
+class SimSequenceSettingsBuilder():
+    """
+    SequenceSettings.Builder stand in. Every builder method stores its
+    argument under its name.
+    """
+    _NAMES = ("channel_group", "channels", "prefix", "save", "root", "save_mode",
+              "slice_z_bottom_um", "slice_z_top_um", "slice_z_step_um",
+              "use_channels", "use_position_list", "use_slices")
+
+    def __init__(self):
+        self._values = {}
+
+    def __getattr__(self, name):
+        if name not in self._NAMES:
+            raise AttributeError(name)
+
+        def setter(value):
+            _bridge_call()
+            self._values[name] = value
+            return self
+        return setter
+
+    def build(self):
+        return SimSequenceSettings(self._values)
+
+
+@_bridged
+class SimAcquisitionManager():
+    def __init__(self, studio):
+        self._studio = studio
+
+    def generate_summary_metadata(self):
+        return SimSummaryMetadata()
+
+    def generate_metadata(self, image, include_hardware_state):
+        core = self._studio._core
+        values = {**image._metadata._values, "UUID": str(uuid.uuid4()),
+                  "ReceivedTime": str(datetime.now())}
+        if include_hardware_state:
+            values.update(core._tags())
+        return SimMetadata(values)
+
+    def channel_spec_builder(self):
+        return SimChannelSpecBuilder()
+
+    def sequence_settings_builder(self):
+        return SimSequenceSettingsBuilder()
+
+    def run_acquisition_with_settings(self, sequence_settings, block):
+        #runs like the MDA engine, on the "Java side" so without bridge calls
+        values = sequence_settings.values
+        core = self._studio._core
+        positions = self._studio._position_list._positions if values.get("use_position_list") else [None]
+        if values.get("use_slices"):
+            bottom, top = values["slice_z_bottom_um"], values["slice_z_top_um"]
+            step = values["slice_z_step_um"]
+            num_slices = int(round(abs(top - bottom)/step)) + 1
+            slices = [bottom + num*step*np.sign(top - bottom) for num in range(num_slices)]
+        else:
+            slices = [None]
+        if values.get("use_channels"):
+            channels = [spec.values["config"] for spec in values["channels"]]
+        else:
+            channels = [None]
+        root = os.path.join(values.get("root", "."), values.get("prefix", "acq"))
+        for pos_num, position in enumerate(positions):
+            datastore = SimDatastore(f"{root}/Pos{pos_num}") if values.get("save") else None
+            if position:
+                core._set_xy(position._x, position._y)
+            for z_num, z_pos in enumerate(slices):
+                if z_pos is not None:
+                    core._set_z(z_pos)
+                for c_num, channel in enumerate(channels):
+                    if channel:
+                        core._set_config(values["channel_group"], channel)
+                    pixels = core._snap()
+                    if datastore:
+                        coords = SimCoords({"position": pos_num, "z": z_num, "channel": c_num})
+                        datastore.put_image(SimImage(pixels, coords, SimMetadata(core._tags())))
+            if datastore:
+                datastore.close()
+
+
+@_bridged
+class SimSnapLiveManager():
+    def __init__(self, studio):
+        self._studio = studio
+
+    def snap(self, display):
+        core = self._studio._core
+        pixels = core._snap()
+        return SimList([SimImage(pixels, metadata=SimMetadata(core._tags()))])
+
+
+@_bridged
+class SimMultiStagePosition():
+    def __init__(self, xy_stage, x_pos, y_pos, z_stage, z_pos):
+        self._xy_stage = xy_stage
+        self._z_stage = z_stage
+        self._x = float(x_pos)
+        self._y = float(y_pos)
+        self._z = float(z_pos)
+        self._label = ""
+
+    def set_label(self, label):
+        self._label = label
+
+    def get_label(self):
+        return self._label
+
+    def get_x(self):
+        return self._x
+
+    def get_y(self):
+        return self._y
+
+    def get_z(self):
+        return self._z
+
+
+@_bridged
+class SimPositionList():
+    def __init__(self, positions=()):
+        self._positions = list(positions)
+
+    def clear_all_positions(self):
+        self._positions = []
+
+    def add_position(self, position):
+        self._positions.append(position)
+
+    def get_number_of_positions(self):
+        return len(self._positions)
+
+    def get_position(self, index):
+        return self._positions[index]
+
+    def replace_position(self, index, position):
+        self._positions[index] = position
+
+    def remove_position(self, index):
+        del self._positions[index]
+
+    def load(self, path):
+        #position list file in property map format, parsed on the "Java
+        #side" so without bridge calls
+        with open(path) as file:
+            stage_positions = json.load(file)["map"]["StagePositions"]["array"]
+        self._positions = []
+        for stage_position in stage_positions:
+            xy_stage = stage_position["DefaultXYStage"]["scalar"]
+            z_stage = stage_position["DefaultZStage"]["scalar"]
+            device_positions = {device["Device"]["scalar"]: device["Position_um"]["array"]
+                                for device in stage_position["DevicePositions"]["array"]}
+            (x_pos, y_pos), (z_pos,) = device_positions[xy_stage], device_positions[z_stage]
+            position = SimMultiStagePosition(xy_stage, x_pos, y_pos, z_stage, z_pos)
+            position._label = stage_position["Label"]["scalar"]
+            self._positions.append(position)
+
+    def save(self, path):
+        #same property map format as load() reads
+        stage_positions = []
+        for position in self._positions:
+            device_positions = [
+                {"Device": {"type": "STRING", "scalar": position._z_stage},
+                 "Position_um": {"type": "DOUBLE", "array": [position._z]}},
+                {"Device": {"type": "STRING", "scalar": position._xy_stage},
+                 "Position_um": {"type": "DOUBLE", "array": [position._x, position._y]}}]
+            stage_positions.append({
+                "DefaultXYStage": {"type": "STRING", "scalar": position._xy_stage},
+                "DefaultZStage": {"type": "STRING", "scalar": position._z_stage},
+                "DevicePositions": {"type": "PROPERTY_MAP", "array": device_positions},
+                "Label": {"type": "STRING", "scalar": position._label}})
+        with open(path, "w") as file:
+            file.write(json.dumps({"encoding": "UTF-8", "format": "Micro-Manager Property Map",
+                                   "major_version": 2, "minor_version": 0,
+                                   "map": {"StagePositions": {"type": "PROPERTY_MAP",
+                                                              "array": stage_positions}}}))
+
+
+@_bridged
+class SimPositionListManager():
+    def __init__(self, studio):
+        self._studio = studio
+
+    def get_position_list(self):
+        return SimPositionList(self._studio._position_list._positions)
+
+    def set_position_list(self, position_list):
+        self._studio._position_list = SimPositionList(position_list._positions)
+
+
+@_bridged
+class SimStudio():
+    """
+    Simulated Studio. Managers are created once, but every getter call still
+    counts as a bridge call.
+    """
+    def __init__(self, core: SimCore):
+        self._core = core
+        self._data = SimDataManager(core)
+        self._acquisitions = SimAcquisitionManager(self)
+        self._live = SimSnapLiveManager(self)
+        self._positions = SimPositionListManager(self)
+        self._position_list = SimPositionList()
+
+    def data(self):
+        return self._data
+
+    def acquisitions(self):
+        return self._acquisitions
+
+    def live(self):
+        return self._live
+
+    def positions(self):
+        return self._positions
+
+    def core(self):
+        return self._core
+
+
+def java_object(classpath: str, args: list | None = None):
+    """
+    returns simulated stand in for JavaObject(classpath, args=args).
+    """
+    #constructing a Java object is a round trip too
+    _bridge_call()
+    if classpath in ("java.util.ArrayList", "mmcorej.DoubleVector", "mmcorej.StrVector"):
+        return SimList()
+    if classpath == "org.micromanager.MultiStagePosition":
+        return SimMultiStagePosition(*args)
+    if classpath == "org.micromanager.PositionList":
+        return SimPositionList()
+    raise ValueError(f"{classpath} isn't simulated")
+
+
+class SimAcquisition():
+    """
+    Stand in for pycromanager.Acquisition that runs events in the calling
+    thread against the simulated core. Like the Java acquisition engine,
+    hardware and camera control don't go over the bridge. Supports the
+    hooks used in this repo: image_process_fn, pre_hardware_hook_fn,
+    post_hardware_hook_fn, post_camera_hook_fn and image_saved_fn. Other
+    keyword arguments are ignored.
+    """
+    def __init__(self, directory=None, name=None, image_process_fn=None,
+                 pre_hardware_hook_fn=None, post_hardware_hook_fn=None,
+                 post_camera_hook_fn=None, image_saved_fn=None, core=None, **kwargs):
+        self._core = core
+        self._image_process_fn = image_process_fn
+        self._pre_hardware_hook_fn = pre_hardware_hook_fn
+        self._post_hardware_hook_fn = post_hardware_hook_fn
+        self._post_camera_hook_fn = post_camera_hook_fn
+        self._image_saved_fn = image_saved_fn
+        self._writer = None
+        self.num_images = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if directory and settings.write_to_disk:
+            path = os.path.join(directory, f"{name or 'acquisition'}.tif")
+            self._writer = tifffile.TiffWriter(path, bigtiff=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        if self._writer:
+            self._writer.close()
+
+    def acquire(self, events):
+        if isinstance(events, dict):
+            events = [events]
+        for event in events:
+            if isinstance(event, list):
+                self.acquire(event)
+            else:
+                self._run_event(event)
+
+    def _run_event(self, event):
+        core = self._core
+        if self._pre_hardware_hook_fn:
+            event = self._pre_hardware_hook_fn(event)
+        if "x" in event and "y" in event:
+            core._set_xy(event["x"], event["y"])
+        if "z" in event:
+            core._set_z(event["z"])
+        if "config_group" in event:
+            core._set_config(*event["config_group"])
+        if "exposure" in event:
+            core._properties[(CAMERA, "Exposure")] = str(float(event["exposure"]))
+        if self._post_hardware_hook_fn:
+            event = self._post_hardware_hook_fn(event)
+        pixels = core._snap()
+        if self._post_camera_hook_fn:
+            event = self._post_camera_hook_fn(event)
+        metadata = {**core._tags(), "Axes": event["axes"]}
+        results = [(pixels, metadata)]
+        if self._image_process_fn:
+            #images go to Python for processing and come back to be saved
+            _transfer(pixels)
+            processed = self._image_process_fn(pixels, metadata)
+            #process fn can return (image, metadata), a list of them, or None
+            #to discard the image.
+            if processed is None:
+                results = []
+            elif isinstance(processed, tuple):
+                results = [processed]
+            else:
+                results = processed
+            for image, _ in results:
+                _transfer(image)
+        for image, image_metadata in results:
+            if self._writer:
+                self._writer.write(image, contiguous=True)
+            self.num_images += 1
+            if self._image_saved_fn:
+                self._image_saved_fn(image_metadata["Axes"], self)
+
+
+def create_backend(sim_settings: SimSettings = settings) -> tuple[SimStudio, SimCore]:
+    """
+    returns new simulated (studio, core).
+    """
+    core = SimCore(sim_settings)
+    return SimStudio(core), core
@@ -0,0 +1,136 @@
+"""
+Module that contains the parameter sweep of the problem 3 segmentation, used
+to compare segmentation settings (threshold offset from Otsu's threshold,
+area bounds and Gaussian smoothing) in one pass over the stack instead of
+one run per setting.
+"""
+import functools
+import itertools
+
+import numpy as np
+from skimage.filters import gaussian
+from skimage.measure import regionprops_table
+
+import histogram
+import segmentation
+
+#eccentricity histograms of each setting use this many bins over [0, 1].
+#Medians and percentiles in the table are accurate to a bin width.
+ECCENTRICITY_BINS = 200
+
+
+def sweep_settings(threshold_offsets, area_bounds, smoothings=(0,)
+                   ) -> list[tuple[float, float, int, int]]:
+    """
+    returns every (smoothing, threshold_offset, min_area, max_area)
+    combination of the grids, in that nesting order.
+    """
+    return [(smoothing, offset, min_area, max_area)
+            for smoothing, offset, (min_area, max_area)
+            in itertools.product(smoothings, threshold_offsets, area_bounds)]
+
+
+def _sweep_page(image, page_num, threshold_offsets, area_bounds, smoothings):
+    #runs in pool worker. Smoothing and Otsu's threshold are computed once
+    #per smoothing, and labels and region properties once per threshold.
+    #Area bounds only filter the regions, so they share everything. Pages
+    #are labeled by segmentation.label_page() like in the analysis, so large
+    #frames are labeled in tiles.
+    histograms = {}
+    for smoothing in smoothings:
+        smoothed = image
+        if smoothing:
+            #rounded back to the image dtype, so the threshold is computed
+            #from an exact integer histogram like for unsmoothed images
+            smoothed = gaussian(image, smoothing, preserve_range=True).round().astype(image.dtype)
+        thresh = segmentation.page_threshold(smoothed)
+        for offset in threshold_offsets:
+            labels = segmentation.label_page(smoothed, offset, thresh)
+            columns = regionprops_table(labels, properties=("area", "eccentricity"))
+            for min_area, max_area in area_bounds:
+                in_range = (min_area <= columns["area"]) & (columns["area"] <= max_area)
+                setting_histogram = histogram.StreamingHistogram(ECCENTRICITY_BINS)
+                setting_histogram.add(columns["eccentricity"][in_range])
+                histograms[smoothing, offset, min_area, max_area] = setting_histogram
+    return histograms
+
+
+def sweep_dtype() -> np.dtype:
+    """
+    returns dtype of the comparison table returned by sweep().
+    """
+    return np.dtype([("smoothing", np.float64), ("threshold_offset", np.float64),
+                     ("min_area", np.int32), ("max_area", np.int32),
+                     ("objects", np.int64), ("objects_per_page", np.float64),
+                     ("eccentricity_mean", np.float64), ("eccentricity_std", np.float64),
+                     ("eccentricity_median", np.float64), ("eccentricity_p10", np.float64),
+                     ("eccentricity_p90", np.float64)])
+
+
+def sweep(filename: str, threshold_offsets: tuple[float, ...] = (0,),
+          area_bounds: tuple[tuple[int, int], ...] = ((segmentation.MIN_AREA,
+                                                       segmentation.MAX_AREA),),
+          smoothings: tuple[float, ...] = (0,), workers: int | None = None,
+          chunk_size: int = 16, axes: dict | None = None) -> np.ndarray:
+    """
+    Segments every page of TIFF stack or NDTiff dataset with every setting
+    of the grids and returns a comparison table (structured array, see
+    sweep_dtype()) with one row per setting in sweep_settings() order: the
+    setting, number of objects in the area bounds, objects per page and
+    eccentricity statistics. Pages are read once and sharded across
+    workers, see segmentation.iter_pages() for workers, chunk_size and axes.
+    The table can be saved with features.save_table().
+
+    Parameters:
+
+    threshold_offsets: tuple[float, ...]
+        Offsets in pixel values added to each page's Otsu threshold.
+
+    area_bounds: tuple[tuple[int, int], ...]
+        (min_area, max_area) pairs in pixels.
+
+    smoothings: tuple[float, ...]
+        Standard deviations in pixels of Gaussian smoothing applied before
+        thresholding. 0 doesn't smooth.
+    """
+    threshold_offsets, smoothings = tuple(threshold_offsets), tuple(smoothings)
+    area_bounds = tuple(tuple(bounds) for bounds in area_bounds)
+    settings = sweep_settings(threshold_offsets, area_bounds, smoothings)
+    totals = {setting: histogram.StreamingHistogram(ECCENTRICITY_BINS)
+              for setting in settings}
+    page_fn = functools.partial(_sweep_page, threshold_offsets=threshold_offsets,
+                                area_bounds=area_bounds, smoothings=smoothings)
+    num_pages = 0
+    for _, page_histograms in segmentation.iter_pages(filename, page_fn, workers,
+                                                      chunk_size, axes):
+        num_pages += 1
+        for setting, page_histogram in page_histograms.items():
+            totals[setting].merge(page_histogram)
+
+    table = np.empty(len(settings), sweep_dtype())
+    for row, setting in zip(table, settings):
+        total = totals[setting]
+        row["smoothing"], row["threshold_offset"], row["min_area"], row["max_area"] = setting
+        row["objects"] = total.count
+        row["objects_per_page"] = total.count/num_pages if num_pages else float("nan")
+        row["eccentricity_mean"] = total.mean if total.count else float("nan")
+        row["eccentricity_std"] = total.std
+        row["eccentricity_median"] = total.quantile(0.5)
+        row["eccentricity_p10"] = total.quantile(0.1)
+        row["eccentricity_p90"] = total.quantile(0.9)
+    return table
+
+
+def format_table(table: np.ndarray) -> str:
+    """
+    returns comparison table from sweep() as aligned text, one line per
+    setting.
+    """
+    names = table.dtype.names
+    widths = [max(len(name), 8) for name in names]
+    lines = [" ".join(f"{name:>{width}}" for name, width in zip(names, widths))]
+    for row in table:
+        lines.append(" ".join(f"{row[name]:>{width}.4g}" if table.dtype[name].kind == "f"
+                              else f"{row[name]:>{width}}"
+                              for name, width in zip(names, widths)))
+    return "\n".join(lines)
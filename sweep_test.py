@@ -0,0 +1,56 @@
+"""
+File used to test the problem 3 segmentation sweep against the normal
+problem 3 analysis, on synthetic pages.
+"""
+import numpy as np
+import pytest
+
+import features
+import histogram
+import segmentation
+import sweep
+from segmentation_test import write_stack
+
+
+def analysis_eccentricities(filename):
+    #problem_3 normal mode: feature table filtered to the area bounds
+    table = segmentation.get_feature_table(filename, workers=1)
+    nuclei = features.filter_area(table, segmentation.MIN_AREA, segmentation.MAX_AREA)
+    return nuclei["eccentricity"]
+
+
+def check_matches_analysis(filename, workers):
+    eccentricities = analysis_eccentricities(filename)
+    table = sweep.sweep(filename, workers=workers, chunk_size=2)
+    assert len(table) == 1
+    row = table[0]
+    assert (row["min_area"], row["max_area"]) == (segmentation.MIN_AREA, segmentation.MAX_AREA)
+    assert row["objects"] == len(eccentricities) > 0
+    assert row["eccentricity_mean"] == pytest.approx(eccentricities.mean())
+    assert row["eccentricity_std"] == pytest.approx(eccentricities.std())
+    expected = histogram.StreamingHistogram(sweep.ECCENTRICITY_BINS)
+    expected.add(eccentricities)
+    assert row["eccentricity_median"] == pytest.approx(expected.quantile(0.5))
+
+
+def test_sweep_matches_analysis(tmp_path):
+    filename = write_stack(tmp_path/"stack.tif", 5)
+    for workers in (1, 2):
+        check_matches_analysis(filename, workers)
+
+
+def test_sweep_matches_analysis_large_frames(tmp_path, monkeypatch):
+    #every page goes through the tiled large-frame path in both
+    monkeypatch.setattr(segmentation, "LARGE_FRAME_PIXELS", 1)
+    filename = write_stack(tmp_path/"stack.tif", 3)
+    check_matches_analysis(filename, 1)
+
+
+def test_label_page_threshold_offset():
+    image = np.random.default_rng(0).integers(0, 1000, (64, 64), dtype=np.uint16)
+    threshold = segmentation.page_threshold(image)
+    for offset in (-100, 0, 100):
+        labels = segmentation.label_page(image, offset)
+        assert np.array_equal(labels > 0, image > threshold + offset)
+        assert np.array_equal(segmentation.label_large_page(image, (20, 20),
+                                                            threshold_offset=offset), labels)
@@ -0,0 +1,139 @@
+"""
+Module that contains a lightweight call tracer used to find where time goes
+in the acquisition scripts. It records per-call latency histograms and a
+timeline that can be exported as a Chrome trace (open in chrome://tracing or
+https://ui.perfetto.dev).
+"""
+import functools
+import json
+import math
+import os
+import threading
+import time
+from collections.abc import Callable
+
+#latency histogram bins are log spaced from 1 us, with BINS_PER_DECADE bins
+#per factor of 10. Last bin holds everything above 1000 s.
+BINS_PER_DECADE = 20
+NUM_BINS = 9*BINS_PER_DECADE + 1
+
+
+class _CallStats():
+    """
+    latency statistics of one traced name.
+    """
+    def __init__(self):
+        self.count = 0
+        self.total_ns = 0
+        self.max_ns = 0
+        self.histogram = [0]*NUM_BINS
+
+    def add(self, duration_ns):
+        self.count += 1
+        self.total_ns += duration_ns
+        self.max_ns = max(self.max_ns, duration_ns)
+        if duration_ns < 1000:
+            bin_num = 0
+        else:
+            bin_num = min(int(math.log10(duration_ns/1000)*BINS_PER_DECADE), NUM_BINS - 1)
+        self.histogram[bin_num] += 1
+
+    def percentile(self, fraction):
+        """
+        returns upper edge of the histogram bin holding the given fraction
+        of calls, in ns.
+        """
+        target = fraction*self.count
+        cumulative = 0
+        for bin_num, count in enumerate(self.histogram):
+            cumulative += count
+            if cumulative >= target:
+                return min(1000*10**((bin_num + 1)/BINS_PER_DECADE), self.max_ns)
+        return self.max_ns
+
+
+class Tracer():
+    """
+    Records the latency of traced calls. Every call adds to a log-binned
+    latency histogram for its name, and (up to max_events) to a timeline for
+    the Chrome trace. Recording a call costs about a microsecond.
+
+    ## Methods:
+
+    #### wrap(fn: Callable, name: str) -> Callable
+        returns fn wrapped so that every call is recorded under name.
+
+    #### span(name: str)
+        context manager that records the time spent in it under name.
+
+    #### record(name: str, start_ns: int, end_ns: int)
+        records a call that ran from start_ns to end_ns (time.perf_counter_ns).
+
+    #### summary() -> str
+        returns table of count, total, mean, p50, p90, p99 and max latency
+        for every traced name.
+
+    #### save_chrome_trace(path: str)
+        saves timeline as Chrome trace JSON.
+    """
+    def __init__(self, max_events: int = 1_000_000):
+        self.stats = {}
+        self.max_events = max_events
+        self._events = []
+        self._lock = threading.Lock()
+
+    def record(self, name, start_ns, end_ns):
+        #lock is needed since datastore writes are traced on writer threads
+        with self._lock:
+            if name not in self.stats:
+                self.stats[name] = _CallStats()
+            self.stats[name].add(end_ns - start_ns)
+            if len(self._events) < self.max_events:
+                self._events.append((name, start_ns, end_ns, threading.get_ident()))
+
+    def wrap(self, fn: Callable, name: str) -> Callable:
+        @functools.wraps(fn)
+        def traced(*args, **kwargs):
+            start = time.perf_counter_ns()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.record(name, start, time.perf_counter_ns())
+        return traced
+
+    def span(self, name: str):
+        return _Span(self, name)
+
+    def summary(self) -> str:
+        header = (f"{'name':<36} {'count':>8} {'total ms':>10} {'mean ms':>9} "
+                  f"{'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+        lines = [header]
+        by_total = sorted(self.stats.items(), key=lambda item: -item[1].total_ns)
+        for name, stats in by_total:
+            values = [stats.total_ns, stats.total_ns/stats.count, stats.percentile(0.5),
+                      stats.percentile(0.9), stats.percentile(0.99), stats.max_ns]
+            lines.append(f"{name:<36} {stats.count:>8} {values[0]/1e6:>10.1f} "
+                         + " ".join(f"{value/1e6:>9.3f}" for value in values[1:]))
+        return "\n".join(lines)
+
+    def save_chrome_trace(self, path: str):
+        pid = os.getpid()
+        with self._lock:
+            events = [{"name": name, "ph": "X", "pid": pid, "tid": thread,
+                       "ts": start/1000, "dur": (end - start)/1000}
+                      for name, start, end, thread in self._events]
+        with open(path, "w") as file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, file)
+
+
+class _Span():
+    def __init__(self, tracer, name):
+        self._tracer = tracer
+        self._name = name
+
+    def __enter__(self):
+        self._start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *args):
+        self._tracer.record(self._name, self._start, time.perf_counter_ns())
@@ -0,0 +1,121 @@
+"""
+File used to test tracing.Tracer latency histograms, span and wrapped call
+recording and the Chrome trace export.
+"""
+import json
+import threading
+import time
+
+import pytest
+
+import tracing
+
+
+def test_histogram_binning():
+    stats = tracing._CallStats()
+    #below 1 us, at 1 us, 2 us, 10 us, 1000 s and above
+    for duration_ns in (500, 1000, 2000, 10_000, 10**12, 10**14):
+        stats.add(duration_ns)
+    assert stats.count == 6
+    assert stats.total_ns == 500 + 1000 + 2000 + 10_000 + 10**12 + 10**14
+    assert stats.max_ns == 10**14
+    nonzero = {bin_num: count for bin_num, count in enumerate(stats.histogram) if count}
+    assert nonzero == {0: 2, 6: 1, tracing.BINS_PER_DECADE: 1, tracing.NUM_BINS - 1: 2}
+
+
+def test_percentile():
+    stats = tracing._CallStats()
+    for _ in range(99):
+        stats.add(2000)
+    #upper bin edge, but never above the slowest call
+    assert stats.percentile(0.5) == 2000
+    stats.add(1_000_000)
+    bin_edge = 1000*10**(7/tracing.BINS_PER_DECADE)
+    assert stats.percentile(0.5) == pytest.approx(bin_edge)
+    assert stats.percentile(0.99) == pytest.approx(bin_edge)
+    assert stats.percentile(1) == 1_000_000
+
+
+def test_span_nesting():
+    tracer = tracing.Tracer()
+    with tracer.span("outer"):
+        for _ in range(3):
+            with tracer.span("inner"):
+                time.sleep(0.001)
+    assert tracer.stats["outer"].count == 1
+    assert tracer.stats["inner"].count == 3
+    assert tracer.stats["inner"].max_ns >= 1_000_000
+    assert tracer.stats["outer"].total_ns >= tracer.stats["inner"].total_ns
+    #inner spans finish first and lie within the outer span
+    names = [event[0] for event in tracer._events]
+    assert names == ["inner"]*3 + ["outer"]
+    _, outer_start, outer_end, _ = tracer._events[-1]
+    inner_spans = [(start, end) for _, start, end, _ in tracer._events[:3]]
+    assert all(outer_start <= start <= end <= outer_end for start, end in inner_spans)
+    assert all(end <= start for (_, end), (start, _) in zip(inner_spans, inner_spans[1:]))
+
+
+def test_wrap():
+    tracer = tracing.Tracer()
+
+    def snap(fail=False):
+        """takes a picture"""
+        if fail:
+            raise OSError("camera timed out")
+        return 42
+
+    traced = tracer.wrap(snap, "core.snapImage")
+    assert traced.__name__ == "snap" and traced.__doc__ == "takes a picture"
+    assert traced() == 42
+    #failed calls are recorded too
+    with pytest.raises(OSError):
+        traced(fail=True)
+    assert tracer.stats["core.snapImage"].count == 2
+    summary = tracer.summary().splitlines()
+    assert summary[0].split()[:3] == ["name", "count", "total"]
+    assert summary[1].split()[:2] == ["core.snapImage", "2"]
+
+
+def test_max_events():
+    tracer = tracing.Tracer(max_events=5)
+    for num in range(10):
+        tracer.record("call", num*1000, num*1000 + 500)
+    #histograms keep counting after the timeline is full
+    assert tracer.stats["call"].count == 10
+    assert len(tracer._events) == 5
+
+
+def test_chrome_trace(tmp_path):
+    tracer = tracing.Tracer()
+
+    def write():
+        with tracer.span("write"):
+            pass
+
+    with tracer.span("acquisition"):
+        with tracer.span("snap"):
+            pass
+        thread = threading.Thread(target=write)
+        thread.start()
+        thread.join()
+    tracer.record("manual", 2_000_000, 5_000_000)
+    path = str(tmp_path/"trace.json")
+    tracer.save_chrome_trace(path)
+    with open(path) as file:
+        trace = json.load(file)
+    assert trace["displayTimeUnit"] == "ms"
+    trace_events = trace["traceEvents"]
+    assert [event["name"] for event in trace_events] == ["snap", "write", "acquisition",
+                                                         "manual"]
+    for event in trace_events:
+        assert set(event) == {"name", "ph", "pid", "tid", "ts", "dur"}
+        #complete events, in us
+        assert event["ph"] == "X"
+        assert event["dur"] >= 0
+    assert trace_events[-1]["ts"] == 2000 and trace_events[-1]["dur"] == 3000
+    assert len({event["pid"] for event in trace_events}) == 1
+    #spans from the writer thread get their own track
+    snap, write, acquisition, _ = trace_events
+    assert write["tid"] != acquisition["tid"] == snap["tid"]
+    assert acquisition["ts"] <= snap["ts"]
+    assert snap["ts"] + snap["dur"] <= acquisition["ts"] + acquisition["dur"]
@@ -1,30 +1,244 @@
 """
 Module that contains utility functions.
 """
+import time
 
-def get_stage_grid_positions(spacing: float = 500, grid_shape: tuple[int, int] = (3,3)
-                     ) -> list[tuple[float, float]]:
+import numpy as np
+from scipy.spatial import cKDTree
+
+
+def get_stage_grid_positions(spacing: float = 500, grid_shape: tuple[int, int] = (3,3),
+                             overlap: float = 0) -> list[tuple[float, float]]:
     """
     Creates list of stage positions as (x, y) tuples with given spacing on a
-    grid of given shape.
+    grid of given shape, centered on (0, 0). Positions are in serpentine
+    order. See plan_stage_path() to order positions by travel time instead.
 
     Parameters:
 
     spacing: float
-        Space between adjacent grid points in um.
-    
+        Space between adjacent grid points in um. If overlap is given, this
+        is the tile size (field of view) instead.
+
     grid_shape: tuple[int, int]
         Desired shape of grid. Shape should be (rows, columns) as per array
         shape convention.
-    
+
+    overlap: float
+        Fraction of tile size adjacent tiles overlap by, so grid points are
+        spacing*(1 - overlap) apart.
+
     """
+    step = spacing*(1 - overlap)
+    #offsets center grid on 0 for any shape
+    x_offset = (grid_shape[1] - 1)/2
+    y_offset = (grid_shape[0] - 1)/2
     positions = []
     for x_coord in range(grid_shape[1]):
-        x_pos = (x_coord - 1)*spacing
+        x_pos = (x_coord - x_offset)*step
         for y_coord in range(grid_shape[0]):
-            y_pos = (y_coord - 1)*spacing
+            y_pos = (y_coord - y_offset)*step
             #Serpentine stage movement (obviously doesn't matter for virtual stage)
             if x_coord % 2 == 0:
-                y_pos = -y_pos
+                y_pos = (y_offset - y_coord)*step
             positions.append((x_pos, y_pos))
     return positions
+
+
+def _move_times(from_xy, to_xy, speed, settle):
+    #axes move at the same time, and an axis only settles if it moved
+    delta = np.abs(np.asarray(to_xy, float) - np.asarray(from_xy, float))
+    axis_times = delta/speed + np.where(delta > 0, settle, 0)
+    return axis_times.max(axis=-1)
+
+
+def get_travel_time(positions: list[tuple[float, float]],
+                    speed: tuple[float, float] = (1000, 1000),
+                    settle: tuple[float, float] = (0, 0)) -> float:
+    """
+    Estimates time in seconds to visit positions in order. Both axes move
+    at the same time, and each axis that moves has to settle, so a move
+    takes max(|dx|/x_speed + x_settle, |dy|/y_speed + y_settle).
+
+    Parameters:
+
+    positions: list[tuple[float, float]]
+        (x, y) stage positions in um.
+
+    speed: tuple[float, float]
+        (x, y) stage speeds in um/s.
+
+    settle: tuple[float, float]
+        (x, y) settle times in s after a move on that axis.
+    """
+    if len(positions) < 2:
+        return 0.
+    positions = np.asarray(positions, float)
+    return float(_move_times(positions[:-1], positions[1:], speed, settle).sum())
+
+
+def _nearest_neighbor_order(points, tree, scale, speed, settle, start):
+    num_points = len(points)
+    visited = np.zeros(num_points, bool)
+    order = [start]
+    visited[start] = True
+    k = min(16, num_points)
+    for _ in range(num_points - 1):
+        current = order[-1]
+        #tree gives candidates in scaled chebyshev distance, which is travel
+        #time without settle. Exact cost picks between them.
+        _, candidates = tree.query(points[current]*scale, k, p=np.inf)
+        candidates = candidates[~visited[candidates]]
+        if not len(candidates):
+            candidates = np.flatnonzero(~visited)
+        costs = _move_times(points[current], points[candidates], speed, settle)
+        next_point = candidates[np.argmin(costs)]
+        order.append(next_point)
+        visited[next_point] = True
+    return order
+
+
+def _sweep_orders(points):
+    #serpentine orders through rows or columns of positions with the same
+    #coordinate (as get_stage_grid_positions() orders grids), from each
+    #corner. Only useful for grids and subsets of grids.
+    orders = []
+    for band_axis in (0, 1):
+        along = points[:, 1 - band_axis]
+        for band_sign in (1, -1):
+            band_nums = np.unique(band_sign*np.round(points[:, band_axis], 6),
+                                  return_inverse=True)[1]
+            for along_sign in (1, -1):
+                direction = np.where(band_nums % 2 == 0, along_sign, -along_sign)
+                #lexsort sorts by its last key first
+                orders.append(np.lexsort((direction*along, band_nums)).tolist())
+    return orders
+
+
+def _two_opt(order, points, neighbors, speed, settle, max_seconds):
+    #2-opt on an open path using neighbor lists. The first position stays
+    #first. Reversing order[i+1:j+1] replaces edges (a, b) and (c, d) with
+    #(a, c) and (b, d).
+    xs, ys = points[:, 0].tolist(), points[:, 1].tolist()
+    x_speed, y_speed = speed
+    x_settle, y_settle = settle
+
+    def cost(p, q):
+        if p is None or q is None:
+            return 0.
+        dx, dy = abs(xs[p] - xs[q]), abs(ys[p] - ys[q])
+        return max(dx/x_speed + (x_settle if dx else 0),
+                   dy/y_speed + (y_settle if dy else 0))
+
+    num_points = len(order)
+    index = [0]*num_points
+    for i, point in enumerate(order):
+        index[point] = i
+    deadline = time.perf_counter() + max_seconds
+    improved = True
+    while improved and time.perf_counter() < deadline:
+        improved = False
+        for i in range(num_points - 1):
+            a, b = order[i], order[i + 1]
+            cost_ab = cost(a, b)
+            for c in neighbors[a]:
+                cost_ac = cost(a, c)
+                if cost_ac >= cost_ab:
+                    break
+                j = index[c]
+                if abs(j - i) < 2:
+                    continue
+                d = order[j + 1] if j + 1 < num_points else None
+                if j > i:
+                    gain = cost_ab + cost(c, d) - cost_ac - cost(b, d)
+                    start, stop = i + 1, j
+                else:
+                    #with c before a, reversing order[j+1:i+1] joins c to a
+                    #and d to b. c can be the first position, which stays
+                    #first.
+                    gain = cost_ab + cost(c, d) - cost_ac - cost(d, b)
+                    start, stop = j + 1, i
+                if gain > 1e-12:
+                    order[start:stop + 1] = order[start:stop + 1][::-1]
+                    for k in range(start, stop + 1):
+                        index[order[k]] = k
+                    improved = True
+                    a, b = order[i], order[i + 1]
+                    cost_ab = cost(a, b)
+                    break
+    return order
+
+
+def plan_stage_path(positions: list[tuple[float, float]],
+                    speed: tuple[float, float] = (1000, 1000),
+                    settle: tuple[float, float] = (0, 0),
+                    start: int = 0, num_neighbors: int = 8,
+                    max_seconds: float = 10, sweeps: bool = True
+                    ) -> tuple[list[tuple[float, float]], float]:
+    """
+    Orders stage positions to minimize estimated travel time (see
+    get_travel_time() for the cost model) and returns (ordered positions,
+    estimated travel time in s). Works with any set of positions (grids of
+    any shape, with overlap, or irregular/sparse sets) and scales to tens of
+    thousands of positions.
+
+    The path starts as the faster of nearest neighbor and serpentine sweeps
+    of rows or columns (for grids and subsets of grids) from start, and is
+    improved with 2-opt moves limited to each position's nearest neighbors,
+    so it's never slower than a serpentine from start. If positions are 
+    already in a better order, that order is returned.
+
+    Parameters:
+
+    positions: list[tuple[float, float]]
+        (x, y) stage positions in um.
+
+    speed: tuple[float, float]
+        (x, y) stage speeds in um/s.
+
+    settle: tuple[float, float]
+        (x, y) settle times in s after a move on that axis.
+
+    start: int
+        Index of position the path starts at (e.g. the position closest to
+        the current stage position).
+
+    num_neighbors: int
+        Number of nearest positions considered for each 2-opt move.
+
+    max_seconds: float
+        Time limit for 2-opt improvement.
+
+    sweeps: bool
+        Whether serpentine sweeps are tried as the starting path. Otherwise
+        it's nearest neighbor only.
+    """
+    positions = [tuple(pos) for pos in positions]
+    given_time = get_travel_time(positions, speed, settle)
+    if len(positions) < 3:
+        #any order from start is as good
+        planned = positions[start:start + 1] + positions[:start] + positions[start + 1:]
+        return planned, get_travel_time(planned, speed, settle)
+    points = np.asarray(positions, float)
+    speed = tuple(float(s) for s in speed)
+    settle = tuple(float(s) for s in settle)
+    scale = 1/np.asarray(speed)
+    tree = cKDTree(points*scale)
+    seeds = [_nearest_neighbor_order(points, tree, scale, speed, settle, start)]
+    if sweeps:
+        seeds += [order for order in _sweep_orders(points) if order[0] == start]
+    order = min(seeds, key=lambda order: get_travel_time(points[order], speed, settle))
+    k = min(num_neighbors + 1, len(positions))
+    _, neighbors = tree.query(points*scale, k, p=np.inf)
+    #neighbor lists sorted by exact cost so 2-opt can stop early
+    costs = _move_times(points[:, None], points[neighbors], speed, settle)
+    costs[neighbors == np.arange(len(points))[:, None]] = np.inf
+    sort = np.argsort(costs, axis=1, kind="stable")
+    neighbors = np.take_along_axis(neighbors, sort, axis=1)[:, :-1].tolist()
+    order = _two_opt(order, points, neighbors, speed, settle, max_seconds)
+    planned = [positions[point] for point in order]
+    planned_time = get_travel_time(planned, speed, settle)
+    #given order is only kept if it starts at the same position
+    if given_time <= planned_time and start == 0:
+        return positions, given_time
+    return planned, planned_time
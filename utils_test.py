@@ -0,0 +1,68 @@
+"""
+File used to test stage grid generation and stage path planning.
+"""
+import numpy as np
+import pytest
+
+import utils
+
+#slow x axis, so orders that move along y are cheaper
+SPEED, SETTLE = (500, 2000), (0.01, 0.005)
+
+
+def position_sets():
+    rng = np.random.default_rng(0)
+    grid = utils.get_stage_grid_positions(grid_shape=(12, 15))
+    overlap = utils.get_stage_grid_positions(1000, (9, 7), overlap=0.2)
+    #sparse set keeps the serpentine order of the grid it's taken from
+    big_grid = utils.get_stage_grid_positions(grid_shape=(30, 30))
+    sparse = [big_grid[num] for num in sorted(rng.choice(len(big_grid), 150, replace=False))]
+    scattered = [tuple(pos) for pos in rng.uniform(-5000, 5000, (200, 2))]
+    return {"grid": grid, "overlap": overlap, "sparse": sparse, "scattered": scattered}
+
+
+@pytest.mark.parametrize("name", ["grid", "overlap", "sparse", "scattered"])
+def test_plan_stage_path(name):
+    positions = position_sets()[name]
+    serpentine_time = utils.get_travel_time(positions, SPEED, SETTLE)
+    shuffled = [positions[num] for num in np.random.default_rng(1).permutation(len(positions))]
+    #both start where the serpentine does
+    for given in (positions, shuffled):
+        start = given.index(positions[0])
+        planned, planned_time = utils.plan_stage_path(given, SPEED, SETTLE, start)
+        assert sorted(planned) == sorted(positions)
+        assert planned[0] == positions[0]
+        assert planned_time == pytest.approx(utils.get_travel_time(planned, SPEED, SETTLE))
+        if name != "scattered":
+            assert planned_time <= serpentine_time + 1e-9
+
+
+@pytest.mark.parametrize("num_positions", [1, 2, 3, 4, 50])
+def test_plan_stage_path_start(num_positions):
+    positions = [tuple(pos) for pos in
+                 np.random.default_rng(num_positions).uniform(0, 1000, (num_positions, 2))]
+    for start in range(min(num_positions, 4)):
+        planned, planned_time = utils.plan_stage_path(positions, SPEED, SETTLE, start)
+        assert planned[0] == positions[start]
+        assert sorted(planned) == sorted(positions)
+        assert planned_time == pytest.approx(utils.get_travel_time(planned, SPEED, SETTLE))
+
+
+def test_two_opt_first_edge():
+    #0 -> 3 -> 2 -> 1 -> 4 becomes 0 -> 1 -> 2 -> 3 -> 4 by reversing
+    #order[1:4], which replaces the first edge. Position 0's neighbor list
+    #doesn't have 1, so the move is only found from position 1, with the
+    #first position as its neighbor.
+    points = np.array([(0, 0), (1, 0), (2, 0), (3, 0), (4, 0)], float)
+    neighbors = [[4], [0, 2, 3, 4], [1, 3, 0, 4], [2, 4, 1, 0], [3, 2, 1, 0]]
+    order = utils._two_opt([0, 3, 2, 1, 4], points, neighbors, (1, 1), (0, 0), 10)
+    assert order == [0, 1, 2, 3, 4]
+
+
+def test_get_travel_time():
+    assert utils.get_travel_time([]) == utils.get_travel_time([(1, 1)]) == 0
+    #axes move at once, and only an axis that moves settles
+    assert utils.get_travel_time([(0, 0), (1000, 500)], (1000, 1000), (0.1, 0.2)) \
+        == pytest.approx(max(1 + 0.1, 0.5 + 0.2))
+    assert utils.get_travel_time([(0, 0), (1000, 0)], (1000, 1000), (0.1, 0.2)) \
+        == pytest.approx(1.1)
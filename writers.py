@@ -0,0 +1,357 @@
+"""
+Module that contains a Python-side NDTiff writer, used by script-style
+acquisitions (see problem_1_script) to save frames pulled off the core as
+NumPy arrays directly, so pixels only cross the bridge once instead of going
+back to a Micro-Manager datastore.
+
+Datasets are written in the NDTiff v3 layout that pycromanager Acquisition
+saves (see readers.NDTiffReader): a folder with NDTiff.index and one or more
+_NDTiffStack.tif files, which are also valid TIFF files. Images can
+optionally be compressed (see compressors module), which ndtiff can't read,
+so compressed datasets are only readable by readers.NDTiffReader.
+"""
+import json
+import os
+import struct
+import threading
+from datetime import datetime
+
+import numpy as np
+
+import compressors
+
+NDTIFF_INDEX = "NDTiff.index"
+#index of compressed datasets. ndtiff ignores the pixel compression of index
+#entries and would read compressed bytes as pixels, so the index has another
+#name and ndtiff (and pycromanager Dataset) can't open these datasets at all.
+COMPRESSED_NDTIFF_INDEX = "NDTiff.compressed.index"
+MAJOR_VERSION = 3
+MINOR_VERSION = 2
+SUMMARY_MD_HEADER = 2355492
+#offsets are uint32, so a new file is started before one reaches 4 GB
+MAX_FILE_SIZE = 2**32 - 1
+#files are preallocated in steps of this many bytes
+PREALLOCATE_BYTES = 256*2**20
+#NDTiff pixel types by dtype
+PIXEL_TYPES = {np.dtype(np.uint8): 0, np.dtype(np.uint16): 1}
+#Micro-Manager image metadata TIFF tag
+MM_METADATA_TAG = 51123
+#TIFF field types
+_SHORT = 3
+_LONG = 4
+_ASCII = 2
+_NUM_IFD_ENTRIES = 10
+_IFD_SIZE = 2 + 12*_NUM_IFD_ENTRIES + 4
+
+
+class SummaryMetadataBuilder():
+    """
+    Python equivalent of pycro.SummaryMetadataBuilder for NDTiffWriter. Same
+    methods, axis order rules and defaults, but build() returns the summary
+    metadata as a dict with Micro-Manager's JSON keys instead of a Java
+    object.
+
+    ## Methods:
+
+    every method returns self, except for build() which returns a dict.
+
+    #### channel_list(channels: list | tuple | str)
+
+    #### z(num_z: int)
+
+    #### t(num_t: int)
+
+    #### p(num_p: int)
+
+    #### step(step_size: float)
+
+    #### interval_ms(interval_ms: float)
+
+    #### build() -> dict
+    """
+    #axis names used in NDTiff axes and AxisOrder
+    _AXES = {"c": "channel", "z": "z", "t": "time", "p": "position"}
+
+    def __init__(self):
+        self._axis_order = []
+        self._intended = {"channel": 1, "z": 1, "time": 1, "position": 1}
+        self._summary = {"ChNames": [], "z-step_um": 0., "WaitInterval": 0.}
+
+    def channel_list(self, channels):
+        self._axis_order.append("channel")
+        channels = [channels] if isinstance(channels, str) else list(channels)
+        self._intended["channel"] = len(channels)
+        self._summary["ChNames"] = channels
+        return self
+
+    def z(self, num_z):
+        self._axis_order.append("z")
+        self._intended["z"] = num_z
+        return self
+
+    def t(self, num_t):
+        self._axis_order.append("time")
+        self._intended["time"] = num_t
+        return self
+
+    def p(self, num_p):
+        self._axis_order.append("position")
+        self._intended["position"] = num_p
+        return self
+
+    def step(self, step_size):
+        self._summary["z-step_um"] = step_size
+        return self
+
+    def interval_ms(self, interval_ms):
+        self._summary["WaitInterval"] = interval_ms
+        return self
+
+    def build(self) -> dict:
+        #default order is cztp, so added in this order if not already added
+        axis_order = self._axis_order + [axis for axis in self._AXES.values()
+                                         if axis not in self._axis_order]
+        return {**self._summary,
+                "AxisOrder": axis_order,
+                "IntendedDimensions": dict(self._intended),
+                "Channels": self._intended["channel"],
+                "Slices": self._intended["z"],
+                "Frames": self._intended["time"],
+                "Positions": self._intended["position"],
+                "StartTime": str(datetime.now())}
+
+
+def unique_path(directory: str, name: str) -> str:
+    """
+    returns path of the first of directory/name_1, directory/name_2, ... that
+    doesn't exist, like pycromanager Acquisition names its datasets.
+    """
+    num = 1
+    while os.path.exists(os.path.join(directory, f"{name}_{num}")):
+        num += 1
+    return os.path.join(directory, f"{name}_{num}")
+
+
+def _ifd(width, height, bits, compression, rows_per_strip, num_strips,
+         strip_offsets, strip_byte_counts, metadata_offset, metadata_length, next_ifd):
+    #classic little endian TIFF IFD with entries sorted by tag. With more
+    #than one strip, strip_offsets and strip_byte_counts are offsets of their
+    #arrays instead of the values.
+    entries = [(256, _LONG, 1, width),
+               (257, _LONG, 1, height),
+               (258, _SHORT, 1, bits),
+               (259, _SHORT, 1, compression),
+               (262, _SHORT, 1, 1),
+               (273, _LONG, num_strips, strip_offsets),
+               (277, _SHORT, 1, 1),
+               (278, _LONG, 1, rows_per_strip),
+               (279, _LONG, num_strips, strip_byte_counts),
+               (MM_METADATA_TAG, _ASCII, metadata_length, metadata_offset)]
+    return (struct.pack("<H", len(entries))
+            + b"".join(struct.pack("<HHII", *entry) for entry in entries)
+            + struct.pack("<I", next_ifd))
+
+
+class NDTiffWriter():
+    """
+    Writes images to an NDTiff dataset in folder path from NumPy arrays, with
+    the same put_image()/close() interface as pycro.MultipageDatastore, so it
+    can be wrapped in pycro.WriteBehindDatastore.
+
+    Data files are append only: each image is written as its TIFF IFD,
+    pixels and JSON metadata in one pass, and its entry is appended to the
+    index right away, so the dataset can be read while it's written. Files
+    are preallocated in preallocate_bytes steps to keep them contiguous on
+    disk, trimmed to size on close(), and a new file is started before one
+    reaches 4 GB. Pixels are written straight from the array without a copy.
+
+    Summary metadata (a dict, see SummaryMetadataBuilder) must be set before
+    the first image. PixelType, Width and Height are added from the first
+    image.
+
+    If compression is a codec name (see compressors.CODECS), images are
+    compressed in strips on a thread pool before they're written, at
+    compression_level (None for the codec's default). Compressed images are
+    standard compressed TIFF pages, with the TIFF compression value in the
+    index entry's pixel compression and the pixel offset pointing at a strip
+    table: uint32 strip count and rows per strip, then uint32 compressed size
+    of each strip, then the strips. The index is saved as
+    COMPRESSED_NDTIFF_INDEX, so ndtiff refuses the dataset instead of
+    returning compressed bytes as pixels. readers.NDTiffReader and tifffile
+    read them.
+
+    ## Methods:
+
+    #### put_image(pixels: np.ndarray, axes: dict, metadata: dict = None)
+        writes 2D uint8 or uint16 image with axes, e.g. {"channel": "DAPI",
+        "z": 3}, and image metadata (e.g. tags of the core's tagged image).
+
+    #### set_summary_metadata(summary_metadata: dict)
+
+    #### freeze()
+        no more images can be put, like freezing a Micro-Manager datastore.
+
+    #### save()
+        does nothing, since every image is saved when it's put. Only there
+        so the writer can stand in for a Micro-Manager datastore.
+
+    #### close()
+        finishes the last file and closes the dataset. Also called on context
+        manager exit.
+    """
+    def __init__(self, path: str, summary_metadata: dict | None = None,
+                 preallocate_bytes: int = PREALLOCATE_BYTES, compression: str | None = None,
+                 compression_level: int | None = None):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self._name = os.path.basename(os.path.normpath(path))
+        self._summary = dict(summary_metadata or {})
+        self._preallocate_bytes = preallocate_bytes
+        self._codec = compressors.get_codec(compression) if compression else None
+        self._compression_level = compression_level
+        index_name = COMPRESSED_NDTIFF_INDEX if self._codec else NDTIFF_INDEX
+        self._index = open(os.path.join(path, index_name), "wb")
+        self._file = None
+        self._file_num = 0
+        self._lock = threading.Lock()
+        self._frozen = False
+        self.num_images = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def set_summary_metadata(self, summary_metadata: dict):
+        if self._file:
+            raise RuntimeError("summary metadata must be set before the first image")
+        self._summary = dict(summary_metadata)
+
+    def freeze(self):
+        self._frozen = True
+
+    def save(self):
+        pass
+
+    def _open_file(self):
+        suffix = f"_{self._file_num}" if self._file_num else ""
+        self._filename = f"{self._name}_NDTiffStack{suffix}.tif"
+        self._file_num += 1
+        self._file = open(os.path.join(self.path, self._filename), "wb", buffering=0)
+        self._allocated = 0
+        summary = json.dumps(self._summary).encode()
+        first_ifd = 28 + len(summary) + len(summary) % 2
+        header = (b"II" + struct.pack("<HII", 42, first_ifd, 0)
+                  + struct.pack("<IIII", MAJOR_VERSION, MINOR_VERSION,
+                                SUMMARY_MD_HEADER, len(summary))
+                  + summary + b"\0"*(len(summary) % 2))
+        self._write(header)
+        #offset of the last IFD's next IFD pointer, set to 0 when the file is
+        #finished
+        self._last_ifd_next = None
+
+    def _write(self, *chunks):
+        chunks = [memoryview(chunk).cast("B") for chunk in chunks]
+        position = self._file.tell()
+        end = position + sum(len(chunk) for chunk in chunks)
+        if end > self._allocated:
+            self._allocated = end + self._preallocate_bytes
+            if hasattr(os, "posix_fallocate"):
+                os.posix_fallocate(self._file.fileno(), position, self._allocated - position)
+            else:
+                self._file.truncate(self._allocated)
+        for chunk in chunks:
+            #unbuffered writes can be partial
+            while chunk:
+                chunk = chunk[self._file.write(chunk):]
+
+    def _finish_file(self):
+        end = self._file.tell()
+        if self._last_ifd_next is not None:
+            self._file.seek(self._last_ifd_next)
+            self._file.write(struct.pack("<I", 0))
+        self._file.truncate(end)
+        self._file.close()
+        self._file = None
+
+    def put_image(self, pixels: np.ndarray, axes: dict, metadata: dict | None = None):
+        if self._frozen:
+            raise RuntimeError("can't put images after freeze()")
+        pixels = np.ascontiguousarray(pixels)
+        if pixels.dtype not in PIXEL_TYPES or pixels.ndim != 2:
+            raise ValueError(f"images must be 2D uint8 or uint16, not {pixels.ndim}D "
+                             f"{pixels.dtype}")
+        height, width = pixels.shape
+        #axes of pycromanager events can be NumPy integers
+        axes = {axis: value if isinstance(value, str) else int(value)
+                for axis, value in axes.items()}
+        axes_json = json.dumps(axes).encode()
+        metadata = json.dumps({**(metadata or {}), "Axes": axes}, default=str).encode()
+        if self._codec:
+            #compressed before taking the lock, so images put from different
+            #threads are compressed in parallel
+            strip_rows, strips = compressors.encode_strips(pixels, self._codec,
+                                                           self._compression_level)
+            strip_sizes = [len(strip) for strip in strips]
+            #offsets array (if more than 1 strip) and strip table
+            num_strips = len(strips)
+            offsets_size = 4*num_strips if num_strips > 1 else 0
+            pixel_chunks = [struct.pack(f"<II{num_strips}I", num_strips, strip_rows,
+                                        *strip_sizes)] + strips
+            pixel_bytes = offsets_size + sum(len(chunk) for chunk in pixel_chunks)
+        else:
+            pixel_bytes = pixels.nbytes
+        #IFD, pixels and NUL terminated metadata, padded to an even size so
+        #every IFD starts on a word boundary as TIFF requires
+        size = _IFD_SIZE + pixel_bytes + len(metadata) + 1
+        padding = b"\0"*(1 + size % 2)
+        size += size % 2
+        with self._lock:
+            if not self._file:
+                self._summary.setdefault("PixelType", f"GRAY{8*pixels.itemsize}")
+                self._summary.setdefault("Width", width)
+                self._summary.setdefault("Height", height)
+                self._open_file()
+            elif self._file.tell() + size > MAX_FILE_SIZE:
+                self._finish_file()
+                self._open_file()
+            ifd_offset = self._file.tell()
+            metadata_offset = ifd_offset + _IFD_SIZE + pixel_bytes
+            if self._codec:
+                offsets_offset = ifd_offset + _IFD_SIZE
+                pixel_offset = offsets_offset + offsets_size
+                strip_offsets = np.cumsum([pixel_offset + len(pixel_chunks[0])]
+                                          + strip_sizes[:-1])
+                if num_strips > 1:
+                    pixel_chunks.insert(0, struct.pack(f"<{num_strips}I", *strip_offsets))
+                    strip_offsets, byte_counts = offsets_offset, pixel_offset + 8
+                else:
+                    strip_offsets, byte_counts = int(strip_offsets[0]), strip_sizes[0]
+                ifd = _ifd(width, height, 8*pixels.itemsize, self._codec.tiff_compression,
+                           strip_rows, num_strips, strip_offsets, byte_counts,
+                           metadata_offset, len(metadata) + 1, ifd_offset + size)
+                compression = self._codec.tiff_compression
+            else:
+                pixel_offset = ifd_offset + _IFD_SIZE
+                pixel_chunks = [pixels.data]
+                ifd = _ifd(width, height, 8*pixels.itemsize, 1, height, 1, pixel_offset,
+                           pixels.nbytes, metadata_offset, len(metadata) + 1,
+                           ifd_offset + size)
+                compression = 0
+            self._write(ifd, *pixel_chunks, metadata, padding)
+            self._last_ifd_next = ifd_offset + _IFD_SIZE - 4
+            filename = self._filename.encode()
+            self._index.write(struct.pack("<I", len(axes_json)) + axes_json
+                              + struct.pack("<I", len(filename)) + filename
+                              + struct.pack("<8I", pixel_offset, width, height,
+                                            PIXEL_TYPES[pixels.dtype], compression,
+                                            metadata_offset, len(metadata), 0))
+            self._index.flush()
+            self.num_images += 1
+
+    def close(self):
+        with self._lock:
+            if self._file:
+                self._finish_file()
+            self._index.close()
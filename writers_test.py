@@ -0,0 +1,114 @@
+"""
+File used to test that NDTiff datasets written with writers.NDTiffWriter,
+compressed or not, read back with ndtiff, readers.NDTiffReader and tifffile.
+"""
+import contextlib
+import io
+import os
+
+import ndtiff
+import numpy as np
+import pytest
+import tifffile
+
+import compressors
+import readers
+import writers
+
+
+def make_images(num_images, shape=(40, 60), dtype=np.uint16):
+    rng = np.random.default_rng(0)
+    return [rng.integers(0, np.iinfo(dtype).max, shape, dtype=dtype)
+            for _ in range(num_images)]
+
+
+def image_axes(num):
+    return {"channel": ["DAPI", "FITC"][num % 2], "z": num//2}
+
+
+def read_ndtiff(path, axes_list):
+    #ndtiff prints progress while reading the index
+    with contextlib.redirect_stdout(io.StringIO()):
+        dataset = ndtiff.Dataset(path)
+        try:
+            return [np.array(dataset.read_image(**axes)) for axes in axes_list]
+        finally:
+            dataset.close()
+
+
+@pytest.mark.parametrize("dtype", [np.uint8, np.uint16])
+def test_round_trip(tmp_path, monkeypatch, dtype):
+    images = make_images(7, dtype=dtype)
+    #a new file every 3 images
+    monkeypatch.setattr(writers, "MAX_FILE_SIZE", 3*(images[0].nbytes + 400))
+    path = str(tmp_path/"dataset")
+    with writers.NDTiffWriter(path, {"Prefix": "test"}, preallocate_bytes=4096) as writer:
+        for num, image in enumerate(images):
+            writer.put_image(image, image_axes(num), {"ImageNumber": num})
+    tiff_files = sorted(name for name in os.listdir(path) if name.endswith(".tif"))
+    assert len(tiff_files) == 3
+    axes_list = [image_axes(num) for num in range(len(images))]
+    for read, image in zip(read_ndtiff(path, axes_list), images):
+        assert np.array_equal(read, image)
+    with readers.NDTiffReader(path, axis_order=("z", "channel")) as reader:
+        assert len(reader) == len(images)
+        for num, image in enumerate(images):
+            assert np.array_equal(reader.read_axes(**image_axes(num)), image)
+            assert reader.read_metadata(num)["ImageNumber"] == num
+    #data files are valid TIFF files on their own
+    pages = []
+    for name in tiff_files:
+        with tifffile.TiffFile(os.path.join(path, name)) as tiff:
+            pages.extend(page.asarray() for page in tiff.pages)
+    assert all(np.array_equal(page, image) for page, image in zip(pages, images))
+
+
+def test_freeze(tmp_path):
+    with writers.NDTiffWriter(str(tmp_path/"dataset")) as writer:
+        writer.put_image(make_images(1)[0], {"time": 0})
+        writer.save()
+        writer.freeze()
+        with pytest.raises(RuntimeError):
+            writer.put_image(make_images(1)[0], {"time": 1})
+
+
+@pytest.mark.parametrize("codec", list(compressors.CODECS))
+def test_compressed_round_trip(tmp_path, monkeypatch, codec):
+    #smooth images that compress, in several strips and files
+    images = [np.add.outer(np.arange(600), np.arange(512)).astype(np.uint16) + num
+              for num in range(5)]
+    assert compressors.get_strip_rows(images[0].shape, 2) < 600
+    #a new file for every image
+    monkeypatch.setattr(writers, "MAX_FILE_SIZE", 1)
+    path = str(tmp_path/"dataset")
+    with writers.NDTiffWriter(path, compression=codec) as writer:
+        for num, image in enumerate(images):
+            writer.put_image(image, image_axes(num), {"ImageNumber": num})
+    tiff_files = sorted(name for name in os.listdir(path) if name.endswith(".tif"))
+    assert len(tiff_files) == len(images)
+    assert readers.is_ndtiff(path)
+    with readers.NDTiffReader(path, axis_order=("z", "channel")) as reader:
+        assert len(reader) == len(images)
+        assert all(np.array_equal(read, image) for read, image in zip(reader, images))
+        assert reader.read_metadata(3)["ImageNumber"] == 3
+        assert np.array_equal(reader.as_array(channel="DAPI")[1].compute(), images[2])
+    #ndtiff would return compressed bytes as pixels, so it must refuse
+    with contextlib.redirect_stdout(io.StringIO()), pytest.raises(Exception):
+        ndtiff.Dataset(path)
+    if codec == "zlib":
+        pages = []
+        for name in tiff_files:
+            with tifffile.TiffFile(os.path.join(path, name)) as tiff:
+                pages.extend(page.asarray() for page in tiff.pages)
+        assert all(np.array_equal(page, image) for page, image in zip(pages, images))
+
+
+def test_single_strip_round_trip(tmp_path):
+    image = make_images(1)[0]
+    path = str(tmp_path/"dataset")
+    with writers.NDTiffWriter(path, compression="zlib") as writer:
+        writer.put_image(image, {"time": 0})
+    with readers.NDTiffReader(path) as reader:
+        assert np.array_equal(reader.read(0), image)
+    with tifffile.TiffFile(os.path.join(path, "dataset_NDTiffStack.tif")) as tiff:
+        assert np.array_equal(tiff.pages[0].asarray(), image)